@@ -0,0 +1,42 @@
+"""Run all benchmarks and optionally save results as JSON
+
+Run with `python -m benchmarks [--json results.json]`, and compare two
+saved runs with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+
+from benchmarks import bench_cycles, bench_repos, bench_ria_parser, bench_tickets
+from benchmarks.common import BenchResult, save_results
+
+
+async def run(args: argparse.Namespace) -> list[BenchResult]:
+    results: list[BenchResult] = []
+    results.extend(await bench_ria_parser.run())
+    results.extend(await bench_tickets.run())
+    results.extend(await bench_repos.run(args.redis_url))
+    results.extend(await bench_cycles.run(args.subs))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", type=Path, help="Save results to this file")
+    parser.add_argument("--redis-url", help="Also benchmark Redis repos")
+    parser.add_argument(
+        "--subs",
+        type=bench_cycles.parse_subs_counts,
+        default=bench_cycles.SUBS_COUNTS,
+        help="Comma separated subscription counts for cycle benchmarks",
+    )
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    for result in results:
+        print(result.describe())
+    if args.json is not None:
+        save_results(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Time full car and ticket processing cycles for many subscriptions
+
+Every subscription sees the same fixture page (or set of tickets). The
+"first" cycle finds everything new and queues notifications, the "steady"
+one finds nothing new, which is what most polls look like.
+
+Run with `python -m benchmarks.bench_cycles [--subs 100,1000]`.
+"""
+import argparse
+import asyncio
+import datetime
+from collections.abc import AsyncIterator, Sequence
+
+from benchmarks.bench_repos import load_cars
+from benchmarks.common import BenchResult, bench_async
+from car_lookup_bot.exam_tickets import TickerReaderConf, Ticket
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryCarRepo
+from car_lookup_bot.impls.notification_repo.in_memory_repo import (
+    InMemoryNotificationRepo,
+)
+from car_lookup_bot.impls.subs_repo.in_memory_repo import InMemoryAuctionRepo
+from car_lookup_bot.impls.ticket_repo.in_memory_repo import InMemoryTicketRepo
+from car_lookup_bot.notifications import NotificationDispatcher
+from car_lookup_bot.subscriptions import (
+    CarSubscription,
+    SubscriptionsService,
+    TicketSubscription,
+)
+
+SUBS_COUNTS = (100, 1000, 10000)
+
+TICKETS_CONF = TickerReaderConf(
+    identity="",
+    csrf="",
+    webchsid2="",
+    csrf_header="",
+    office_id="42",
+    date_start=datetime.date(2023, 10, 10),
+    date_end=datetime.date(2023, 10, 16),
+)
+
+
+class FakeTicketReader:
+    def __init__(self, tickets: Sequence[Ticket]) -> None:
+        self._tickets = tickets
+
+    async def get_tickets(self) -> AsyncIterator[Ticket]:
+        for ticket in self._tickets:
+            yield ticket
+
+
+def make_service() -> SubscriptionsService:
+    # Bot is never called, as the dispatcher is not started
+    notifications = NotificationDispatcher(
+        None, InMemoryNotificationRepo()  # type: ignore[arg-type]
+    )
+    return SubscriptionsService(
+        notifications, InMemoryAuctionRepo(), InMemoryCarRepo(), InMemoryTicketRepo()
+    )
+
+
+def make_tickets(count: int) -> list[Ticket]:
+    start = datetime.datetime(2023, 10, 10, 8)
+    return [
+        Ticket(
+            id=str(idx),
+            office_id="42",
+            time=start + datetime.timedelta(minutes=idx),
+        )
+        for idx in range(count)
+    ]
+
+
+async def bench_car_cycles(subs_count: int) -> list[BenchResult]:
+    cars = load_cars()
+    subs = [
+        CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=idx)
+        for idx in range(subs_count)
+    ]
+    service = make_service()
+
+    async def cycle() -> None:
+        for sub in subs:
+            await service._car_process_once(sub, cars)
+
+    async def first_cycle() -> None:
+        nonlocal service
+        service = make_service()
+        await cycle()
+
+    items = subs_count * len(cars)
+    return [
+        await bench_async(
+            "car_cycle", first_cycle, items=items, subs=subs_count, kind="first"
+        ),
+        await bench_async(
+            "car_cycle", cycle, items=items, subs=subs_count, kind="steady"
+        ),
+    ]
+
+
+async def bench_ticket_cycles(subs_count: int) -> list[BenchResult]:
+    reader = FakeTicketReader(make_tickets(20))
+    subs = [
+        TicketSubscription(conf=TICKETS_CONF, chat_id=idx) for idx in range(subs_count)
+    ]
+    service = make_service()
+
+    async def cycle() -> None:
+        for sub in subs:
+            await service._ticket_process_once(sub, reader)  # type: ignore[arg-type]
+
+    async def first_cycle() -> None:
+        nonlocal service
+        service = make_service()
+        await cycle()
+
+    items = subs_count * 20
+    return [
+        await bench_async(
+            "ticket_cycle", first_cycle, items=items, subs=subs_count, kind="first"
+        ),
+        await bench_async(
+            "ticket_cycle", cycle, items=items, subs=subs_count, kind="steady"
+        ),
+    ]
+
+
+async def run(subs_counts: Sequence[int] = SUBS_COUNTS) -> list[BenchResult]:
+    results: list[BenchResult] = []
+    for subs_count in subs_counts:
+        results.extend(await bench_car_cycles(subs_count))
+        results.extend(await bench_ticket_cycles(subs_count))
+    return results
+
+
+def parse_subs_counts(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subs", type=parse_subs_counts, default=SUBS_COUNTS)
+    args = parser.parse_args()
+    for result in asyncio.run(run(args.subs)):
+        print(result.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare dedupe throughput of seen cars repos
+
+Run with `python -m benchmarks.bench_repos [--redis-url URL]`. Redis repo
+is only measured when the url is given, its keys use the "bench" prefix
+and are removed afterwards. SQLite repos use databases in a temporary
+directory.
+"""
+import argparse
+import asyncio
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from redis.asyncio import Redis
+
+from benchmarks.common import FIXTURES_DIR, BenchResult, bench_async
+from car_lookup_bot.car_info_readers import RiaCarRecord, parse_ria_page_stream
+from car_lookup_bot.impls.car_repo.cached_repo import CachedCarRepo
+from car_lookup_bot.impls.car_repo.in_memory_repo import (
+    InMemoryCarRepo,
+    InMemoryWatermarkCarRepo,
+)
+from car_lookup_bot.impls.car_repo.redis_repo import (
+    RedisCarRepo,
+    RedisWatermarkCarRepo,
+)
+from car_lookup_bot.impls.car_repo.sqlite_repo import (
+    SqliteCarRepo,
+    SqliteWatermarkCarRepo,
+)
+from car_lookup_bot.impls.redis_utils import RedisKeys
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.subscriptions import CarRepoABC
+
+SUBS_COUNT = 100
+
+
+def load_cars() -> list[RiaCarRecord]:
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    return parse_ria_page_stream(raw)
+
+
+async def bench_repo(
+    name: str, repo: CarRepoABC, cars: list[RiaCarRecord]
+) -> BenchResult:
+    subs_ids = [f"bench{idx}" for idx in range(SUBS_COUNT)]
+    for subs_id in subs_ids:
+        await repo.add_cars(cars[: len(cars) // 2], subs_id)
+
+    async def dedupe() -> None:
+        for subs_id in subs_ids:
+            await repo.filter_new_cars(cars, subs_id)
+
+    return await bench_async(
+        "car_repo_dedupe", dedupe, items=len(subs_ids) * len(cars), repo=name
+    )
+
+
+async def run(redis_url: str | None = None) -> list[BenchResult]:
+    cars = load_cars()
+    repos: dict[str, Callable[[], CarRepoABC]] = {
+        "in_memory": InMemoryCarRepo,
+        "cached_in_memory": lambda: CachedCarRepo(InMemoryCarRepo()),
+        "watermark_in_memory": InMemoryWatermarkCarRepo,
+    }
+    client = None
+    if redis_url is not None:
+        client = Redis.from_url(redis_url)
+        keys = RedisKeys("bench")
+        repos["redis"] = lambda: RedisCarRepo(client, keys)
+        repos["cached_redis"] = lambda: CachedCarRepo(RedisCarRepo(client, keys))
+        repos["watermark_redis"] = lambda: RedisWatermarkCarRepo(client, keys)
+    results: list[BenchResult] = []
+    try:
+        for name, make_repo in repos.items():
+            results.append(await bench_repo(name, make_repo(), cars))
+            if client is not None:
+                await drop_bench_keys(client)
+    finally:
+        if client is not None:
+            await client.close()
+    sqlite_repos: dict[str, Callable[[SqliteDatabase], CarRepoABC]] = {
+        "sqlite": SqliteCarRepo,
+        "cached_sqlite": lambda db: CachedCarRepo(SqliteCarRepo(db)),
+        "watermark_sqlite": SqliteWatermarkCarRepo,
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, make_sqlite_repo in sqlite_repos.items():
+            async with SqliteDatabase(str(Path(tmp_dir) / f"{name}.sqlite3")) as db:
+                results.append(await bench_repo(name, make_sqlite_repo(db), cars))
+    return results
+
+
+async def drop_bench_keys(client: Redis) -> None:
+    async for key in client.scan_iter("bench:*"):
+        await client.unlink(key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+    for result in asyncio.run(run(args.redis_url)):
+        print(result.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Compare AutoRia search page parsers on the saved fixture pages
+
+Run with `python -m benchmarks.bench_ria_parser`.
+"""
+import asyncio
+
+import httpx
+
+from benchmarks.common import (
+    FIXTURES_DIR,
+    BenchResult,
+    bench_async,
+    bench_sync,
+    ria_transport,
+)
+from car_lookup_bot.car_info_readers import RIA_PARSERS, RiaCarReader
+
+
+async def run() -> list[BenchResult]:
+    results: list[BenchResult] = []
+    for page in sorted(FIXTURES_DIR.glob("ria_*.html")):
+        raw = page.read_bytes()
+        for name in ("soup", "stream"):
+            parse = RIA_PARSERS[name]
+            results.append(
+                bench_sync(
+                    "ria_parse",
+                    lambda: parse(raw),
+                    items=len(parse(raw)),
+                    page=page.name,
+                    parser=name,
+                )
+            )
+        async with httpx.AsyncClient(transport=ria_transport(raw)) as client:
+            reader = RiaCarReader("https://auto.ria.com/search/", client)
+            cars = await reader.read_cars()
+            results.append(
+                await bench_async(
+                    "ria_read_cars", reader.read_cars, items=len(cars), page=page.name
+                )
+            )
+    return results
+
+
+def main() -> None:
+    for result in asyncio.run(run()):
+        print(result.describe())
+
+
+if __name__ == "__main__":
+    main()
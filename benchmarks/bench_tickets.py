@@ -0,0 +1,34 @@
+"""Measure decoding of free times responses
+
+Run with `python -m benchmarks.bench_tickets`.
+"""
+import asyncio
+import datetime
+
+from benchmarks.common import BenchResult, bench_sync, tickets_response
+from car_lookup_bot.exam_tickets import decode_tickets
+
+
+async def run() -> list[BenchResult]:
+    results: list[BenchResult] = []
+    date = datetime.date(2023, 10, 10)
+    for rows in (10, 100, 500):
+        raw = tickets_response(rows)
+        results.append(
+            bench_sync(
+                "tickets_decode",
+                lambda: decode_tickets(raw, date, "42"),
+                items=rows,
+                rows=rows,
+            )
+        )
+    return results
+
+
+def main() -> None:
+    for result in asyncio.run(run()):
+        print(result.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Shared helpers for the benchmarks: timing, results and fake upstreams"""
+from __future__ import annotations
+
+import datetime
+import json
+import time
+import timeit
+from collections.abc import Awaitable, Callable, Sequence
+from pathlib import Path
+from typing import Any
+
+import httpx
+from pydantic import BaseModel, Field
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "fixtures"
+
+
+class BenchResult(BaseModel):
+    name: str
+    params: dict[str, Any] = Field(default_factory=dict)
+    runs: int
+    seconds_per_run: float
+    items_per_run: int = 1
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items_per_run / self.seconds_per_run
+
+    def describe(self) -> str:
+        params = " ".join(f"{key}={value}" for key, value in self.params.items())
+        return (
+            f"{self.name:28} {params:32} {self.seconds_per_run * 1000:10.3f} ms/run "
+            f"{self.items_per_second:12.0f} items/s"
+        )
+
+
+def bench_sync(
+    name: str, func: Callable[[], object], items: int = 1, **params: Any
+) -> BenchResult:
+    runs, total = timeit.Timer(func).autorange()
+    return BenchResult(
+        name=name,
+        params=params,
+        runs=runs,
+        seconds_per_run=total / runs,
+        items_per_run=items,
+    )
+
+
+async def bench_async(
+    name: str,
+    func: Callable[[], Awaitable[object]],
+    items: int = 1,
+    min_time: float = 0.2,
+    **params: Any,
+) -> BenchResult:
+    """Like `bench_sync`, runs `func` until at least `min_time` passed"""
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        await func()
+        runs += 1
+        total = time.perf_counter() - started
+        if total >= min_time:
+            break
+    return BenchResult(
+        name=name,
+        params=params,
+        runs=runs,
+        seconds_per_run=total / runs,
+        items_per_run=items,
+    )
+
+
+def save_results(path: Path, results: Sequence[BenchResult]) -> None:
+    path.write_text(
+        json.dumps([result.model_dump() for result in results], indent=2) + "\n"
+    )
+
+
+def load_results(path: Path) -> list[BenchResult]:
+    return [BenchResult.model_validate(item) for item in json.loads(path.read_text())]
+
+
+def ria_transport(raw: bytes) -> httpx.MockTransport:
+    """Serves the same search page for any request"""
+    return httpx.MockTransport(lambda request: httpx.Response(200, content=raw))
+
+
+def tickets_response(rows: int) -> bytes:
+    start = datetime.datetime(2023, 10, 10, 8)
+    return json.dumps(
+        {
+            "rows": [
+                {
+                    "id": 1000 + idx,
+                    "chtime": (start + datetime.timedelta(minutes=idx)).strftime(
+                        "%H:%M"
+                    ),
+                }
+                for idx in range(rows)
+            ]
+        }
+    ).encode()
+
+
+def tickets_transport(rows: int) -> httpx.MockTransport:
+    """Serves the same free times for any day"""
+    raw = tickets_response(rows)
+    return httpx.MockTransport(lambda request: httpx.Response(200, content=raw))
@@ -0,0 +1,31 @@
+"""Compare two saved benchmark runs
+
+Run with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+from pathlib import Path
+
+from benchmarks.common import BenchResult, load_results
+
+
+def result_key(result: BenchResult) -> tuple[str, ...]:
+    return (result.name, *(f"{key}={value}" for key, value in result.params.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args = parser.parse_args()
+    old = {result_key(result): result for result in load_results(args.old)}
+    for result in load_results(args.new):
+        before = old.get(result_key(result))
+        if before is None:
+            print(f"{' '.join(result_key(result)):60} new")
+            continue
+        change = result.seconds_per_run / before.seconds_per_run - 1
+        print(f"{' '.join(result_key(result)):60} {change:+8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Soak test: run the whole bot against local fakes with many subscriptions
+
+Starts `benchmarks.soak.fakes` in a subprocess, seeds synthetic car and
+ticket subscriptions into Redis under a separate key prefix and runs
+`bot.async_main` for `--duration` seconds. Reports notification latency
+(from the moment an ad or ticket appeared upstream to its delivery to the
+fake Telegram), memory growth and CPU time per subscription.
+
+Run with `python -m benchmarks.soak --redis-url redis://localhost --cars 2000`.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import httpx
+from pydantic import BaseModel
+
+from benchmarks.soak.fakes import (
+    FakesConfig,
+    ad_created_at,
+    ticket_created_at,
+)
+from car_lookup_bot import bot
+from car_lookup_bot.exam_tickets import TickerReaderConf
+from car_lookup_bot.impls.redis_utils import RedisKeys, make_redis_client
+from car_lookup_bot.impls.subs_repo.redis_repo import RedisSubscriptionRepo
+from car_lookup_bot.subscriptions import CarSubscription, TicketSubscription
+
+CAR_CHAT_BASE = 1_000_000
+TICKET_CHAT_BASE = 2_000_000
+
+_CAR_LINK_RE = re.compile(r"auto_soak_(\d+)\.html")
+_TICKET_TIME_RE = re.compile(r"На (\d\d):(\d\d)")
+
+
+class SoakReport(BaseModel):
+    cars: int
+    tickets: int
+    duration: float
+    deliveries: int
+    flood_errors: int
+    latency_p50: float | None
+    latency_p90: float | None
+    latency_p99: float | None
+    latency_max: float | None
+    rss_growth_kb: float
+    cpu_seconds: float
+
+    @property
+    def subs(self) -> int:
+        return max(self.cars + self.tickets, 1)
+
+    def describe(self) -> str:
+        def fmt(value: float | None) -> str:
+            return "-" if value is None else f"{value:.2f}s"
+
+        cpu_ms = self.cpu_seconds * 1000 / self.subs / (self.duration / 60)
+        return "\n".join(
+            [
+                f"subscriptions    {self.cars} cars, {self.tickets} tickets",
+                f"deliveries       {self.deliveries} ({self.flood_errors} 429s)",
+                f"latency          p50 {fmt(self.latency_p50)} "
+                f"p90 {fmt(self.latency_p90)} p99 {fmt(self.latency_p99)} "
+                f"max {fmt(self.latency_max)}",
+                f"rss growth       {self.rss_growth_kb:.0f} KiB "
+                f"({self.rss_growth_kb * 1024 / self.subs:.0f} B/subscription)",
+                f"cpu              {cpu_ms:.3f} ms/subscription/minute",
+            ]
+        )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _rss_kb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+
+
+def _percentile(values: list[float], percent: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+async def _wait_ready(base_url: str) -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{base_url}/soak/stats")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Fakes did not start")
+
+
+async def _seed(args: argparse.Namespace, base_url: str) -> None:
+    client = make_redis_client(args.redis_url)
+    try:
+        async for key in client.scan_iter(f"{args.prefix}:*"):
+            await client.unlink(key)
+        repo = RedisSubscriptionRepo(client, RedisKeys(args.prefix))
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        for index in range(args.cars):
+            await repo.add_subscription(
+                CarSubscription(
+                    ria_url=f"{base_url}/search/?search={index}",
+                    chat_id=CAR_CHAT_BASE + index,
+                )
+            )
+        for index in range(args.tickets):
+            await repo.add_subscription(
+                TicketSubscription(
+                    conf=TickerReaderConf(
+                        identity="soak",
+                        csrf="soak",
+                        webchsid2="soak",
+                        csrf_header="soak",
+                        office_id=str(index),
+                        date_start=day,
+                        date_end=day,
+                    ),
+                    chat_id=TICKET_CHAT_BASE + index,
+                )
+            )
+    finally:
+        await client.close()
+
+
+def _latencies(config: FakesConfig, deliveries: list[list[Any]]) -> list[float]:
+    res = []
+    for chat_id, delivered_at, text in deliveries:
+        created_at = None
+        if chat_id >= TICKET_CHAT_BASE:
+            match = _TICKET_TIME_RE.search(text)
+            if match:
+                index = int(match[1]) * 60 + int(match[2])
+                created_at = ticket_created_at(
+                    config, chat_id - TICKET_CHAT_BASE, index
+                )
+        else:
+            match = _CAR_LINK_RE.search(text)
+            if match:
+                created_at = ad_created_at(config, int(match[1]))
+        # Listings that were there before the start are not interesting
+        if created_at is not None and created_at > config.start:
+            res.append(delivered_at - created_at)
+    return res
+
+
+async def run(args: argparse.Namespace) -> SoakReport:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    config = FakesConfig(
+        start=time.time(),
+        ad_interval=args.ad_interval,
+        ticket_interval=args.ticket_interval,
+        flood_rate=args.flood_rate,
+    )
+    fakes = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.soak.fakes",
+            "--port",
+            str(port),
+            "--config",
+            config.model_dump_json(),
+        ]
+    )
+    try:
+        await _wait_ready(base_url)
+        await _seed(args, base_url)
+        os.environ.update(
+            REDIS_URL=args.redis_url,
+            REDIS_KEY_PREFIX=args.prefix,
+            # Legacy keys of the Redis belong to whoever else uses it
+            REDIS_MIGRATE_LEGACY="false",
+            TELEGRAM_API_URL=base_url,
+            TICKETS_BASE_URL=base_url,
+            TELEGRAM_TOKEN="1:soak",
+        )
+        rss_start = _rss_kb()
+        cpu_start = time.process_time()
+        started = time.monotonic()
+        main_task = asyncio.create_task(bot.async_main())
+        while time.monotonic() - started < args.duration and not main_task.done():
+            await asyncio.sleep(1)
+        duration = time.monotonic() - started
+        main_task.cancel()
+        try:
+            await main_task
+        except asyncio.CancelledError:
+            pass
+        cpu_seconds = time.process_time() - cpu_start
+        rss_growth = _rss_kb() - rss_start
+        async with httpx.AsyncClient() as client:
+            stats = (await client.get(f"{base_url}/soak/stats")).json()
+    finally:
+        fakes.terminate()
+        fakes.wait()
+    latencies = _latencies(config, stats["deliveries"])
+    return SoakReport(
+        cars=args.cars,
+        tickets=args.tickets,
+        duration=duration,
+        deliveries=len(stats["deliveries"]),
+        flood_errors=stats["flood_errors"],
+        latency_p50=_percentile(latencies, 50),
+        latency_p90=_percentile(latencies, 90),
+        latency_p99=_percentile(latencies, 99),
+        latency_max=max(latencies) if latencies else None,
+        rss_growth_kb=rss_growth,
+        cpu_seconds=cpu_seconds,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL"))
+    parser.add_argument("--prefix", default="soak", help="Redis key prefix")
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--tickets", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=600, help="Seconds")
+    parser.add_argument(
+        "--ad-interval", type=float, default=600, help="Seconds between new ads"
+    )
+    parser.add_argument(
+        "--ticket-interval",
+        type=float,
+        default=900,
+        help="Seconds between new tickets",
+    )
+    parser.add_argument(
+        "--flood-rate", type=float, default=0.0, help="Share of sends failing with 429"
+    )
+    parser.add_argument("--json", type=Path, help="Save the report to this file")
+    args = parser.parse_args()
+    if args.redis_url is None:
+        parser.error("--redis-url or REDIS_URL is required")
+    report = asyncio.run(run(args))
+    print(report.describe())
+    if args.json is not None:
+        args.json.write_text(json.dumps(report.model_dump(), indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
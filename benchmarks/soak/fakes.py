@@ -0,0 +1,195 @@
+"""Local stand-ins for Telegram Bot API, AutoRia search and free times pages
+
+All of them are served by one aiohttp app. New ads and tickets appear at a
+fixed rate, their creation times are derived from ids, so the harness can
+compute notification latency without talking to this process.
+
+Run with `python -m benchmarks.soak.fakes --port 8081 --config <FakesConfig json>`,
+the soak harness starts it on its own.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import random
+import time
+from typing import Any
+
+from aiohttp import web
+from pydantic import BaseModel
+
+PAGE_SIZE = 20
+ID_BASE = 1_000_000
+
+
+class FakesConfig(BaseModel):
+    start: float
+    ad_interval: float = 600.0
+    ticket_interval: float = 900.0
+    flood_rate: float = 0.0
+    retry_after: int = 1
+
+
+def _phase(key: int, interval: float) -> float:
+    # Spread new items of different searches and offices over the interval
+    return (key * 7919 % 1000) / 1000 * interval
+
+
+def ad_created_at(config: FakesConfig, car_id: int) -> float:
+    """Ads with negative offset were there before the start"""
+    search, index = divmod(car_id, ID_BASE)
+    offset = index - PAGE_SIZE + 1
+    return (
+        config.start + offset * config.ad_interval + _phase(search, config.ad_interval)
+    )
+
+
+def last_ad_index(config: FakesConfig, search: int, now: float) -> int:
+    elapsed = now - config.start - _phase(search, config.ad_interval)
+    return PAGE_SIZE - 1 + math.floor(elapsed / config.ad_interval)
+
+
+def ticket_created_at(config: FakesConfig, office: int, index: int) -> float:
+    return (
+        config.start
+        + (index + 1) * config.ticket_interval
+        + _phase(office, config.ticket_interval)
+    )
+
+
+def ticket_time(index: int) -> str:
+    return f"{index % 1440 // 60:02d}:{index % 60:02d}"
+
+
+def render_ad(car_id: int, created_at: float) -> str:
+    add_date = datetime.datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M:%S")
+    link = f"https://auto.ria.com/uk/auto_soak_{car_id}.html"
+    return f"""<section class="ticket-item" data-advertisement-id="{car_id}">
+  <div class="ticket-photo"><img src="https://cdn.example.com/{car_id}.jpg"></div>
+  <div class="item ticket-title"><a href="{link}">Soak Car 2020</a></div>
+  <div class="price-ticket">
+    <span data-currency="USD">10 000</span> <span data-currency="UAH">370 000</span>
+  </div>
+  <ul><li class="item-char js-race"> 100 тис. км</li></ul>
+  <div class="footer_ticket"><span data-add-date="{add_date}"></span></div>
+  <a class="m-link-ticket" href="{link}"></a>
+</section>
+"""
+
+
+class Fakes:
+    def __init__(self, config: FakesConfig) -> None:
+        self._config = config
+        self._random = random.Random(0)
+        self.deliveries: list[tuple[int, float, str]] = []
+        self.flood_errors = 0
+        self.requests: dict[str, int] = {}
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/search/", self._search)
+        app.router.add_post("/site/freetimes", self._freetimes)
+        app.router.add_get("/soak/stats", self._stats)
+        app.router.add_post("/bot{token}/{method}", self._telegram)
+        return app
+
+    def _count(self, name: str) -> None:
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    async def _search(self, request: web.Request) -> web.Response:
+        self._count("search")
+        search = int(request.query["search"])
+        last = last_ad_index(self._config, search, time.time())
+        ads = "".join(
+            render_ad(
+                search * ID_BASE + index,
+                ad_created_at(self._config, search * ID_BASE + index),
+            )
+            for index in range(last, max(last - PAGE_SIZE, -1), -1)
+        )
+        body = f'<html><body><div id="searchResults">{ads}</div></body></html>'
+        return web.Response(text=body, content_type="text/html")
+
+    async def _freetimes(self, request: web.Request) -> web.Response:
+        self._count("freetimes")
+        form = await request.post()
+        office = int(str(form["office_id"]))
+        now = time.time()
+        rows = []
+        index = 0
+        while ticket_created_at(self._config, office, index) <= now:
+            rows.append({"id": office * ID_BASE + index, "chtime": ticket_time(index)})
+            index += 1
+        return web.json_response({"rows": rows[-PAGE_SIZE:]})
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "deliveries": self.deliveries,
+                "flood_errors": self.flood_errors,
+                "requests": self.requests,
+            }
+        )
+
+    async def _telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self._count(method)
+        form = await request.post()
+        if method == "getme":
+            return self._ok(
+                {"id": 1, "is_bot": True, "first_name": "Soak", "username": "soak_bot"}
+            )
+        if method == "getupdates":
+            await asyncio.sleep(min(float(str(form.get("timeout", 0))), 5))
+            return self._ok([])
+        if method not in ("sendmessage", "sendphoto", "sendmediagroup"):
+            return self._ok(True)
+        if self._random.random() < self._config.flood_rate:
+            self.flood_errors += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after "
+                    f"{self._config.retry_after}",
+                    "parameters": {"retry_after": self._config.retry_after},
+                }
+            )
+        chat_id = int(str(form["chat_id"]))
+        now = time.time()
+        if method == "sendmediagroup":
+            media = json.loads(str(form["media"]))
+            for item in media:
+                self.deliveries.append((chat_id, now, item.get("caption", "")))
+            return self._ok([self._message(chat_id) for _ in media])
+        text = str(form.get("text") or form.get("caption") or "")
+        self.deliveries.append((chat_id, now, text))
+        return self._ok(self._message(chat_id))
+
+    def _message(self, chat_id: int) -> dict[str, Any]:
+        return {
+            "message_id": len(self.deliveries),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+
+    def _ok(self, result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--config", required=True, help="FakesConfig as JSON")
+    args = parser.parse_args()
+    fakes = Fakes(FakesConfig.model_validate_json(args.config))
+    web.run_app(
+        fakes.make_app(), host="127.0.0.1", port=args.port, print=lambda *args: None
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@ import datetime
 import logging
 import sys
 import textwrap
+from collections.abc import Sequence
+from contextlib import AsyncExitStack
+from typing import NamedTuple
 
 from aiogram import Bot, Dispatcher, Router, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.types import Message
@@ -12,15 +17,44 @@ from pydantic import BaseModel
 from redis.asyncio.client import Redis
 
 from car_lookup_bot.car_info_readers import RiaCarReader
-from car_lookup_bot.exam_tickets import TickerReaderConf, TicketReader
-from car_lookup_bot.impls.car_repo.redis_repo import RedisCarRepo
+from car_lookup_bot.exam_tickets import (
+    TickerReaderConf,
+    TicketReader,
+    TicketReaderOptions,
+)
+from car_lookup_bot.executors import ParseExecutor
+from car_lookup_bot.http_clients import HttpClients
+from car_lookup_bot.impls.car_repo.cached_repo import CachedCarRepo
+from car_lookup_bot.impls.car_repo.redis_repo import (
+    RedisCarRepo,
+    RedisWatermarkCarRepo,
+)
+from car_lookup_bot.impls.car_repo.sqlite_repo import (
+    SqliteCarRepo,
+    SqliteWatermarkCarRepo,
+)
+from car_lookup_bot.impls.notification_repo.redis_repo import RedisNotificationRepo
+from car_lookup_bot.impls.notification_repo.sqlite_repo import SqliteNotificationRepo
+from car_lookup_bot.impls.redis_utils import RedisClient, RedisKeys, make_redis_client
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
 from car_lookup_bot.impls.subs_repo.redis_repo import RedisSubscriptionRepo
+from car_lookup_bot.impls.subs_repo.sqlite_repo import SqliteSubscriptionRepo
+from car_lookup_bot.impls.ticket_repo.cached_repo import CachedTicketRepo
 from car_lookup_bot.impls.ticket_repo.redis_repo import RedisTicketRepo
+from car_lookup_bot.impls.ticket_repo.sqlite_repo import SqliteTicketRepo
+from car_lookup_bot.maintenance import migrate_legacy_keys
+from car_lookup_bot.metrics import MetricsServer
+from car_lookup_bot.notifications import NotificationDispatcher, NotificationRepoABC
+from car_lookup_bot.poll_intervals import PollIntervals
 from car_lookup_bot.settings import Settings
+from car_lookup_bot.sharding import ShardCoordinator, ShardEvent, ShardListener
 from car_lookup_bot.subscriptions import (
+    CarRepoABC,
     CarSubscription,
     Subscription,
+    SubscriptionRepoABC,
     SubscriptionsService,
+    TicketRepoABC,
     TicketSubscription,
 )
 
@@ -54,14 +88,19 @@ async def command_start_handler(message: Message) -> None:
 
 @router.message(Command("subscribe"))
 async def command_subscribe(
-    message: types.Message, command: CommandObject, subs_service: SubscriptionsService
+    message: types.Message,
+    command: CommandObject,
+    subs_service: SubscriptionsService,
+    http_clients: HttpClients,
 ) -> None:
     url = command.args
     if url is None:
         await message.answer(f"Нужно указать ссылку на риа поиск")
         return
     try:
-        await RiaCarReader(url).read_cars()
+        await RiaCarReader(
+            url, http_clients.get(url), responses=http_clients.responses
+        ).read_cars()
     except Exception:
         await message.answer(
             f"Ошибка при загрузке резальтатов по ссылке. Ссылка правильная?"
@@ -86,7 +125,10 @@ class TicketSubsTokens(BaseModel):
 
 @router.message(Command("subscribe_ticket"))
 async def command_subscribe_ticket(
-    message: types.Message, command: CommandObject, subs_service: SubscriptionsService
+    message: types.Message,
+    command: CommandObject,
+    subs_service: SubscriptionsService,
+    ticket_options: TicketReaderOptions,
 ) -> None:
     if command.args is None:
         await message.answer(f"Нужно указать дату")
@@ -127,7 +169,7 @@ async def command_subscribe_ticket(
     )
 
     try:
-        async with TicketReader(conf) as reader:
+        async with TicketReader(conf, options=ticket_options) as reader:
             await reader._get_tickets(date_start)
             conf.webchsid2 = reader.get_current_webchsid2()
     except Exception:
@@ -184,21 +226,253 @@ async def command_unsubscribe(
         await message.answer(f"Подписка {sub_id} нe найдена")
 
 
+class Storage(NamedTuple):
+    subs_repo: SubscriptionRepoABC
+    car_repo: CarRepoABC
+    ticket_repo: TicketRepoABC
+    notification_repo: NotificationRepoABC
+
+
+async def make_redis_storage(settings: Settings, redis_client: RedisClient) -> Storage:
+    redis_keys = RedisKeys(settings.REDIS_KEY_PREFIX)
+    subs_repo = RedisSubscriptionRepo(redis_client, redis_keys)
+    redis_car_repo = RedisCarRepo(
+        redis_client, redis_keys, retention=settings.SEEN_CARS_RETENTION
+    )
+    redis_ticket_repo = RedisTicketRepo(
+        redis_client, redis_keys, retention=settings.SEEN_TICKETS_RETENTION
+    )
+    if settings.REDIS_MIGRATE_LEGACY:
+        await migrate_legacy_keys(settings, redis_client)
+    subs = await subs_repo.list_subscriptions()
+    subs_ids = [sub.id for sub in subs]
+    if (
+        await subs_repo.has_legacy()
+        or await redis_car_repo.has_legacy(subs_ids)
+        or await redis_ticket_repo.has_legacy(subs_ids)
+    ):
+        logging.error(
+            "Redis has data of an old version in unprefixed keys, run "
+            "`python -m car_lookup_bot.maintenance migrate-legacy` first"
+        )
+        raise RuntimeError("Legacy Redis keys are not migrated")
+    car_repo: CarRepoABC
+    if settings.CAR_DEDUPE_STRATEGY == "watermark":
+        watermark_repo = RedisWatermarkCarRepo(
+            redis_client,
+            redis_keys,
+            window=settings.CAR_WATERMARK_WINDOW,
+            window_size=settings.CAR_WATERMARK_WINDOW_SIZE,
+            retention=settings.SEEN_CARS_RETENTION,
+        )
+        await check_car_watermarks(redis_car_repo, watermark_repo, subs)
+        car_repo = watermark_repo
+    else:
+        car_repo = CachedCarRepo(
+            redis_car_repo,
+            max_size=settings.SEEN_CACHE_SIZE,
+            bloom_capacity=settings.SEEN_CACHE_BLOOM_CAPACITY,
+        )
+    return Storage(
+        subs_repo=subs_repo,
+        car_repo=car_repo,
+        ticket_repo=CachedTicketRepo(
+            redis_ticket_repo,
+            max_size=settings.SEEN_CACHE_SIZE,
+            bloom_capacity=settings.SEEN_CACHE_BLOOM_CAPACITY,
+        ),
+        notification_repo=RedisNotificationRepo(
+            redis_client,
+            redis_keys,
+            worker_id=settings.WORKER_ID if settings.SHARDING else None,
+        ),
+    )
+
+
+async def check_car_watermarks(
+    set_repo: RedisCarRepo,
+    watermark_repo: RedisWatermarkCarRepo,
+    subs: Sequence[Subscription],
+) -> None:
+    """Refuse to switch to watermarks before they are built from seen sets"""
+    car_ids = [sub.id for sub in subs if isinstance(sub, CarSubscription)]
+    not_built = [
+        subs_id
+        for subs_id in await watermark_repo.missing_watermarks(car_ids)
+        if await set_repo.list_seen_cars(subs_id)
+    ]
+    if not_built:
+        logging.error(
+            f"{len(not_built)} car subscriptions have seen cars but no watermark, "
+            f"run `python -m car_lookup_bot.maintenance car-watermarks` first"
+        )
+        raise RuntimeError("Car watermarks are not built")
+
+
+def make_sqlite_storage(settings: Settings, db: SqliteDatabase) -> Storage:
+    car_repo: CarRepoABC
+    if settings.CAR_DEDUPE_STRATEGY == "watermark":
+        car_repo = SqliteWatermarkCarRepo(
+            db,
+            window=settings.CAR_WATERMARK_WINDOW,
+            window_size=settings.CAR_WATERMARK_WINDOW_SIZE,
+        )
+    else:
+        car_repo = CachedCarRepo(
+            SqliteCarRepo(db, retention=settings.SEEN_CARS_RETENTION),
+            max_size=settings.SEEN_CACHE_SIZE,
+            bloom_capacity=settings.SEEN_CACHE_BLOOM_CAPACITY,
+        )
+    return Storage(
+        subs_repo=SqliteSubscriptionRepo(db),
+        car_repo=car_repo,
+        ticket_repo=CachedTicketRepo(
+            SqliteTicketRepo(db, retention=settings.SEEN_TICKETS_RETENTION),
+            max_size=settings.SEEN_CACHE_SIZE,
+            bloom_capacity=settings.SEEN_CACHE_BLOOM_CAPACITY,
+        ),
+        notification_repo=SqliteNotificationRepo(db),
+    )
+
+
 async def async_main() -> None:
     settings = Settings()
 
-    bot = Bot(TOKEN, parse_mode=ParseMode.HTML)
+    session = None
+    if settings.TELEGRAM_API_URL is not None:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL)
+        )
+    bot = Bot(
+        settings.TELEGRAM_TOKEN or TOKEN, session=session, parse_mode=ParseMode.HTML
+    )
 
-    redis_client = Redis.from_url(settings.REDIS_URL)
-    car_repo = RedisCarRepo(redis_client)
-    ticket_repo = RedisTicketRepo(redis_client)
-    subs_repo = RedisSubscriptionRepo(redis_client)
-    async with SubscriptionsService(
-        bot=bot, subs_repo=subs_repo, car_repo=car_repo, ticket_repo=ticket_repo
-    ) as subs_service:
-        dp = Dispatcher(subs_service=subs_service)
+    parse_executor = ParseExecutor(
+        settings.PARSE_EXECUTOR, workers=settings.PARSE_WORKERS
+    )
+    http_clients = HttpClients(
+        max_connections_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+        http2=settings.HTTP2,
+        shared_ttl=settings.HTTP_SHARED_TTL,
+    )
+    ticket_options = TicketReaderOptions(
+        requests_per_second=settings.TICKET_REQUESTS_PER_SECOND,
+        office_requests_per_second=settings.TICKET_OFFICE_REQUESTS_PER_SECOND,
+        max_concurrency=settings.TICKET_MAX_CONCURRENCY,
+        max_retries=settings.TICKET_MAX_RETRIES,
+        base_url=settings.TICKETS_BASE_URL,
+    )
+    async with AsyncExitStack() as stack:
+        if settings.METRICS_PORT is not None:
+            await stack.enter_async_context(MetricsServer(settings.METRICS_PORT))
+        redis_client = None
+        if settings.STORAGE_BACKEND == "sqlite":
+            if settings.SHARDING:
+                raise ValueError("Sharding needs Redis storage")
+            db = await stack.enter_async_context(SqliteDatabase(settings.SQLITE_PATH))
+            storage = make_sqlite_storage(settings, db)
+        else:
+            if settings.REDIS_URL is None:
+                raise ValueError("REDIS_URL is required for Redis storage")
+            redis_client = make_redis_client(
+                settings.REDIS_URL, settings.REDIS_CLUSTER_MODE
+            )
+            storage = await make_redis_storage(settings, redis_client)
+        shard = None
+        if settings.SHARDING and redis_client is not None:
+            shard = ShardCoordinator(
+                redis_client,
+                settings.WORKER_ID,
+                lease_ttl=settings.SHARD_LEASE_TTL,
+                key_prefix=settings.REDIS_KEY_PREFIX,
+                # Channels are shared by the whole cluster, any node will do
+                pubsub_client=(
+                    Redis.from_url(settings.REDIS_URL)
+                    if settings.REDIS_CLUSTER_MODE
+                    else None
+                ),
+            )
+            await stack.enter_async_context(shard)
+        notifications = NotificationDispatcher(
+            bot,
+            storage.notification_repo,
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            chat_interval=settings.TELEGRAM_CHAT_INTERVAL,
+            senders=settings.NOTIFICATION_SENDERS,
+        )
+        if shard is not None:
+            shard.add_listener(share_notification_limits(shard, notifications))
+        await stack.enter_async_context(parse_executor)
+        await stack.enter_async_context(http_clients)
+        await stack.enter_async_context(notifications)
+        subs_service = await stack.enter_async_context(
+            SubscriptionsService(
+                notifications=notifications,
+                subs_repo=storage.subs_repo,
+                car_repo=storage.car_repo,
+                ticket_repo=storage.ticket_repo,
+                pooling_interval=settings.POLL_INTERVAL,
+                poll_intervals=PollIntervals(
+                    settings.POLL_INTERVAL,
+                    min_interval=settings.POLL_MIN_INTERVAL,
+                    max_interval=settings.POLL_MAX_INTERVAL,
+                    target_arrivals=settings.POLL_TARGET_ARRIVALS,
+                    ticket_max_interval=settings.TICKET_POLL_MAX_INTERVAL,
+                    release_window=settings.TICKET_RELEASE_WINDOW,
+                ),
+                poll_workers=settings.POLL_WORKERS,
+                host_limits=settings.POLL_HOST_LIMITS,
+                warm_start_batch=settings.WARM_START_BATCH,
+                poll_jitter=settings.POLL_JITTER,
+                ria_parser=settings.RIA_PARSER,
+                ria_max_pages=settings.RIA_MAX_PAGES,
+                subs_flush_interval=settings.SUBS_FLUSH_INTERVAL,
+                ticket_options=ticket_options,
+                parse_executor=parse_executor,
+                http_clients=http_clients,
+                shard=shard,
+            )
+        )
+        dp = Dispatcher(
+            subs_service=subs_service,
+            http_clients=http_clients,
+            ticket_options=ticket_options,
+        )
         dp.include_router(router)
-        await dp.start_polling(bot)
+        if shard is None:
+            await dp.start_polling(bot)
+        else:
+            await poll_while_leader(dp, bot, shard)
+
+
+def share_notification_limits(
+    shard: ShardCoordinator, notifications: NotificationDispatcher
+) -> ShardListener:
+    """Keep Telegram limits of the dispatcher split between live workers"""
+
+    async def on_event(event: ShardEvent) -> None:
+        if event.kind == "rebalance":
+            notifications.set_workers(len(shard.workers()))
+
+    notifications.set_workers(len(shard.workers()))
+    return on_event
+
+
+async def poll_while_leader(dp: Dispatcher, bot: Bot, shard: ShardCoordinator) -> None:
+    """Receive Telegram updates only while this worker holds the leader lease"""
+    while True:
+        await shard.wait_leadership()
+        polling = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+        )
+        lost = asyncio.create_task(shard.wait_leadership(False))
+        await asyncio.wait([polling, lost], return_when=asyncio.FIRST_COMPLETED)
+        if polling.done():
+            lost.cancel()
+            return polling.result()
+        logging.info("Lost leadership, stopping Telegram polling")
+        await dp.stop_polling()
+        await polling
 
 
 def main() -> None:
@@ -1,11 +1,59 @@
 import abc
 import datetime
+import hashlib
 import logging
+import re
+from collections.abc import AsyncIterator, Awaitable, Callable
+from html.parser import HTMLParser
+from typing import NamedTuple, Protocol, TypeVar
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from bs4 import BeautifulSoup, Tag
-from httpx import AsyncClient
+from httpx import AsyncClient, Response
 from pydantic import BaseModel
 
+from car_lookup_bot.executors import ParseExecutor
+from car_lookup_bot.http_clients import SingleFlight
+from car_lookup_bot.metrics import PARSE_SECONDS
+
+TRACKING_PARAMS = frozenset({"fbclid", "gclid", "yclid", "_gl", "ref"})
+
+
+def normalize_ria_url(url: str) -> str:
+    """Bring equivalent AutoRia search urls to the same form.
+
+    Query params are sorted by name (keeping the order of repeated ones)
+    and tracking params like utm_* are dropped.
+    """
+    parts = urlsplit(url.strip())
+    params = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_PARAMS
+    ]
+    params.sort(key=lambda param: param[0])
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path,
+            urlencode(params),
+            "",
+        )
+    )
+
+
+def ria_page_url(url: str, page: int) -> str:
+    """Url of the given (0-based) page of AutoRia search results"""
+    parts = urlsplit(url)
+    params = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key != "page"
+    ]
+    params.append(("page", str(page)))
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
 
 class CarInfo(BaseModel):
     provider_name: str
@@ -21,69 +69,388 @@ class CarInfo(BaseModel):
     link: str
 
 
+class CarIdentity(Protocol):
+    """Fields that tell listings apart, enough to check if one was seen"""
+
+    @property
+    def provider_name(self) -> str:
+        ...
+
+    @property
+    def provider_car_id(self) -> str:
+        ...
+
+    @property
+    def add_time(self) -> datetime.datetime:
+        ...
+
+
+CarT = TypeVar("CarT", bound=CarIdentity)
+
+
+class RiaCarRecord(NamedTuple):
+    """AutoRia listing as found on the page, cheap to pass between processes
+
+    Most listings of a poll are already seen, so fields are kept as raw
+    strings and parsed only by `to_car_info` for the new ones.
+    """
+
+    car_id: str
+    title: str
+    price_usd: str
+    price_uah: str
+    race: str
+    add_date: str
+    image_url: str
+    link: str
+
+    @property
+    def provider_name(self) -> str:
+        return "ria"
+
+    @property
+    def provider_car_id(self) -> str:
+        return self.car_id
+
+    @property
+    def add_time(self) -> datetime.datetime:
+        # Same as "%Y-%m-%d %H:%M:%S" but much faster than strptime
+        return datetime.datetime.fromisoformat(self.add_date)
+
+    def to_car_info(self) -> CarInfo:
+        name, year = self.title.rsplit(" ", 1)
+        return CarInfo(
+            provider_name=self.provider_name,
+            provider_car_id=self.car_id,
+            name=name.strip(),
+            year=int(year),
+            price_usd=int(self.price_usd.replace(" ", "")),
+            price_uah=int(self.price_uah.replace(" ", "")),
+            mileage_km=int(self.race.split(" ")[1]) * 1000,
+            add_time=self.add_time,
+            image_url=self.image_url,
+            link=self.link,
+        )
+
+
 class CarReader(abc.ABC):
     @abc.abstractmethod
     async def read_cars(self) -> list[CarInfo]:
         pass
 
 
+def parse_ria_page_soup(raw: bytes) -> list[RiaCarRecord]:
+    """Parse AutoRia search page by building the whole BeautifulSoup tree"""
+    res: list[RiaCarRecord] = []
+    bs = BeautifulSoup(raw, features="html.parser")
+    sr = bs.find(id="searchResults")
+    if not isinstance(sr, Tag):
+        logging.warning("Failed to parse AutoRia response")
+        return []
+    for tag in sr.children:
+        if not isinstance(tag, Tag) or tag.name != "section":
+            continue
+        name_tag = tag.find(class_="ticket-title")
+        if name_tag is None:
+            continue
+        price_tag = tag.find(class_="price-ticket")
+        assert isinstance(price_tag, Tag)
+        price_usd = price_tag.find(  # type: ignore
+            "span", attrs={"data-currency": "USD"}
+        ).text
+        price_uah = price_tag.find(  # type: ignore
+            "span", attrs={"data-currency": "UAH"}
+        ).text
+
+        mileage_tag = tag.find(class_="js-race")
+        assert isinstance(mileage_tag, Tag)
+
+        time_tag = tag.find(attrs={"data-add-date": True})
+        assert isinstance(time_tag, Tag)
+
+        img_tag = tag.find("img")
+        assert isinstance(img_tag, Tag)
+
+        link_tag = tag.find(class_="m-link-ticket")
+        assert isinstance(link_tag, Tag)
+
+        record = RiaCarRecord(
+            car_id=tag.attrs["data-advertisement-id"],
+            title=name_tag.text.strip(),
+            price_usd=price_usd,
+            price_uah=price_uah,
+            race=mileage_tag.text,
+            add_date=time_tag.attrs["data-add-date"],
+            image_url=img_tag.attrs["src"],
+            link=link_tag.attrs["href"],
+        )
+        res.append(record)
+    return res
+
+
+class _RiaResultsParser(HTMLParser):
+    """Collects listing fields in a single pass over the #searchResults subtree
+
+    Picks the same elements as `parse_ria_page_soup`: the first matching
+    one in every top level <section> of the results.
+    """
+
+    VOID_TAGS = frozenset(
+        {
+            "area",
+            "base",
+            "br",
+            "col",
+            "embed",
+            "hr",
+            "img",
+            "input",
+            "link",
+            "meta",
+            "param",
+            "source",
+            "track",
+            "wbr",
+        }
+    )
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.cars: list[RiaCarRecord] = []
+        self.done = False
+        self._stack: list[str] = []
+        self._fields: dict[str, str] | None = None
+        self._captures: list[tuple[str, int]] = []
+        self._price_depth: int | None = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        depth = len(self._stack)
+        if tag not in self.VOID_TAGS:
+            self._stack.append(tag)
+        if self.done or depth == 0:
+            return
+        attrs_map = dict(attrs)
+        if depth == 1:
+            if tag == "section":
+                self._fields = {"car_id": attrs_map.get("data-advertisement-id") or ""}
+            return
+        fields = self._fields
+        if fields is None:
+            return
+        classes = (attrs_map.get("class") or "").split()
+        if "title" not in fields and "ticket-title" in classes:
+            self._capture("title", depth)
+        if "price" not in fields and "price-ticket" in classes:
+            fields["price"] = ""
+            self._price_depth = depth
+        elif self._price_depth is not None and tag == "span":
+            currency = attrs_map.get("data-currency")
+            if currency == "USD" and "price_usd" not in fields:
+                self._capture("price_usd", depth)
+            if currency == "UAH" and "price_uah" not in fields:
+                self._capture("price_uah", depth)
+        if "race" not in fields and "js-race" in classes:
+            self._capture("race", depth)
+        if "add_date" not in fields and "data-add-date" in attrs_map:
+            fields["add_date"] = attrs_map["data-add-date"] or ""
+        if "image_url" not in fields and tag == "img":
+            fields["image_url"] = attrs_map.get("src") or ""
+        if "link" not in fields and "m-link-ticket" in classes:
+            fields["link"] = attrs_map.get("href") or ""
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in self.VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag not in self._stack:
+            return
+        while self._stack:
+            closed = self._stack.pop()
+            self._close(len(self._stack))
+            if closed == tag:
+                return
+
+    def handle_data(self, data: str) -> None:
+        if self._fields is None:
+            return
+        for field, _ in self._captures:
+            self._fields[field] += data
+
+    def _capture(self, field: str, depth: int) -> None:
+        assert self._fields is not None
+        self._fields[field] = ""
+        self._captures.append((field, depth))
+
+    def _close(self, depth: int) -> None:
+        if self._captures:
+            self._captures = [item for item in self._captures if item[1] != depth]
+        if depth == self._price_depth:
+            self._price_depth = None
+        if depth == 1 and self._fields is not None:
+            fields, self._fields = self._fields, None
+            if "title" in fields:
+                self.cars.append(self._make_car_record(fields))
+        if depth == 0:
+            self.done = True
+
+    def _make_car_record(self, fields: dict[str, str]) -> RiaCarRecord:
+        for field in ("price_usd", "price_uah", "race", "add_date", "link"):
+            if field not in fields:
+                raise ValueError(
+                    f"Failed to parse AutoRia listing {fields['car_id']}: "
+                    f"{field} is missing"
+                )
+        return RiaCarRecord(
+            car_id=fields["car_id"],
+            title=fields["title"].strip(),
+            price_usd=fields["price_usd"],
+            price_uah=fields["price_uah"],
+            race=fields["race"],
+            add_date=fields["add_date"],
+            image_url=fields.get("image_url", ""),
+            link=fields["link"],
+        )
+
+
+def parse_ria_page_stream(
+    raw: bytes, chunk_size: int = 32 * 1024
+) -> list[RiaCarRecord]:
+    """Parse AutoRia search page looking only at the #searchResults subtree"""
+    pos = max(raw.find(b'id="searchResults"'), raw.find(b"id='searchResults'"))
+    start = raw.rfind(b"<", 0, pos)
+    if pos < 0 or start < 0:
+        logging.warning("Failed to parse AutoRia response")
+        return []
+    text = raw[start:].decode("utf-8", errors="replace")
+    parser = _RiaResultsParser()
+    for offset in range(0, len(text), chunk_size):
+        parser.feed(text[offset : offset + chunk_size])
+        if parser.done:
+            break
+    return parser.cars
+
+
+def parse_ria_page_verify(raw: bytes) -> list[RiaCarRecord]:
+    """Run both parsers and report when the stream one disagrees"""
+    res = parse_ria_page_soup(raw)
+    try:
+        stream_res = parse_ria_page_stream(raw)
+    except Exception:
+        logging.exception("Stream AutoRia parser failed")
+    else:
+        if stream_res != res:
+            logging.warning("Stream AutoRia parser result differs from soup one")
+    return res
+
+
+_AD_ID_RE = re.compile(rb'data-advertisement-id="([^"]*)"')
+
+
+def ria_page_fingerprint(raw: bytes) -> str:
+    """Hash of the ordered listing ids of the #searchResults part of the page"""
+    start = max(raw.find(b'id="searchResults"'), raw.find(b"id='searchResults'"), 0)
+    ids = _AD_ID_RE.findall(raw, start)
+    return hashlib.blake2b(b",".join(ids), digest_size=16).hexdigest()
+
+
+RIA_PARSERS: dict[str, Callable[[bytes], list[RiaCarRecord]]] = {
+    "soup": parse_ria_page_soup,
+    "stream": parse_ria_page_stream,
+    "verify": parse_ria_page_verify,
+}
+
+
 class RiaCarReader(CarReader):
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self,
+        url: str,
+        client: AsyncClient,
+        parser: str = "stream",
+        executor: ParseExecutor | None = None,
+        responses: SingleFlight[Response] | None = None,
+    ) -> None:
         self._url = url
-        self._client = AsyncClient()
+        self._client = client
+        self._responses = responses
+        self._parse = RIA_PARSERS[parser]
+        self._parser_name = parser
+        self._executor = executor or ParseExecutor()
+        self._validators: dict[str, str] = {}
 
     async def read_cars(self) -> list[CarInfo]:
-        res: list[CarInfo] = []
+        return [record.to_car_info() for record in await self.read_records()]
+
+    async def read_records(self) -> list[RiaCarRecord]:
+        resp = await self._get_page()
+        return await self.parse_page(resp.read())
+
+    async def fetch_new_page(self) -> bytes | None:
+        """Fetch raw search page, returns None if it is not modified
+
+        Sends ETag/Last-Modified of the previous response as a conditional
+        request, so an unchanged page is neither downloaded nor parsed.
+        Error responses raise `httpx.HTTPStatusError`.
+        """
+        if self._validators:
+            resp = await self._client.get(self._url, headers=self._validators)
+        else:
+            resp = await self._get_page()
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        self._validators.clear()
+        if etag := resp.headers.get("etag"):
+            self._validators["If-None-Match"] = etag
+        if last_modified := resp.headers.get("last-modified"):
+            self._validators["If-Modified-Since"] = last_modified
+        return resp.read()
+
+    async def parse_page(self, raw: bytes) -> list[RiaCarRecord]:
+        with PARSE_SECONDS.time(parser=self._parser_name):
+            return await self._executor.run(self._parse, raw)
+
+    async def crawl(
+        self,
+        first_page: bytes,
+        reached_known: Callable[[list[RiaCarRecord]], Awaitable[bool]],
+        max_pages: int = 1,
+    ) -> AsyncIterator[RiaCarRecord]:
+        """Yield listings across result pages, newest first
+
+        Starts from already fetched `first_page`. Next page is requested
+        only if `reached_known` says that the current one has no listings
+        that were processed before, so usually there is a single request.
+        """
+        raw = first_page
+        for page in range(max_pages):
+            if page > 0:
+                resp = await self._client.get(ria_page_url(self._url, page))
+                resp.raise_for_status()
+                raw = resp.read()
+            records = await self.parse_page(raw)
+            for record in records:
+                yield record
+            if not records or await reached_known(records):
+                return
+
+    def reset_validators(self) -> None:
+        """Make next `fetch_new_page` return the page even if not modified"""
+        self._validators.clear()
+
+    async def _get_page(self) -> Response:
+        """Unconditional load of the first page, shared by equivalent urls
+
+        A subscription is checked on /subscribe and then its first results
+        are loaded right away, this way both use a single request.
+        """
+        if self._responses is None:
+            return await self._load_page()
+        return await self._responses.do(normalize_ria_url(self._url), self._load_page)
+
+    async def _load_page(self) -> Response:
+        # Raising keeps error responses out of the shared cache
         resp = await self._client.get(self._url)
-        bs = BeautifulSoup(resp.read(), features="html.parser")
-        sr = bs.find(id="searchResults")
-        if not isinstance(sr, Tag):
-            logging.warning("Failed to parse AutoRia response")
-            return []
-        for tag in sr.children:
-            if not isinstance(tag, Tag) or tag.name != "section":
-                continue
-            name_tag = tag.find(class_="ticket-title")
-            if name_tag is None:
-                continue
-            name, year = name_tag.text.strip().rsplit(" ", 1)
-            price_tag = tag.find(class_="price-ticket")
-            assert isinstance(price_tag, Tag)
-            price_usd = price_tag.find(  # type: ignore
-                "span", attrs={"data-currency": "USD"}
-            ).text
-            price_uah = price_tag.find(  # type: ignore
-                "span", attrs={"data-currency": "UAH"}
-            ).text
-
-            mileage_tag = tag.find(class_="js-race")
-            assert isinstance(mileage_tag, Tag)
-            mileage_km = int(mileage_tag.text.split(" ")[1]) * 1000
-
-            time_tag = tag.find(attrs={"data-add-date": True})
-            assert isinstance(time_tag, Tag)
-            add_time_raw = time_tag.attrs["data-add-date"]
-            add_time = datetime.datetime.strptime(add_time_raw, "%Y-%m-%d %H:%M:%S")
-
-            img_tag = tag.find("img")
-            assert isinstance(img_tag, Tag)
-            image_url = img_tag.attrs["src"]
-
-            link_tag = tag.find(class_="m-link-ticket")
-            assert isinstance(link_tag, Tag)
-            link = link_tag.attrs["href"]
-
-            info = CarInfo(
-                provider_name="ria",
-                provider_car_id=tag.attrs["data-advertisement-id"],
-                name=name.strip(),
-                year=int(year),
-                price_usd=int(price_usd.replace(" ", "")),
-                price_uah=int(price_uah.replace(" ", "")),
-                mileage_km=mileage_km,
-                add_time=add_time,
-                image_url=image_url,
-                link=link,
-            )
-            res.append(info)
-        return res
+        resp.raise_for_status()
+        return resp
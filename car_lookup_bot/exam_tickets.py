@@ -2,16 +2,46 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import json
 import logging
 from collections.abc import AsyncIterator
 from typing import Any
+from urllib.parse import urlsplit
 
 import httpx
 from httpx import Cookies
 from pydantic import BaseModel
 
+from car_lookup_bot.http_clients import SingleFlight
+from car_lookup_bot.metrics import http_event_hooks
+from car_lookup_bot.rate_limits import TokenBucket
+
 logger = logging.getLogger(__name__)
 
+TICKETS_HOST = "eq.hsc.gov.ua"
+TICKETS_BASE_URL = f"https://{TICKETS_HOST}"
+
+
+class OfficeBuckets:
+    """Rate limits shared by all sessions that request the same office"""
+
+    def __init__(self, requests_per_second: float = 5.0) -> None:
+        self._requests_per_second = requests_per_second
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def get(self, office_id: str) -> TokenBucket:
+        bucket = self._buckets.get(office_id)
+        if bucket is None:
+            bucket = self._buckets[office_id] = TokenBucket(self._requests_per_second)
+        return bucket
+
+
+def _get_retry_after(resp: httpx.Response) -> float | None:
+    try:
+        return float(resp.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
 
 class TickerReaderConf(BaseModel):
     identity: str
@@ -21,21 +51,25 @@ class TickerReaderConf(BaseModel):
     office_id: str
     date_start: datetime.date
     date_end: datetime.date
-    pause_between_requests: datetime.timedelta = datetime.timedelta(seconds=2)
 
 
-def setup_client(conf: TickerReaderConf) -> httpx.AsyncClient:
+def setup_client(
+    conf: TickerReaderConf,
+    base_url: str = TICKETS_BASE_URL,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> httpx.AsyncClient:
+    host = urlsplit(base_url).hostname or TICKETS_HOST
     jar = Cookies()
-    jar.set(name="_identity", value=conf.identity, domain="eq.hsc.gov.ua")
-    jar.set(name="_csrf", value=conf.csrf, domain="eq.hsc.gov.ua")
-    jar.set(name="WEBCHSID2", value=conf.webchsid2, domain="eq.hsc.gov.ua")
+    jar.set(name="_identity", value=conf.identity, domain=host)
+    jar.set(name="_csrf", value=conf.csrf, domain=host)
+    jar.set(name="WEBCHSID2", value=conf.webchsid2, domain=host)
 
     headers = {
         "accept": "*/*",
         "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-        "Host": "eq.hsc.gov.ua",
-        "Origin": "https://eq.hsc.gov.ua",
-        "Referer": "https://eq.hsc.gov.ua/site/step2?chdate=2023-10-10&question_id=56&id_es=",  # noqa
+        "Host": host,
+        "Origin": base_url,
+        "Referer": f"{base_url}/site/step2?chdate=2023-10-10&question_id=56&id_es=",  # noqa
         "Referrer-Policy": "strict-origin-when-cross-origin",
         "x-requested-with": "XMLHttpRequest",
         "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36",  # noqa
@@ -47,7 +81,27 @@ def setup_client(conf: TickerReaderConf) -> httpx.AsyncClient:
         "sec-fetch-site": "same-origin",
         "X-Csrf-Token": conf.csrf_header,
     }
-    return httpx.AsyncClient(verify=False, cookies=jar, headers=headers)
+    return httpx.AsyncClient(
+        verify=False,
+        cookies=jar,
+        headers=headers,
+        event_hooks=http_event_hooks(),
+        transport=transport,
+    )
+
+
+class TicketReaderOptions(BaseModel):
+    """Settings shared by readers of all ticket subscriptions"""
+
+    requests_per_second: float = 2.0
+    office_requests_per_second: float = 5.0
+    max_concurrency: int = 3
+    max_retries: int = 3
+    base_url: str = TICKETS_BASE_URL
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.base_url).hostname or TICKETS_HOST
 
 
 class Ticket(BaseModel):
@@ -56,50 +110,123 @@ class Ticket(BaseModel):
     time: datetime.datetime
 
 
+def decode_tickets(raw: bytes, date: datetime.date, office_id: str) -> list[Ticket]:
+    """Decode free times response for a single day"""
+    data = json.loads(raw)
+    res: list[Ticket] = []
+    for row in data["rows"]:
+        res.append(
+            Ticket(
+                id=str(row["id"]),
+                time=datetime.datetime.combine(
+                    date,
+                    datetime.datetime.strptime(row["chtime"], "%H:%M").time(),
+                ),
+                office_id=office_id,
+            )
+        )
+    return res
+
+
 class TicketReader:
-    def __init__(self, conf: TickerReaderConf) -> None:
-        self._client = setup_client(conf)
+    def __init__(
+        self,
+        conf: TickerReaderConf,
+        transport: httpx.AsyncBaseTransport | None = None,
+        options: TicketReaderOptions | None = None,
+        day_tickets: SingleFlight[list[Ticket]] | None = None,
+        office_buckets: OfficeBuckets | None = None,
+    ) -> None:
+        self._options = options or TicketReaderOptions()
+        self._client = setup_client(conf, self._options.base_url, transport)
         self._conf = conf
+        self._day_tickets = day_tickets
+        self._session_bucket = TokenBucket(self._options.requests_per_second)
+        if office_buckets is None:
+            office_buckets = OfficeBuckets(self._options.office_requests_per_second)
+        self._office_bucket = office_buckets.get(conf.office_id)
 
     async def __aenter__(self) -> TicketReader:
         return self
 
     async def __aexit__(self, *args: Any) -> None:
-        print("WEBCHSID2: ", self._client.cookies.get("WEBCHSID2"))
+        logger.debug(f"WEBCHSID2: {self._client.cookies.get('WEBCHSID2')}")
+        await self._client.aclose()
 
     def get_current_webchsid2(self) -> str:
         return self._client.cookies.get("WEBCHSID2") or ""
 
     async def get_tickets(self) -> AsyncIterator[Ticket]:
+        """Fetch all days concurrently, yielding tickets as days arrive"""
         day_cnt = (self._conf.date_end - self._conf.date_start).days + 1
-        for day_idx in range(day_cnt):
-            res = await self._get_tickets(
-                self._conf.date_start + datetime.timedelta(days=day_idx)
+        semaphore = asyncio.Semaphore(self._options.max_concurrency)
+
+        async def fetch_day(date: datetime.date) -> list[Ticket]:
+            async with semaphore:
+                return await self._get_tickets_limited(date)
+
+        tasks = [
+            asyncio.create_task(
+                fetch_day(self._conf.date_start + datetime.timedelta(days=day_idx))
             )
-            for ticket in res:
-                yield ticket
-            await asyncio.sleep(self._conf.pause_between_requests.total_seconds())
+            for day_idx in range(day_cnt)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for ticket in await next_done:
+                    yield ticket
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _get_tickets_limited(self, date: datetime.date) -> list[Ticket]:
+        attempt = 0
+        while True:
+            await self._session_bucket.acquire()
+            await self._office_bucket.acquire()
+            try:
+                res = await self._get_tickets(date)
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if attempt >= self._options.max_retries or (
+                    status != 429 and status < 500
+                ):
+                    raise
+                retry_after = _get_retry_after(e.response)
+                logger.warning(
+                    f"Got {status} for tickets at {date}, retry after {retry_after}"
+                )
+                self._session_bucket.penalize(retry_after)
+                self._office_bucket.penalize(retry_after)
+                attempt += 1
+            else:
+                self._session_bucket.reward()
+                self._office_bucket.reward()
+                return res
 
     async def _get_tickets(self, date: datetime.date) -> list[Ticket]:
+        """Load tickets of a day, shared by readers of the same session"""
+        if self._day_tickets is None:
+            return await self._request_tickets(date)
+        key = "|".join(
+            [
+                self._conf.identity,
+                self._conf.csrf,
+                self.get_current_webchsid2(),
+                self._conf.office_id,
+                date.strftime("%Y-%m-%d"),
+            ]
+        )
+        return await self._day_tickets.do(key, lambda: self._request_tickets(date))
+
+    async def _request_tickets(self, date: datetime.date) -> list[Ticket]:
         logger.info(f"Requesting tickets for date {date}")
         resp = await self._client.post(
-            "https://eq.hsc.gov.ua/site/freetimes",
+            f"{self._options.base_url}/site/freetimes",
             content=f"office_id={self._conf.office_id}"
             f"&date_of_admission={date.strftime('%Y-%m-%d')}"
             f"&question_id=55&es_date=&es_time=",
         )
         resp.raise_for_status()
-        data = resp.json()
-        res: list[Ticket] = []
-        for row in data["rows"]:
-            res.append(
-                Ticket(
-                    id=str(row["id"]),
-                    time=datetime.datetime.combine(
-                        date,
-                        datetime.datetime.strptime(row["chtime"], "%H:%M").time(),
-                    ),
-                    office_id=self._conf.office_id,
-                )
-            )
-        return res
+        return decode_tickets(resp.content, date, self._conf.office_id)
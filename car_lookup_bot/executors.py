@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+EXECUTOR_KINDS = ("none", "thread", "process")
+
+
+class ParseExecutor:
+    """Runs CPU heavy parsing of raw responses off the event loop
+
+    With kind "none" the work runs inline. "thread" and "process" use a pool
+    of `workers`. When `max_pending` jobs are already submitted callers
+    wait for a free slot instead of queueing up more raw pages.
+    """
+
+    def __init__(
+        self, kind: str = "none", workers: int = 2, max_pending: int | None = None
+    ) -> None:
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor kind {kind}")
+        self._executor: Executor | None = None
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="parse"
+            )
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._pending = asyncio.Semaphore(max_pending or 2 * workers)
+
+    async def __aenter__(self) -> ParseExecutor:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[[bytes], T], raw: bytes) -> T:
+        if self._executor is None:
+            return func(raw)
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, raw)
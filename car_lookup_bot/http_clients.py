@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, TypeVar
+from urllib.parse import urlsplit
+
+import httpx
+
+from car_lookup_bot.metrics import http_event_hooks
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Share results of identical requests made at about the same time
+
+    Concurrent calls with the same key wait for a single call of `func`,
+    its result is then reused for `ttl` seconds. Failures are not kept, so
+    the next call tries again. A caller being cancelled does not cancel
+    the request for the others.
+    """
+
+    def __init__(self, ttl: float = 10.0, max_size: int = 1024) -> None:
+        self._ttl = ttl
+        self._max_size = max_size
+        self._inflight: dict[str, asyncio.Task[T]] = {}
+        self._results: OrderedDict[str, tuple[float, T]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        cached = self._results.get(key)
+        if cached is not None:
+            expires_at, value = cached
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+            del self._results[key]
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._store(key, done))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _store(self, key: str, task: asyncio.Task[T]) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None or self._ttl <= 0:
+            return
+        self._results[key] = (time.monotonic() + self._ttl, task.result())
+        self._results.move_to_end(key)
+        while len(self._results) > self._max_size:
+            self._results.popitem(last=False)
+
+
+class HttpClients:
+    """Process-wide keep-alive http clients, one per upstream host
+
+    Every host gets its own connection pool, so the connection limit is
+    applied per host. HTTP/2 is only used when the `h2` package is installed.
+    Plain page loads can be shared through `responses`, see `SingleFlight`.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int = 10,
+        keepalive_expiry: float = 60,
+        http2: bool = False,
+        shared_ttl: float = 10.0,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self._limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=max_connections_per_host,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested, but h2 is not installed")
+            http2 = False
+        self._http2 = http2
+        self._transport = transport
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self.shared_ttl = shared_ttl
+        self.responses: SingleFlight[httpx.Response] = SingleFlight(shared_ttl)
+
+    async def __aenter__(self) -> HttpClients:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        host = urlsplit(url).netloc.lower()
+        client = self._clients.get(host)
+        if client is None:
+            client = self._clients[host] = httpx.AsyncClient(
+                limits=self._limits,
+                http2=self._http2,
+                event_hooks=http_event_hooks(),
+                transport=self._transport,
+            )
+        return client
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
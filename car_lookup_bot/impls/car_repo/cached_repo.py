@@ -0,0 +1,85 @@
+import asyncio
+from collections.abc import Sequence
+
+from car_lookup_bot.car_info_readers import CarIdentity, CarT
+from car_lookup_bot.impls.seen_cache import SeenCache
+from car_lookup_bot.subscriptions import CarRepoABC
+
+
+class CachedCarRepo(CarRepoABC):
+    """Keeps recently seen cars of every subscription in process memory
+
+    Writes go through to the wrapped repo. Caches are warmed from the
+    wrapped repo by `warm` when polling starts, or on first use otherwise.
+    """
+
+    def __init__(
+        self,
+        repo: CarRepoABC,
+        max_size: int = 200,
+        bloom_capacity: int | None = None,
+    ) -> None:
+        self._repo = repo
+        self._max_size = max_size
+        self._bloom_capacity = bloom_capacity
+        self._caches: dict[str, SeenCache] = {}
+        self._warm_concurrency = 16
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        return not await self.filter_new_cars([car_info], subs_id)
+
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        await self._repo.add_cars(cars, subs_id)
+        cache = await self._get_cache(subs_id)
+        cache.add(self._car_key(car_info) for car_info in cars)
+
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        cache = await self._get_cache(subs_id)
+        return await cache.filter_new(
+            cars,
+            self._car_key,
+            lambda to_check: self._repo.filter_new_cars(to_check, subs_id),
+        )
+
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        return await self._repo.list_seen_cars(subs_id)
+
+    async def drop_subscription(self, subs_id: str) -> None:
+        self._caches.pop(subs_id, None)
+        await self._repo.drop_subscription(subs_id)
+
+    def evict(self, subs_id: str) -> None:
+        self._caches.pop(subs_id, None)
+        self._repo.evict(subs_id)
+
+    async def warm(self, subs_ids: Sequence[str]) -> None:
+        semaphore = asyncio.Semaphore(self._warm_concurrency)
+
+        async def warm_one(subs_id: str) -> None:
+            async with semaphore:
+                await self._get_cache(subs_id)
+
+        await asyncio.gather(
+            *(warm_one(subs_id) for subs_id in subs_ids if subs_id not in self._caches)
+        )
+
+    async def _get_cache(self, subs_id: str) -> SeenCache:
+        cache = self._caches.get(subs_id)
+        if cache is None:
+            seen = await self._repo.list_seen_cars(subs_id)
+            # Could be warmed concurrently, first one wins
+            cache = self._caches.setdefault(
+                subs_id,
+                SeenCache(
+                    [provider + "|" + car_id for provider, car_id in seen],
+                    self._max_size,
+                    self._bloom_capacity,
+                ),
+            )
+        return cache
+
+    def _car_key(self, car_info: CarIdentity) -> str:
+        return car_info.provider_name + "|" + car_info.provider_car_id
@@ -1,4 +1,8 @@
-from car_lookup_bot.car_info_readers import CarInfo
+import datetime
+from collections.abc import Sequence
+
+from car_lookup_bot.car_info_readers import CarIdentity, CarT
+from car_lookup_bot.impls.car_repo.watermark import CarWatermark
 from car_lookup_bot.subscriptions import CarRepoABC
 
 
@@ -6,12 +10,61 @@ class InMemoryCarRepo(CarRepoABC):
     def __init__(self) -> None:
         self.cars_ids: set[tuple[str, str, str]] = set()
 
-    async def add_car(self, car_info: CarInfo, subs_id: str) -> None:
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
         self.cars_ids.add((car_info.provider_name, car_info.provider_car_id, subs_id))
 
-    async def has_car(self, car_info: CarInfo, subs_id: str) -> bool:
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
         return (
             car_info.provider_name,
             car_info.provider_car_id,
             subs_id,
         ) in self.cars_ids
+
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        for car_info in cars:
+            await self.add_car(car_info, subs_id)
+
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        return [
+            car_info for car_info in cars if not await self.has_car(car_info, subs_id)
+        ]
+
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        return [
+            (provider_name, car_id)
+            for provider_name, car_id, entry_subs_id in self.cars_ids
+            if entry_subs_id == subs_id
+        ]
+
+    async def drop_subscription(self, subs_id: str) -> None:
+        self.cars_ids = {entry for entry in self.cars_ids if entry[-1] != subs_id}
+
+
+class InMemoryWatermarkCarRepo(CarRepoABC):
+    def __init__(
+        self,
+        window: datetime.timedelta = datetime.timedelta(hours=1),
+        window_size: int = 100,
+    ) -> None:
+        self.watermarks: dict[str, CarWatermark] = {}
+        self._window = window.total_seconds()
+        self._window_size = window_size
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        return not await self.filter_new_cars([car_info], subs_id)
+
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        watermark = self.watermarks.setdefault(subs_id, CarWatermark())
+        watermark.add(cars, self._window, self._window_size)
+
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        return self.watermarks.get(subs_id, CarWatermark()).filter_new(cars)
+
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        return self.watermarks.get(subs_id, CarWatermark()).seen()
+
+    async def drop_subscription(self, subs_id: str) -> None:
+        self.watermarks.pop(subs_id, None)
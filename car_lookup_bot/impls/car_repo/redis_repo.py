@@ -1,24 +1,220 @@
-from redis.asyncio import Redis
+import datetime
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Collection, Sequence
 
-from car_lookup_bot.car_info_readers import CarInfo
+from car_lookup_bot.car_info_readers import CarIdentity, CarT
+from car_lookup_bot.impls.car_repo.watermark import CarWatermark
+from car_lookup_bot.impls.redis_utils import RedisClient, RedisKeys
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
 from car_lookup_bot.subscriptions import CarRepoABC
 
+logger = logging.getLogger(__name__)
+
 
 class RedisCarRepo(CarRepoABC):
+    """Seen cars are kept in a sorted set per subscription
+
+    Scores are the last time a car was seen in the search results, so cars
+    that are gone from the results for longer than `retention` are trimmed.
+    """
+
+    def __init__(
+        self,
+        client: RedisClient,
+        keys: RedisKeys | None = None,
+        retention: datetime.timedelta = datetime.timedelta(days=30),
+    ) -> None:
+        self._client = client
+        self._keys = keys or RedisKeys()
+        self._legacy_key = "cars"
+        self._retention = retention.total_seconds()
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="has_car")
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        score = await self._client.zscore(
+            self._subs_key(subs_id), self._car_to_id(car_info)
+        )
+        return score is not None
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="add_cars")
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        if not cars:
+            return
+        now = time.time()
+        key = self._subs_key(subs_id)
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {self._car_to_id(car_info): now for car_info in cars})
+            pipe.zremrangebyscore(key, "-inf", now - self._retention)
+            await pipe.execute()
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="filter_new_cars")
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        if not cars:
+            return []
+        key = self._subs_key(subs_id)
+        ids = [self._car_to_id(car_info) for car_info in cars]
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.zmscore(key, ids)
+            # Cars that are still in the results should not be trimmed
+            pipe.zadd(key, dict.fromkeys(ids, time.time()), xx=True)
+            scores, _ = await pipe.execute()
+        return [car_info for car_info, score in zip(cars, scores) if score is None]
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="list_seen_cars")
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        res: list[tuple[str, str]] = []
+        for entry in await self._client.zrange(self._subs_key(subs_id), 0, -1):
+            provider_name, _, car_id = entry.decode().partition("|")
+            res.append((provider_name, car_id))
+        return res
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._client.unlink(self._subs_key(subs_id))
+
+    async def compact_legacy(
+        self, active_subs_ids: Collection[str], batch_size: int = 1000
+    ) -> int:
+        """Move entries of the legacy global "cars" set to per-subscription sets
+
+        Entries of subscriptions that are not active anymore are dropped.
+        Returns the number of moved entries.
+        """
+        if not await self._client.exists(self._legacy_key):
+            return 0
+        moved = 0
+        batch: dict[str, dict[bytes, float]] = defaultdict(dict)
+        now = time.time()
+        async for entry in self._client.sscan_iter(self._legacy_key, count=batch_size):
+            car_id, _, subs_id = entry.decode().rpartition("|")
+            if subs_id not in active_subs_ids:
+                continue
+            batch[subs_id][car_id.encode()] = now
+            moved += 1
+            if moved % batch_size == 0:
+                await self._flush_legacy(batch)
+        await self._flush_legacy(batch)
+        await self._client.unlink(self._legacy_key)
+        logger.info(f"Moved {moved} legacy car entries")
+        return moved
+
+    async def has_legacy(self, subs_ids: Sequence[str]) -> bool:
+        """Whether any of the legacy unprefixed keys is left"""
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._legacy_key)
+            for subs_id in subs_ids:
+                pipe.exists(f"{self._legacy_key}:{subs_id}")
+            return any(await pipe.execute())
+
+    async def migrate(self, subs_ids: Sequence[str]) -> None:
+        """Move per-subscription sets from legacy unprefixed keys"""
+        legacy_keys = [f"{self._legacy_key}:{subs_id}" for subs_id in subs_ids]
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in legacy_keys:
+                pipe.exists(key)
+            exists = await pipe.execute()
+        for subs_id, key, found in zip(subs_ids, legacy_keys, exists):
+            if not found:
+                continue
+            entries = await self._client.zrange(key, 0, -1, withscores=True)
+            if entries:
+                await self._client.zadd(self._subs_key(subs_id), dict(entries), nx=True)
+            await self._client.unlink(key)
+            logger.info(f"Moved {len(entries)} seen cars of {subs_id}")
+
+    async def _flush_legacy(self, batch: dict[str, dict[bytes, float]]) -> None:
+        async with self._client.pipeline(transaction=False) as pipe:
+            for subs_id, mapping in batch.items():
+                pipe.zadd(self._subs_key(subs_id), mapping, nx=True)
+            await pipe.execute()
+        batch.clear()
+
+    def _subs_key(self, subs_id: str) -> str:
+        return self._keys.seen_cars(subs_id)
+
+    def _car_to_id(self, car_info: CarIdentity) -> bytes:
+        return (car_info.provider_name + "|" + car_info.provider_car_id).encode()
+
+
+class RedisWatermarkCarRepo(CarRepoABC):
+    """Every subscription keeps a single `CarWatermark` blob
+
+    Dedupe of a whole page costs one GET, and the stored state does not
+    grow with the number of seen cars. Blobs of subscriptions that are not
+    updated for longer than `retention` expire.
+    """
+
     def __init__(
         self,
-        client: Redis,
+        client: RedisClient,
+        keys: RedisKeys | None = None,
+        window: datetime.timedelta = datetime.timedelta(hours=1),
+        window_size: int = 100,
+        retention: datetime.timedelta = datetime.timedelta(days=30),
     ) -> None:
         self._client = client
-        self._key = "cars"
+        self._keys = keys or RedisKeys()
+        self._window = window.total_seconds()
+        self._window_size = window_size
+        self._retention = retention
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        return not await self.filter_new_cars([car_info], subs_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="add_cars")
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        if not cars:
+            return
+        # Only the worker that polls the subscription writes its watermark
+        watermark = await self._get(subs_id)
+        watermark.add(cars, self._window, self._window_size)
+        await self._client.set(
+            self._keys.car_watermark(subs_id),
+            watermark.model_dump_json(),
+            ex=self._retention,
+        )
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="filter_new_cars")
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        if not cars:
+            return []
+        return (await self._get(subs_id)).filter_new(cars)
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="list_seen_cars")
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        return (await self._get(subs_id)).seen()
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._client.unlink(self._keys.car_watermark(subs_id))
 
-    async def add_car(self, car_info: CarInfo, subs_id: str) -> None:
-        await self._client.sadd("cars", self._car_to_id(car_info, subs_id))
+    async def init_watermark(self, subs_id: str, floor: datetime.datetime) -> None:
+        """Count everything added up to `floor` as seen, unless already built"""
+        await self._client.set(
+            self._keys.car_watermark(subs_id),
+            CarWatermark(floor=floor.timestamp()).model_dump_json(),
+            ex=self._retention,
+            nx=True,
+        )
 
-    async def has_car(self, car_info: CarInfo, subs_id: str) -> bool:
-        return await self._client.sismember("cars", self._car_to_id(car_info, subs_id))
+    async def missing_watermarks(self, subs_ids: Sequence[str]) -> list[str]:
+        """Return ids of subscriptions that have no watermark yet"""
+        async with self._client.pipeline(transaction=False) as pipe:
+            for subs_id in subs_ids:
+                pipe.exists(self._keys.car_watermark(subs_id))
+            exists = await pipe.execute()
+        return [subs_id for subs_id, found in zip(subs_ids, exists) if not found]
 
-    def _car_to_id(self, car_info: CarInfo, subs_id: str) -> bytes:
-        return (
-            car_info.provider_name + "|" + car_info.provider_car_id + "|" + subs_id
-        ).encode()
+    async def _get(self, subs_id: str) -> CarWatermark:
+        raw = await self._client.get(self._keys.car_watermark(subs_id))
+        if raw is None:
+            return CarWatermark()
+        return CarWatermark.model_validate_json(raw)
@@ -0,0 +1,164 @@
+import datetime
+import sqlite3
+import time
+from collections.abc import Sequence
+
+from car_lookup_bot.car_info_readers import CarIdentity, CarT
+from car_lookup_bot.impls.car_repo.watermark import CarWatermark, car_key
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
+from car_lookup_bot.subscriptions import CarRepoABC
+
+
+class SqliteCarRepo(CarRepoABC):
+    """Seen cars are rows keyed by subscription id and car
+
+    Like in the Redis repo, `seen_at` is the last time a car was seen in
+    the search results, and cars that are gone for longer than `retention`
+    are trimmed.
+    """
+
+    def __init__(
+        self,
+        db: SqliteDatabase,
+        retention: datetime.timedelta = datetime.timedelta(days=30),
+    ) -> None:
+        self._db = db
+        self._retention = retention.total_seconds()
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        return not await self.filter_new_cars([car_info], subs_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="add_cars")
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        if not cars:
+            return
+        now = time.time()
+        rows = [(subs_id, car_key(car_info), now) for car_info in cars]
+
+        def query(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen_cars (subs_id, car_key, seen_at) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "DELETE FROM seen_cars WHERE subs_id = ? AND seen_at < ?",
+                (subs_id, now - self._retention),
+            )
+
+        await self._db.write(query)
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="filter_new_cars")
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        if not cars:
+            return []
+        keys = [car_key(car_info) for car_info in cars]
+        placeholders = ",".join("?" * len(keys))
+        rows = await self._db.read(
+            lambda conn: conn.execute(
+                f"SELECT car_key FROM seen_cars "
+                f"WHERE subs_id = ? AND car_key IN ({placeholders})",
+                (subs_id, *keys),
+            ).fetchall()
+        )
+        seen = {key for key, in rows}
+        if seen:
+            # Cars that are still in the results should not be trimmed
+            now = time.time()
+            await self._db.write(
+                lambda conn: conn.executemany(
+                    "UPDATE seen_cars SET seen_at = ? "
+                    "WHERE subs_id = ? AND car_key = ?",
+                    [(now, subs_id, key) for key in seen],
+                )
+            )
+        return [car_info for car_info, key in zip(cars, keys) if key not in seen]
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="list_seen_cars")
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        rows = await self._db.read(
+            lambda conn: conn.execute(
+                "SELECT car_key FROM seen_cars WHERE subs_id = ? ORDER BY seen_at",
+                (subs_id,),
+            ).fetchall()
+        )
+        res = []
+        for (key,) in rows:
+            provider_name, _, car_id = key.partition("|")
+            res.append((provider_name, car_id))
+        return res
+
+    @timed(REPO_OPERATION_SECONDS, repo="cars", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM seen_cars WHERE subs_id = ?", (subs_id,)
+            )
+        )
+
+
+class SqliteWatermarkCarRepo(CarRepoABC):
+    """Every subscription keeps a single `CarWatermark` row"""
+
+    def __init__(
+        self,
+        db: SqliteDatabase,
+        window: datetime.timedelta = datetime.timedelta(hours=1),
+        window_size: int = 100,
+    ) -> None:
+        self._db = db
+        self._window = window.total_seconds()
+        self._window_size = window_size
+
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
+        await self.add_cars([car_info], subs_id)
+
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
+        return not await self.filter_new_cars([car_info], subs_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="add_cars")
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        if not cars:
+            return
+
+        def query(conn: sqlite3.Connection) -> None:
+            watermark = self._get(conn, subs_id)
+            watermark.add(cars, self._window, self._window_size)
+            conn.execute(
+                "INSERT OR REPLACE INTO car_watermarks (subs_id, data) VALUES (?, ?)",
+                (subs_id, watermark.model_dump_json()),
+            )
+
+        await self._db.write(query)
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="filter_new_cars")
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        if not cars:
+            return []
+        watermark = await self._db.read(lambda conn: self._get(conn, subs_id))
+        return watermark.filter_new(cars)
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="list_seen_cars")
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        watermark = await self._db.read(lambda conn: self._get(conn, subs_id))
+        return watermark.seen()
+
+    @timed(REPO_OPERATION_SECONDS, repo="car_watermarks", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM car_watermarks WHERE subs_id = ?", (subs_id,)
+            )
+        )
+
+    def _get(self, conn: sqlite3.Connection, subs_id: str) -> CarWatermark:
+        row = conn.execute(
+            "SELECT data FROM car_watermarks WHERE subs_id = ?", (subs_id,)
+        ).fetchone()
+        if row is None:
+            return CarWatermark()
+        return CarWatermark.model_validate_json(row[0])
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, Sequence
+
+from pydantic import BaseModel, Field
+
+from car_lookup_bot.car_info_readers import CarIdentity, CarT
+
+
+def car_key(car_info: CarIdentity) -> str:
+    return car_info.provider_name + "|" + car_info.provider_car_id
+
+
+class CarWatermark(BaseModel):
+    """Constant size replacement of the seen set of a subscription
+
+    AutoRia results are ordered by add time, so everything added at or
+    before `floor` counts as seen. Ids of listings added after it are kept,
+    it lets listings with equal or shuffled add times near the newest one
+    still be told apart. The window is limited both by time span and size,
+    dropping old ids raises the floor.
+    """
+
+    floor: float = 0.0
+    ids: dict[str, float] = Field(default_factory=dict)
+
+    def filter_new(self, cars: Sequence[CarT]) -> list[CarT]:
+        return [
+            car_info
+            for car_info in cars
+            if car_info.add_time.timestamp() > self.floor
+            and car_key(car_info) not in self.ids
+        ]
+
+    def add(self, cars: Iterable[CarIdentity], span: float, max_size: int) -> None:
+        for car_info in cars:
+            self.ids[car_key(car_info)] = car_info.add_time.timestamp()
+        if not self.ids:
+            return
+        self.floor = max(self.floor, max(self.ids.values()) - span)
+        if len(self.ids) > max_size:
+            times = sorted(self.ids.values())
+            self.floor = max(self.floor, times[-max_size - 1])
+        self.ids = {key: added for key, added in self.ids.items() if added > self.floor}
+
+    def seen(self) -> list[tuple[str, str]]:
+        res = []
+        for key in self.ids:
+            provider_name, _, car_id = key.partition("|")
+            res.append((provider_name, car_id))
+        return res
@@ -0,0 +1,19 @@
+from collections.abc import Sequence
+
+from car_lookup_bot.notifications import Notification, NotificationRepoABC
+
+
+class InMemoryNotificationRepo(NotificationRepoABC):
+    def __init__(self) -> None:
+        self.notifications: dict[str, Notification] = {}
+
+    async def add_notifications(self, notifications: Sequence[Notification]) -> None:
+        for notification in notifications:
+            self.notifications[notification.id] = notification
+
+    async def list_notifications(self) -> list[Notification]:
+        return list(self.notifications.values())
+
+    async def drop_notifications(self, ids: Sequence[str]) -> None:
+        for notification_id in ids:
+            self.notifications.pop(notification_id, None)
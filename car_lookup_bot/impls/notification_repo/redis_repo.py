@@ -0,0 +1,47 @@
+from collections.abc import Sequence
+
+from car_lookup_bot.impls.redis_utils import RedisClient, RedisKeys
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
+from car_lookup_bot.notifications import Notification, NotificationRepoABC
+
+
+class RedisNotificationRepo(NotificationRepoABC):
+    """Undelivered notifications are stored in a hash by id
+
+    Every worker has its own hash, so it resends only its own notifications
+    after restart.
+    """
+
+    def __init__(
+        self,
+        client: RedisClient,
+        keys: RedisKeys | None = None,
+        worker_id: str | None = None,
+    ) -> None:
+        self._client = client
+        self._key = (keys or RedisKeys()).notifications(worker_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="add_notifications")
+    async def add_notifications(self, notifications: Sequence[Notification]) -> None:
+        if not notifications:
+            return
+        await self._client.hset(
+            self._key,
+            mapping={
+                notification.id: notification.model_dump_json()
+                for notification in notifications
+            },
+        )
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="list_notifications")
+    async def list_notifications(self) -> list[Notification]:
+        res: list[Notification] = []
+        async for _, entry in self._client.hscan_iter(self._key):
+            res.append(Notification.model_validate_json(entry))
+        return res
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="drop_notifications")
+    async def drop_notifications(self, ids: Sequence[str]) -> None:
+        if not ids:
+            return
+        await self._client.hdel(self._key, *ids)
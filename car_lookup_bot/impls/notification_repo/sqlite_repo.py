@@ -0,0 +1,44 @@
+from collections.abc import Sequence
+
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
+from car_lookup_bot.notifications import Notification, NotificationRepoABC
+
+
+class SqliteNotificationRepo(NotificationRepoABC):
+    """Undelivered notifications are stored as JSON blobs by id"""
+
+    def __init__(self, db: SqliteDatabase) -> None:
+        self._db = db
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="add_notifications")
+    async def add_notifications(self, notifications: Sequence[Notification]) -> None:
+        if not notifications:
+            return
+        rows = [
+            (notification.id, notification.model_dump_json())
+            for notification in notifications
+        ]
+        await self._db.write(
+            lambda conn: conn.executemany(
+                "INSERT OR REPLACE INTO notifications (id, data) VALUES (?, ?)", rows
+            )
+        )
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="list_notifications")
+    async def list_notifications(self) -> list[Notification]:
+        rows = await self._db.read(
+            lambda conn: conn.execute("SELECT data FROM notifications").fetchall()
+        )
+        return [Notification.model_validate_json(data) for data, in rows]
+
+    @timed(REPO_OPERATION_SECONDS, repo="notifications", operation="drop_notifications")
+    async def drop_notifications(self, ids: Sequence[str]) -> None:
+        if not ids:
+            return
+        await self._db.write(
+            lambda conn: conn.executemany(
+                "DELETE FROM notifications WHERE id = ?",
+                [(notification_id,) for notification_id in ids],
+            )
+        )
@@ -0,0 +1,70 @@
+from collections import defaultdict
+from collections.abc import Sequence
+from typing import Union
+
+from redis.asyncio import Redis, RedisCluster
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import ClusterPipeline
+from redis.crc import key_slot
+
+RedisClient = Union[Redis, RedisCluster]
+RedisPipeline = Union[Pipeline, ClusterPipeline]
+
+
+def make_redis_client(url: str, cluster_mode: bool = False) -> RedisClient:
+    if cluster_mode:
+        return RedisCluster.from_url(url)
+    return Redis.from_url(url)
+
+
+class RedisKeys:
+    """Key layout of the bot data
+
+    All keys start with `prefix`. Keys with data of a single subscription
+    share its id as a hash tag, so in a cluster they are stored in one slot
+    and the hot per-subscription data is spread over the whole cluster.
+    """
+
+    def __init__(self, prefix: str = "louvre") -> None:
+        self.prefix = prefix
+
+    def subscriptions(self) -> str:
+        return f"{self.prefix}:subscriptions"
+
+    def chat_subscriptions(self, chat_id: int) -> str:
+        return f"{self.prefix}:chat:{chat_id}:subscriptions"
+
+    def subscription(self, subs_id: str) -> str:
+        return f"{self.prefix}:sub:{{{subs_id}}}"
+
+    def seen_cars(self, subs_id: str) -> str:
+        return f"{self.prefix}:sub:{{{subs_id}}}:cars"
+
+    def car_watermark(self, subs_id: str) -> str:
+        return f"{self.prefix}:sub:{{{subs_id}}}:cars_watermark"
+
+    def seen_tickets(self, subs_id: str) -> str:
+        return f"{self.prefix}:sub:{{{subs_id}}}:tickets"
+
+    def notifications(self, worker_id: str | None = None) -> str:
+        if worker_id is None:
+            return f"{self.prefix}:notifications"
+        return f"{self.prefix}:notifications:{worker_id}"
+
+
+async def mget_by_slot(client: RedisClient, keys: Sequence[str]) -> list[bytes | None]:
+    """MGET that works across cluster slots, keeping the order of keys"""
+    if not keys:
+        return []
+    by_slot: dict[int, list[int]] = defaultdict(list)
+    for index, key in enumerate(keys):
+        by_slot[key_slot(key.encode())].append(index)
+    res: list[bytes | None] = [None] * len(keys)
+    async with client.pipeline(transaction=False) as pipe:
+        for indexes in by_slot.values():
+            pipe.mget([keys[index] for index in indexes])
+        values = await pipe.execute()
+    for indexes, slot_values in zip(by_slot.values(), values):
+        for index, value in zip(indexes, slot_values):
+            res[index] = value
+    return res
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_cnt = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def add(self, item: str) -> None:
+        for idx in self._indexes(item):
+            self._bits[idx >> 3] |= 1 << (idx & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[idx >> 3] & (1 << (idx & 7)) for idx in self._indexes(item)
+        )
+
+    def _indexes(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self._size for i in range(self._hash_cnt))
+
+
+class SeenCache:
+    """Recently seen ids of a single subscription
+
+    The LRU answers "seen" for sure. The optional Bloom filter holds every
+    id that was loaded from the backing repo or added through the cache,
+    so a miss there means the id is new for sure. Everything else has to
+    be checked in the backing repo. Once per `refresh_interval` the whole
+    page is passed to the backing repo, so it can see the ids are still
+    in use.
+    """
+
+    def __init__(
+        self,
+        seen_ids: Sequence[str],
+        max_size: int,
+        bloom_capacity: int | None = None,
+        refresh_interval: float = 3600,
+    ) -> None:
+        self._max_size = max_size
+        self._lru: OrderedDict[str, None] = OrderedDict()
+        self._bloom: BloomFilter | None = None
+        if bloom_capacity:
+            self._bloom = BloomFilter(max(bloom_capacity, 2 * len(seen_ids)))
+        self._refresh_interval = refresh_interval
+        self._refreshed_at = time.monotonic()
+        self.add(seen_ids[-max_size:])
+        if self._bloom is not None:
+            for item_id in seen_ids[:-max_size]:
+                self._bloom.add(item_id)
+
+    def add(self, ids: Iterable[str]) -> None:
+        for item_id in ids:
+            self._lru[item_id] = None
+            self._lru.move_to_end(item_id)
+            if self._bloom is not None:
+                self._bloom.add(item_id)
+        while len(self._lru) > self._max_size:
+            self._lru.popitem(last=False)
+
+    async def filter_new(
+        self,
+        items: Sequence[T],
+        key: Callable[[T], str],
+        check: Callable[[Sequence[T]], Awaitable[list[T]]],
+    ) -> list[T]:
+        """Return new items, asking `check` only about the unknown ones"""
+        new_items: list[T] = []
+        now = time.monotonic()
+        if now - self._refreshed_at > self._refresh_interval:
+            self._refreshed_at = now
+            to_check = list(items)
+        else:
+            to_check = []
+            for item in items:
+                item_id = key(item)
+                if item_id in self._lru:
+                    self._lru.move_to_end(item_id)
+                elif self._bloom is not None and item_id not in self._bloom:
+                    new_items.append(item)
+                else:
+                    to_check.append(item)
+        if to_check:
+            checked_new = await check(to_check)
+            new_ids = {key(item) for item in checked_new}
+            self.add(key(item) for item in to_check if key(item) not in new_ids)
+            new_items.extend(checked_new)
+        if len(new_items) < 2:
+            return new_items
+        new_ids = {key(item) for item in new_items}
+        return [item for item in items if key(item) in new_ids]
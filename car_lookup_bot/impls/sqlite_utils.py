@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS subscriptions_chat_id ON subscriptions (chat_id);
+
+CREATE TABLE IF NOT EXISTS seen_cars (
+    subs_id TEXT NOT NULL,
+    car_key TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (subs_id, car_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_cars_seen_at ON seen_cars (subs_id, seen_at);
+
+CREATE TABLE IF NOT EXISTS car_watermarks (
+    subs_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS seen_tickets (
+    subs_id TEXT NOT NULL,
+    ticket_id TEXT NOT NULL,
+    ticket_time REAL NOT NULL,
+    PRIMARY KEY (subs_id, ticket_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_tickets_time ON seen_tickets (subs_id, ticket_time);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+Query = Callable[[sqlite3.Connection], T]
+
+
+class SqliteDatabase:
+    """Single SQLite connection in WAL mode, used from its own thread
+
+    All queries run in one worker thread, so the event loop never blocks on
+    disk. Writes issued during the same loop iteration, or while a previous
+    batch is committed, are committed together in one transaction, each in
+    its own savepoint so a failing write does not affect the others.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        self._conn: sqlite3.Connection | None = None
+        self._pending: list[tuple[Query[Any], asyncio.Future[Any]]] = []
+        self._flush_task: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> SqliteDatabase:
+        await self._run(self._open)
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._run(self._close)
+        self._executor.shutdown()
+
+    async def read(self, query: Query[T]) -> T:
+        return await self._run(lambda: query(self._connection()))
+
+    async def write(self, query: Query[T]) -> T:
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        self._pending.append((query, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        batch: list[tuple[Query[Any], asyncio.Future[Any]]] = []
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await self._run(
+                        lambda: self._write_batch([query for query, _ in batch])
+                    )
+                except Exception as exc:
+                    # The whole transaction is rolled back
+                    self._fail(batch, exc)
+                    continue
+                for (_, future), (value, error) in zip(batch, results):
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(value)
+        except BaseException as exc:
+            interrupted = RuntimeError("SqliteDatabase write was interrupted")
+            interrupted.__cause__ = exc
+            self._fail(batch + self._pending, interrupted)
+            self._pending = []
+            raise
+        finally:
+            self._flush_task = None
+
+    def _fail(
+        self, batch: list[tuple[Query[Any], asyncio.Future[Any]]], exc: Exception
+    ) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+    def _write_batch(
+        self, queries: list[Query[Any]]
+    ) -> list[tuple[Any, Exception | None]]:
+        conn = self._connection()
+        res: list[tuple[Any, Exception | None]] = []
+        conn.execute("BEGIN")
+        try:
+            for query in queries:
+                conn.execute("SAVEPOINT write")
+                try:
+                    value = query(conn)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO write")
+                    res.append((None, exc))
+                else:
+                    res.append((value, None))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return res
+
+    async def _run(self, func: Callable[[], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func)
+
+    def _open(self) -> None:
+        # Transactions are managed explicitly
+        conn = sqlite3.connect(self._path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise RuntimeError("SqliteDatabase is used outside of its context")
+        return self._conn
@@ -1,3 +1,5 @@
+from collections.abc import Sequence
+
 from car_lookup_bot.subscriptions import Subscription, SubscriptionRepoABC
 
 
@@ -9,10 +11,22 @@ class InMemoryAuctionRepo(SubscriptionRepoABC):
         self.subs[subscription.id] = subscription
 
     async def update_subscription(self, subscription: Subscription) -> None:
-        self.subs[subscription.id] = subscription
+        if subscription.id in self.subs:
+            self.subs[subscription.id] = subscription
+
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        for subscription in subscriptions:
+            if subscription.id in self.subs:
+                self.subs[subscription.id] = subscription
 
     async def list_subscriptions(self) -> list[Subscription]:
         return list(self.subs.values())
 
+    async def list_chat_subscriptions(self, chat_id: int) -> list[Subscription]:
+        return [sub for sub in self.subs.values() if sub.chat_id == chat_id]
+
+    async def get_subscription(self, subs_id: str) -> Subscription | None:
+        return self.subs.get(subs_id)
+
     async def drop_subscription(self, subscription: Subscription) -> None:
         self.subs.pop(subscription.id, None)
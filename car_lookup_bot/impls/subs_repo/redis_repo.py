@@ -1,47 +1,136 @@
-from redis.asyncio import Redis
+import logging
+from collections.abc import Sequence
 
+from car_lookup_bot.impls.redis_utils import (
+    RedisClient,
+    RedisKeys,
+    RedisPipeline,
+    mget_by_slot,
+)
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
 from car_lookup_bot.subscriptions import (
-    CarSubscription,
     Subscription,
     SubscriptionRepoABC,
-    TicketSubscription,
+    load_subscription,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class RedisSubscriptionRepo(SubscriptionRepoABC):
+    """Every subscription is stored under its own key
+
+    Ids of all subscriptions and of subscriptions of every chat are kept
+    in sets.
+    """
+
     def __init__(
         self,
-        client: Redis,
+        client: RedisClient,
+        keys: RedisKeys | None = None,
     ) -> None:
         self._client = client
+        self._keys = keys or RedisKeys()
+        self._legacy_key = "subscriptions"
+
+    async def has_legacy(self) -> bool:
+        """Whether the legacy global "subscriptions" key is left"""
+        return bool(await self._client.exists(self._legacy_key))
+
+    async def migrate(self) -> None:
+        """Move subscriptions from the legacy global "subscriptions" key
 
+        It was either a set of subscription blobs or a hash of them by id.
+        """
+        key_type = await self._client.type(self._legacy_key)
+        if key_type == b"set":
+            entries = await self._client.smembers(self._legacy_key)
+        elif key_type == b"hash":
+            entries = await self._client.hvals(self._legacy_key)
+        else:
+            return
+        subs = [self._load_sub(entry) for entry in entries]
+        async with self._client.pipeline(transaction=False) as pipe:
+            for sub in subs:
+                self._add_to_pipe(pipe, sub)
+                pipe.unlink(f"{self._legacy_key}:chat:{sub.chat_id}")
+            await pipe.execute()
+        await self._client.unlink(self._legacy_key)
+        logger.info(f"Migrated {len(subs)} subscriptions to the per-key layout")
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="add_subscription")
     async def add_subscription(self, subscription: Subscription) -> None:
-        key = f"subscriptions"
-        await self._client.sadd(key, self._dump_sub(subscription))
+        async with self._client.pipeline(transaction=False) as pipe:
+            self._add_to_pipe(pipe, subscription)
+            await pipe.execute()
 
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="list_subscriptions")
     async def list_subscriptions(self) -> list[Subscription]:
-        key = f"subscriptions"
-        res: list[Subscription] = []
-        async for entry in self._client.sscan_iter(key):
-            res.append(self._load_sub(entry))
-        return res
+        ids = await self._client.smembers(self._keys.subscriptions())
+        return await self._load_subs(ids)
+
+    @timed(
+        REPO_OPERATION_SECONDS,
+        repo="subscriptions",
+        operation="list_chat_subscriptions",
+    )
+    async def list_chat_subscriptions(self, chat_id: int) -> list[Subscription]:
+        ids = await self._client.smembers(self._keys.chat_subscriptions(chat_id))
+        return await self._load_subs(ids)
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="get_subscription")
+    async def get_subscription(self, subs_id: str) -> Subscription | None:
+        entry = await self._client.get(self._keys.subscription(subs_id))
+        if entry is None:
+            return None
+        return self._load_sub(entry)
 
+    @timed(
+        REPO_OPERATION_SECONDS, repo="subscriptions", operation="update_subscription"
+    )
     async def update_subscription(self, subscription: Subscription) -> None:
-        subs = await self.list_subscriptions()
-        for sub in subs:
-            if sub.id == subscription.id:
-                await self.drop_subscription(sub)
-        await self.add_subscription(subscription)
+        # Subscription may be dropped by another worker in the meantime
+        await self._client.set(
+            self._keys.subscription(subscription.id),
+            self._dump_sub(subscription),
+            xx=True,
+        )
 
+    @timed(
+        REPO_OPERATION_SECONDS, repo="subscriptions", operation="update_subscriptions"
+    )
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        async with self._client.pipeline(transaction=False) as pipe:
+            for subscription in subscriptions:
+                pipe.set(
+                    self._keys.subscription(subscription.id),
+                    self._dump_sub(subscription),
+                    xx=True,
+                )
+            await pipe.execute()
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="drop_subscription")
     async def drop_subscription(self, subscription: Subscription) -> None:
-        key = f"subscriptions"
-        await self._client.srem(key, self._dump_sub(subscription))
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.unlink(self._keys.subscription(subscription.id))
+            pipe.srem(self._keys.subscriptions(), subscription.id)
+            pipe.srem(
+                self._keys.chat_subscriptions(subscription.chat_id), subscription.id
+            )
+            await pipe.execute()
+
+    def _add_to_pipe(self, pipe: RedisPipeline, sub: Subscription) -> None:
+        pipe.set(self._keys.subscription(sub.id), self._dump_sub(sub))
+        pipe.sadd(self._keys.subscriptions(), sub.id)
+        pipe.sadd(self._keys.chat_subscriptions(sub.chat_id), sub.id)
+
+    async def _load_subs(self, ids: set[bytes]) -> list[Subscription]:
+        keys = [self._keys.subscription(subs_id.decode()) for subs_id in ids]
+        entries = await mget_by_slot(self._client, keys)
+        return [self._load_sub(entry) for entry in entries if entry is not None]
 
     def _dump_sub(self, sub: Subscription) -> bytes:
         return sub.model_dump_json(by_alias=True).encode()
 
     def _load_sub(self, raw_data: bytes) -> Subscription:
-        try:
-            return CarSubscription.model_validate_json(raw_data)
-        except ValueError:
-            return TicketSubscription.model_validate_json(raw_data)
+        return load_subscription(raw_data)
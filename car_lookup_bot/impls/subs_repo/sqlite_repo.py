@@ -0,0 +1,91 @@
+from collections.abc import Sequence
+
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
+from car_lookup_bot.subscriptions import (
+    Subscription,
+    SubscriptionRepoABC,
+    load_subscription,
+)
+
+
+class SqliteSubscriptionRepo(SubscriptionRepoABC):
+    """Subscriptions are stored as JSON blobs next to their chat id"""
+
+    def __init__(self, db: SqliteDatabase) -> None:
+        self._db = db
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="add_subscription")
+    async def add_subscription(self, subscription: Subscription) -> None:
+        await self._db.write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO subscriptions (id, chat_id, data) "
+                "VALUES (?, ?, ?)",
+                (subscription.id, subscription.chat_id, self._dump_sub(subscription)),
+            )
+        )
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="list_subscriptions")
+    async def list_subscriptions(self) -> list[Subscription]:
+        rows = await self._db.read(
+            lambda conn: conn.execute("SELECT data FROM subscriptions").fetchall()
+        )
+        return [load_subscription(data) for data, in rows]
+
+    @timed(
+        REPO_OPERATION_SECONDS,
+        repo="subscriptions",
+        operation="list_chat_subscriptions",
+    )
+    async def list_chat_subscriptions(self, chat_id: int) -> list[Subscription]:
+        rows = await self._db.read(
+            lambda conn: conn.execute(
+                "SELECT data FROM subscriptions WHERE chat_id = ?", (chat_id,)
+            ).fetchall()
+        )
+        return [load_subscription(data) for data, in rows]
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="get_subscription")
+    async def get_subscription(self, subs_id: str) -> Subscription | None:
+        row = await self._db.read(
+            lambda conn: conn.execute(
+                "SELECT data FROM subscriptions WHERE id = ?", (subs_id,)
+            ).fetchone()
+        )
+        if row is None:
+            return None
+        return load_subscription(row[0])
+
+    @timed(
+        REPO_OPERATION_SECONDS, repo="subscriptions", operation="update_subscription"
+    )
+    async def update_subscription(self, subscription: Subscription) -> None:
+        # Subscription may be dropped in the meantime
+        await self._db.write(
+            lambda conn: conn.execute(
+                "UPDATE subscriptions SET data = ? WHERE id = ?",
+                (self._dump_sub(subscription), subscription.id),
+            )
+        )
+
+    @timed(
+        REPO_OPERATION_SECONDS, repo="subscriptions", operation="update_subscriptions"
+    )
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        rows = [(self._dump_sub(sub), sub.id) for sub in subscriptions]
+        await self._db.write(
+            lambda conn: conn.executemany(
+                "UPDATE subscriptions SET data = ? WHERE id = ?", rows
+            )
+        )
+
+    @timed(REPO_OPERATION_SECONDS, repo="subscriptions", operation="drop_subscription")
+    async def drop_subscription(self, subscription: Subscription) -> None:
+        await self._db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM subscriptions WHERE id = ?", (subscription.id,)
+            )
+        )
+
+    def _dump_sub(self, sub: Subscription) -> str:
+        return sub.model_dump_json(by_alias=True)
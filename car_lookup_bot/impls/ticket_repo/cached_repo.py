@@ -0,0 +1,79 @@
+import asyncio
+from collections.abc import Sequence
+
+from car_lookup_bot.exam_tickets import Ticket
+from car_lookup_bot.impls.seen_cache import SeenCache
+from car_lookup_bot.subscriptions import TicketRepoABC
+
+
+class CachedTicketRepo(TicketRepoABC):
+    """Keeps recently seen tickets of every subscription in process memory
+
+    Writes go through to the wrapped repo. Caches are warmed from the
+    wrapped repo by `warm` when polling starts, or on first use otherwise.
+    """
+
+    def __init__(
+        self,
+        repo: TicketRepoABC,
+        max_size: int = 200,
+        bloom_capacity: int | None = None,
+    ) -> None:
+        self._repo = repo
+        self._max_size = max_size
+        self._bloom_capacity = bloom_capacity
+        self._caches: dict[str, SeenCache] = {}
+        self._warm_concurrency = 16
+
+    async def add_ticket(self, ticket: Ticket, subs_id: str) -> None:
+        await self.add_tickets([ticket], subs_id)
+
+    async def has_ticket(self, ticket: Ticket, subs_id: str) -> bool:
+        return not await self.filter_new_tickets([ticket], subs_id)
+
+    async def add_tickets(self, tickets: Sequence[Ticket], subs_id: str) -> None:
+        await self._repo.add_tickets(tickets, subs_id)
+        cache = await self._get_cache(subs_id)
+        cache.add(ticket.id for ticket in tickets)
+
+    async def filter_new_tickets(
+        self, tickets: Sequence[Ticket], subs_id: str
+    ) -> list[Ticket]:
+        cache = await self._get_cache(subs_id)
+        return await cache.filter_new(
+            tickets,
+            lambda ticket: ticket.id,
+            lambda to_check: self._repo.filter_new_tickets(to_check, subs_id),
+        )
+
+    async def list_seen_tickets(self, subs_id: str) -> list[str]:
+        return await self._repo.list_seen_tickets(subs_id)
+
+    async def drop_subscription(self, subs_id: str) -> None:
+        self._caches.pop(subs_id, None)
+        await self._repo.drop_subscription(subs_id)
+
+    def evict(self, subs_id: str) -> None:
+        self._caches.pop(subs_id, None)
+        self._repo.evict(subs_id)
+
+    async def warm(self, subs_ids: Sequence[str]) -> None:
+        semaphore = asyncio.Semaphore(self._warm_concurrency)
+
+        async def warm_one(subs_id: str) -> None:
+            async with semaphore:
+                await self._get_cache(subs_id)
+
+        await asyncio.gather(
+            *(warm_one(subs_id) for subs_id in subs_ids if subs_id not in self._caches)
+        )
+
+    async def _get_cache(self, subs_id: str) -> SeenCache:
+        cache = self._caches.get(subs_id)
+        if cache is None:
+            seen = await self._repo.list_seen_tickets(subs_id)
+            # Could be warmed concurrently, first one wins
+            cache = self._caches.setdefault(
+                subs_id, SeenCache(seen, self._max_size, self._bloom_capacity)
+            )
+        return cache
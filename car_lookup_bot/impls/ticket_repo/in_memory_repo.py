@@ -1,3 +1,5 @@
+from collections.abc import Sequence
+
 from car_lookup_bot.exam_tickets import Ticket
 from car_lookup_bot.subscriptions import TicketRepoABC
 
@@ -11,3 +13,24 @@ class InMemoryTicketRepo(TicketRepoABC):
 
     async def has_ticket(self, ticket: Ticket, subs_id: str) -> bool:
         return (ticket.id, subs_id) in self.cars_ids
+
+    async def add_tickets(self, tickets: Sequence[Ticket], subs_id: str) -> None:
+        for ticket in tickets:
+            await self.add_ticket(ticket, subs_id)
+
+    async def filter_new_tickets(
+        self, tickets: Sequence[Ticket], subs_id: str
+    ) -> list[Ticket]:
+        return [
+            ticket for ticket in tickets if not await self.has_ticket(ticket, subs_id)
+        ]
+
+    async def list_seen_tickets(self, subs_id: str) -> list[str]:
+        return [
+            ticket_id
+            for ticket_id, entry_subs_id in self.cars_ids
+            if entry_subs_id == subs_id
+        ]
+
+    async def drop_subscription(self, subs_id: str) -> None:
+        self.cars_ids = {entry for entry in self.cars_ids if entry[-1] != subs_id}
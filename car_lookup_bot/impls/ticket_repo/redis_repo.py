@@ -1,24 +1,131 @@
-from redis.asyncio import Redis
+import datetime
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Collection, Sequence
 
 from car_lookup_bot.exam_tickets import Ticket
+from car_lookup_bot.impls.redis_utils import RedisClient, RedisKeys
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
 from car_lookup_bot.subscriptions import TicketRepoABC
 
+logger = logging.getLogger(__name__)
+
 
 class RedisTicketRepo(TicketRepoABC):
+    """Seen tickets are kept in a sorted set per subscription
+
+    Scores are ticket times, so tickets are trimmed once they are older
+    than `retention` and can not show up again.
+    """
+
     def __init__(
         self,
-        client: Redis,
+        client: RedisClient,
+        keys: RedisKeys | None = None,
+        retention: datetime.timedelta = datetime.timedelta(days=1),
     ) -> None:
         self._client = client
-        self._key = "tickets"
+        self._keys = keys or RedisKeys()
+        self._legacy_key = "tickets"
+        self._retention = retention.total_seconds()
 
     async def add_ticket(self, ticket: Ticket, subs_id: str) -> None:
-        await self._client.sadd("tickets", self._ticket_to_id(ticket, subs_id))
+        await self.add_tickets([ticket], subs_id)
 
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="has_ticket")
     async def has_ticket(self, ticket: Ticket, subs_id: str) -> bool:
-        return await self._client.sismember(
-            "tickets", self._ticket_to_id(ticket, subs_id)
+        score = await self._client.zscore(self._subs_key(subs_id), ticket.id)
+        return score is not None
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="add_tickets")
+    async def add_tickets(self, tickets: Sequence[Ticket], subs_id: str) -> None:
+        if not tickets:
+            return
+        key = self._subs_key(subs_id)
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {ticket.id: ticket.time.timestamp() for ticket in tickets})
+            pipe.zremrangebyscore(key, "-inf", time.time() - self._retention)
+            await pipe.execute()
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="filter_new_tickets")
+    async def filter_new_tickets(
+        self, tickets: Sequence[Ticket], subs_id: str
+    ) -> list[Ticket]:
+        if not tickets:
+            return []
+        scores = await self._client.zmscore(
+            self._subs_key(subs_id), [ticket.id for ticket in tickets]
         )
+        return [ticket for ticket, score in zip(tickets, scores) if score is None]
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="list_seen_tickets")
+    async def list_seen_tickets(self, subs_id: str) -> list[str]:
+        entries = await self._client.zrange(self._subs_key(subs_id), 0, -1)
+        return [entry.decode() for entry in entries]
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._client.unlink(self._subs_key(subs_id))
+
+    async def compact_legacy(
+        self, active_subs_ids: Collection[str], batch_size: int = 1000
+    ) -> int:
+        """Move entries of the legacy global "tickets" set to per-subscription sets
+
+        Entries of subscriptions that are not active anymore are dropped.
+        Returns the number of moved entries.
+        """
+        if not await self._client.exists(self._legacy_key):
+            return 0
+        moved = 0
+        batch: dict[str, dict[str, float]] = defaultdict(dict)
+        # Legacy entries have no ticket time, so keep them long enough
+        # to outlive any booking window
+        score = time.time() + datetime.timedelta(days=60).total_seconds()
+        async for entry in self._client.sscan_iter(self._legacy_key, count=batch_size):
+            ticket_id, _, subs_id = entry.decode().rpartition("|")
+            if subs_id not in active_subs_ids:
+                continue
+            batch[subs_id][ticket_id] = score
+            moved += 1
+            if moved % batch_size == 0:
+                await self._flush_legacy(batch)
+        await self._flush_legacy(batch)
+        await self._client.unlink(self._legacy_key)
+        logger.info(f"Moved {moved} legacy ticket entries")
+        return moved
+
+    async def has_legacy(self, subs_ids: Sequence[str]) -> bool:
+        """Whether any of the legacy unprefixed keys is left"""
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._legacy_key)
+            for subs_id in subs_ids:
+                pipe.exists(f"{self._legacy_key}:{subs_id}")
+            return any(await pipe.execute())
+
+    async def migrate(self, subs_ids: Sequence[str]) -> None:
+        """Move per-subscription sets from legacy unprefixed keys"""
+        legacy_keys = [f"{self._legacy_key}:{subs_id}" for subs_id in subs_ids]
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in legacy_keys:
+                pipe.exists(key)
+            exists = await pipe.execute()
+        for subs_id, key, found in zip(subs_ids, legacy_keys, exists):
+            if not found:
+                continue
+            entries = await self._client.zrange(key, 0, -1, withscores=True)
+            if entries:
+                await self._client.zadd(self._subs_key(subs_id), dict(entries), nx=True)
+            await self._client.unlink(key)
+            logger.info(f"Moved {len(entries)} seen tickets of {subs_id}")
+
+    async def _flush_legacy(self, batch: dict[str, dict[str, float]]) -> None:
+        async with self._client.pipeline(transaction=False) as pipe:
+            for subs_id, mapping in batch.items():
+                pipe.zadd(self._subs_key(subs_id), mapping, nx=True)
+            await pipe.execute()
+        batch.clear()
 
-    def _ticket_to_id(self, ticket: Ticket, subs_id: str) -> bytes:
-        return (ticket.id + "|" + subs_id).encode()
+    def _subs_key(self, subs_id: str) -> str:
+        return self._keys.seen_tickets(subs_id)
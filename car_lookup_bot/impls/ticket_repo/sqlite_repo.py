@@ -0,0 +1,87 @@
+import datetime
+import sqlite3
+import time
+from collections.abc import Sequence
+
+from car_lookup_bot.exam_tickets import Ticket
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.metrics import REPO_OPERATION_SECONDS, timed
+from car_lookup_bot.subscriptions import TicketRepoABC
+
+
+class SqliteTicketRepo(TicketRepoABC):
+    """Seen tickets are rows keyed by subscription id and ticket id
+
+    Like in the Redis repo, tickets are trimmed by their time once they are
+    older than `retention` and can not show up again.
+    """
+
+    def __init__(
+        self,
+        db: SqliteDatabase,
+        retention: datetime.timedelta = datetime.timedelta(days=1),
+    ) -> None:
+        self._db = db
+        self._retention = retention.total_seconds()
+
+    async def add_ticket(self, ticket: Ticket, subs_id: str) -> None:
+        await self.add_tickets([ticket], subs_id)
+
+    async def has_ticket(self, ticket: Ticket, subs_id: str) -> bool:
+        return not await self.filter_new_tickets([ticket], subs_id)
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="add_tickets")
+    async def add_tickets(self, tickets: Sequence[Ticket], subs_id: str) -> None:
+        if not tickets:
+            return
+        rows = [(subs_id, ticket.id, ticket.time.timestamp()) for ticket in tickets]
+
+        def query(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen_tickets (subs_id, ticket_id, ticket_time) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "DELETE FROM seen_tickets WHERE subs_id = ? AND ticket_time < ?",
+                (subs_id, time.time() - self._retention),
+            )
+
+        await self._db.write(query)
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="filter_new_tickets")
+    async def filter_new_tickets(
+        self, tickets: Sequence[Ticket], subs_id: str
+    ) -> list[Ticket]:
+        if not tickets:
+            return []
+        ids = [ticket.id for ticket in tickets]
+        placeholders = ",".join("?" * len(ids))
+        rows = await self._db.read(
+            lambda conn: conn.execute(
+                f"SELECT ticket_id FROM seen_tickets "
+                f"WHERE subs_id = ? AND ticket_id IN ({placeholders})",
+                (subs_id, *ids),
+            ).fetchall()
+        )
+        seen = {ticket_id for ticket_id, in rows}
+        return [ticket for ticket in tickets if ticket.id not in seen]
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="list_seen_tickets")
+    async def list_seen_tickets(self, subs_id: str) -> list[str]:
+        rows = await self._db.read(
+            lambda conn: conn.execute(
+                "SELECT ticket_id FROM seen_tickets WHERE subs_id = ? "
+                "ORDER BY ticket_time",
+                (subs_id,),
+            ).fetchall()
+        )
+        return [ticket_id for ticket_id, in rows]
+
+    @timed(REPO_OPERATION_SECONDS, repo="tickets", operation="drop_subscription")
+    async def drop_subscription(self, subs_id: str) -> None:
+        await self._db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM seen_tickets WHERE subs_id = ?", (subs_id,)
+            )
+        )
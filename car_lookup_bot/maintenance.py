@@ -0,0 +1,142 @@
+"""One-off maintenance commands for the bot storage"""
+import argparse
+import asyncio
+import datetime
+import logging
+import sys
+
+from car_lookup_bot.car_info_readers import RiaCarReader
+from car_lookup_bot.http_clients import HttpClients
+from car_lookup_bot.impls.car_repo.redis_repo import (
+    RedisCarRepo,
+    RedisWatermarkCarRepo,
+)
+from car_lookup_bot.impls.redis_utils import (
+    RedisClient,
+    RedisKeys,
+    make_redis_client,
+)
+from car_lookup_bot.impls.subs_repo.redis_repo import RedisSubscriptionRepo
+from car_lookup_bot.impls.ticket_repo.redis_repo import RedisTicketRepo
+from car_lookup_bot.settings import Settings
+from car_lookup_bot.subscriptions import CarSubscription
+
+logger = logging.getLogger(__name__)
+
+
+def _make_redis_client(settings: Settings) -> RedisClient:
+    if settings.REDIS_URL is None:
+        raise ValueError("Maintenance commands need REDIS_URL")
+    return make_redis_client(settings.REDIS_URL, settings.REDIS_CLUSTER_MODE)
+
+
+async def migrate_legacy(settings: Settings) -> None:
+    redis_client = _make_redis_client(settings)
+    await migrate_legacy_keys(settings, redis_client)
+    await redis_client.close()
+
+
+async def migrate_legacy_keys(settings: Settings, redis_client: RedisClient) -> None:
+    """Move data of old versions from unprefixed keys to `REDIS_KEY_PREFIX`
+
+    Legacy keys are not namespaced, so only the deployment that created
+    them may run it, other ones sharing the Redis would take its data.
+    """
+    redis_keys = RedisKeys(settings.REDIS_KEY_PREFIX)
+    subs_repo = RedisSubscriptionRepo(redis_client, redis_keys)
+    await subs_repo.migrate()
+    subs_ids = [sub.id for sub in await subs_repo.list_subscriptions()]
+    car_repo = RedisCarRepo(
+        redis_client, redis_keys, retention=settings.SEEN_CARS_RETENTION
+    )
+    ticket_repo = RedisTicketRepo(
+        redis_client, redis_keys, retention=settings.SEEN_TICKETS_RETENTION
+    )
+    await car_repo.migrate(subs_ids)
+    await ticket_repo.migrate(subs_ids)
+    # Otherwise every subscription would get its current listings again
+    await car_repo.compact_legacy(set(subs_ids))
+    await ticket_repo.compact_legacy(set(subs_ids))
+
+
+async def car_watermarks(settings: Settings) -> None:
+    redis_client = _make_redis_client(settings)
+    async with HttpClients() as http_clients:
+        await build_car_watermarks(settings, redis_client, http_clients)
+    await redis_client.close()
+
+
+async def build_car_watermarks(
+    settings: Settings, redis_client: RedisClient, http_clients: HttpClients
+) -> list[str]:
+    """Build watermarks of car subscriptions from their seen sets
+
+    Seen sets do not store add times, so the current results page of every
+    subscription is fetched and its listings that were seen become the
+    initial watermark window. If none of them is on the page, or the page
+    fails to load, everything added before the start counts as seen.
+    Seen sets are left in place, so it is still possible to switch back to
+    the "set" strategy. Returns ids of subscriptions whose page failed.
+    """
+    started = datetime.datetime.now()
+    redis_keys = RedisKeys(settings.REDIS_KEY_PREFIX)
+    subs_repo = RedisSubscriptionRepo(redis_client, redis_keys)
+    set_repo = RedisCarRepo(
+        redis_client, redis_keys, retention=settings.SEEN_CARS_RETENTION
+    )
+    watermark_repo = RedisWatermarkCarRepo(
+        redis_client,
+        redis_keys,
+        window=settings.CAR_WATERMARK_WINDOW,
+        window_size=settings.CAR_WATERMARK_WINDOW_SIZE,
+        retention=settings.SEEN_CARS_RETENTION,
+    )
+    subs = [
+        sub
+        for sub in await subs_repo.list_subscriptions()
+        if isinstance(sub, CarSubscription)
+    ]
+    failed: list[str] = []
+    for sub in subs:
+        seen = set(await set_repo.list_seen_cars(sub.id))
+        try:
+            reader = RiaCarReader(sub.ria_url, http_clients.get(sub.ria_url))
+            records = await reader.read_records()
+        except Exception:
+            logger.exception(f"Failed to read results of {sub.id}")
+            failed.append(sub.id)
+            records = []
+        seen_records = [
+            record
+            for record in records
+            if (record.provider_name, record.provider_car_id) in seen
+        ]
+        if seen_records:
+            await watermark_repo.add_cars(seen_records, sub.id)
+        else:
+            await watermark_repo.init_watermark(sub.id, started)
+        logger.info(f"Built watermark of {sub.id} from {len(seen_records)} seen cars")
+    if failed:
+        logger.warning(
+            f"Results of {len(failed)} car subscriptions failed to load, "
+            f"their watermarks start at {started}: {', '.join(failed)}"
+        )
+    return failed
+
+
+COMMANDS = {
+    "car-watermarks": car_watermarks,
+    "migrate-legacy": migrate_legacy,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    asyncio.run(COMMANDS[args.command](Settings()))
+
+
+if __name__ == "__main__":
+    main()
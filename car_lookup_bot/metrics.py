@@ -0,0 +1,261 @@
+"""In-process metrics exposed in the Prometheus text format"""
+from __future__ import annotations
+
+import bisect
+import functools
+import logging
+import math
+import time
+from collections.abc import (
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterator,
+    Mapping,
+    Sequence,
+)
+from contextlib import contextmanager
+from typing import Any, ParamSpec, TypeVar
+
+import httpx
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = tuple[str, ...]
+AsyncFunc = Callable[P, Coroutine[Any, Any, R]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _label_values(self, labels: Mapping[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(
+        self, values: LabelValues, extra: Mapping[str, str] | None = None
+    ) -> str:
+        pairs = list(zip(self.labelnames, values)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        labels = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+        return "{" + labels + "}"
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: object) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f"{self.name}{self._format_labels(key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._label_values(labels)] = value
+
+    def value(self, **labels: object) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f"{self.name}{self._format_labels(key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self._buckets = sorted(buckets)
+        # Per labels: bucket counts (the last one is +Inf), sum
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._label_values(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self._buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        total[0] += value
+
+    def count(self, **labels: object) -> int:
+        entry = self._values.get(self._label_values(labels))
+        return sum(entry[0]) if entry else 0
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip([*self._buckets, math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                labels = self._format_labels(key, {"le": le})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total[0]}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed(
+    histogram: Histogram, **labels: object
+) -> Callable[[AsyncFunc[P, R]], AsyncFunc[P, R]]:
+    """Observe duration of every call of the decorated coroutine function"""
+
+    def decorator(func: AsyncFunc[P, R]) -> AsyncFunc[P, R]:
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "car_lookup_http_request_seconds",
+    "Latency of upstream http requests",
+    ["host", "status"],
+)
+PARSE_SECONDS = Histogram(
+    "car_lookup_parse_seconds", "Time to parse a search page", ["parser"]
+)
+REPO_OPERATION_SECONDS = Histogram(
+    "car_lookup_repo_operation_seconds",
+    "Latency of storage operations",
+    ["repo", "operation"],
+)
+NOTIFICATION_SEND_SECONDS = Histogram(
+    "car_lookup_notification_send_seconds",
+    "Latency of Telegram send calls",
+    ["method"],
+)
+NOTIFICATION_FAILURES = Counter(
+    "car_lookup_notification_failures_total",
+    "Failed Telegram send calls",
+    ["reason"],
+)
+POLL_LATENESS_SECONDS = Histogram(
+    "car_lookup_poll_lateness_seconds",
+    "How late polls start compared to their schedule",
+    ["host"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+CAR_POLL_FINGERPRINT_HITS = Counter(
+    "car_lookup_car_poll_fingerprint_hits_total",
+    "AutoRia polls that skipped parsing and dedupe as results did not change",
+)
+ACTIVE_SUBSCRIPTIONS = Gauge(
+    "car_lookup_active_subscriptions",
+    "Subscriptions polled by this process",
+    ["type"],
+)
+
+
+async def _on_request(request: httpx.Request) -> None:
+    request.extensions["car_lookup_started"] = time.perf_counter()
+
+
+async def _on_response(response: httpx.Response) -> None:
+    started = response.request.extensions.get("car_lookup_started")
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            host=response.request.url.host,
+            status=response.status_code,
+        )
+
+
+def http_event_hooks() -> dict[str, list[Callable[[Any], Awaitable[None]]]]:
+    """httpx event hooks that record request latency per host"""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+class MetricsServer:
+    """Serves `render()` at /metrics"""
+
+    def __init__(self, port: int, host: str = "0.0.0.0") -> None:
+        self._port = port
+        self._host = host
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app)
+
+    async def __aenter__(self) -> MetricsServer:
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        logger.info(f"Serving metrics on {self._host}:{self._port}")
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain; version=0.0.4")
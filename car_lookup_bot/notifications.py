@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from collections.abc import Sequence
+from contextlib import suppress
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from aiogram.types import InputMediaPhoto
+from pydantic import BaseModel, Field
+
+from car_lookup_bot.metrics import NOTIFICATION_FAILURES, NOTIFICATION_SEND_SECONDS
+from car_lookup_bot.rate_limits import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_SIZE = 10
+
+
+class Notification(BaseModel):
+    id: str
+    chat_id: int
+    text: str
+    photo_url: str | None = None
+    created_at: float = Field(default_factory=time.time)
+    attempts: int = 0
+
+
+class NotificationRepoABC(abc.ABC):
+    @abc.abstractmethod
+    async def add_notifications(self, notifications: Sequence[Notification]) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def list_notifications(self) -> list[Notification]:
+        pass
+
+    @abc.abstractmethod
+    async def drop_notifications(self, ids: Sequence[str]) -> None:
+        pass
+
+
+class NotificationDispatcher:
+    """Sends notifications to Telegram within its flood limits
+
+    Notifications stay in the repo until they are delivered, so they survive
+    restarts. Each chat gets at most one message per `chat_interval`
+    (three times longer for group chats), and all chats together are
+    limited by `global_rate`. Consecutive photo notifications for a chat
+    are sent as a single media group.
+
+    Sharded workers send their notifications independently, and the same
+    chat can get them from several workers, so both limits are split
+    between live workers with `set_workers`.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        repo: NotificationRepoABC,
+        global_rate: float = 25.0,
+        chat_interval: float = 1.0,
+        senders: int = 8,
+        max_attempts: int = 5,
+    ) -> None:
+        self._bot = bot
+        self._repo = repo
+        self._global_rate = global_rate
+        self._global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self._chat_interval = chat_interval
+        self._workers = 1
+        self._senders = senders
+        self._max_attempts = max_attempts
+        self._pending: dict[str, Notification] = {}
+        self._queues: dict[int, deque[Notification]] = {}
+        self._ready: list[tuple[float, int, int]] = []
+        self._scheduled: set[int] = set()
+        self._next_send: dict[int, float] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    async def __aenter__(self) -> NotificationDispatcher:
+        pending = await self._repo.list_notifications()
+        if pending:
+            logger.info(f"Resending {len(pending)} undelivered notifications")
+        self._put(sorted(pending, key=lambda item: item.created_at))
+        for _ in range(self._senders):
+            self._tasks.append(asyncio.create_task(self._send_loop()))
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        for task in self._tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks.clear()
+
+    async def enqueue(self, notifications: Sequence[Notification]) -> None:
+        new = [item for item in notifications if item.id not in self._pending]
+        if not new:
+            return
+        await self._repo.add_notifications(new)
+        self._put(new)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def set_workers(self, workers: int) -> None:
+        """Keep the limits for the number of workers that share the bot"""
+        self._workers = max(workers, 1)
+        rate = self._global_rate / self._workers
+        self._global_bucket.set_max_rate(rate, burst=max(rate, 1.0))
+
+    def _put(self, notifications: Sequence[Notification]) -> None:
+        for item in notifications:
+            self._pending[item.id] = item
+            self._queues.setdefault(item.chat_id, deque()).append(item)
+            self._schedule_chat(item.chat_id)
+
+    def _schedule_chat(self, chat_id: int) -> None:
+        if chat_id in self._scheduled or not self._queues.get(chat_id):
+            return
+        self._scheduled.add(chat_id)
+        ready_at = self._next_send.get(chat_id, 0.0)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _next_chat(self) -> int:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._ready:
+                ready_at, _, chat_id = self._ready[0]
+                timeout = ready_at - loop.time()
+                if timeout <= 0:
+                    heapq.heappop(self._ready)
+                    return chat_id
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    async def _send_loop(self) -> None:
+        while True:
+            chat_id = await self._next_chat()
+            try:
+                await self._process_chat(chat_id)
+            except Exception:
+                logger.exception(f"Failed to process notifications for {chat_id}")
+            finally:
+                self._scheduled.discard(chat_id)
+                if not self._queues.get(chat_id):
+                    self._queues.pop(chat_id, None)
+                self._schedule_chat(chat_id)
+
+    async def _process_chat(self, chat_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queues[chat_id]
+        batch = [queue.popleft()]
+        while (
+            batch[0].photo_url
+            and queue
+            and queue[0].photo_url
+            and len(batch) < MEDIA_GROUP_SIZE
+        ):
+            batch.append(queue.popleft())
+        for _ in batch:
+            await self._global_bucket.acquire()
+        try:
+            await self._send(chat_id, batch)
+        except TelegramRetryAfter as e:
+            NOTIFICATION_FAILURES.inc(reason="retry_after")
+            logger.warning(f"Flood limit for chat {chat_id}, retry in {e.retry_after}")
+            queue.extendleft(reversed(batch))
+            self._next_send[chat_id] = loop.time() + e.retry_after
+            self._global_bucket.penalize()
+            return
+        except TelegramForbiddenError:
+            NOTIFICATION_FAILURES.inc(reason="forbidden")
+            logger.warning(f"Bot can not write to chat {chat_id}, dropping messages")
+            await self._drop(batch)
+            return
+        except TelegramBadRequest:
+            NOTIFICATION_FAILURES.inc(reason="bad_request")
+            if not any(item.photo_url for item in batch):
+                logger.exception(f"Failed to send message to {chat_id}")
+                await self._drop(batch)
+                return
+            # Most likely the photo is broken, send just the text then
+            for item in batch:
+                item.photo_url = None
+            queue.extendleft(reversed(batch))
+            return
+        except Exception:
+            NOTIFICATION_FAILURES.inc(reason="error")
+            logger.exception(f"Failed to send message to {chat_id}")
+            retry = []
+            for item in batch:
+                item.attempts += 1
+                if item.attempts < self._max_attempts:
+                    retry.append(item)
+            await self._drop([item for item in batch if item not in retry])
+            queue.extendleft(reversed(retry))
+            self._next_send[chat_id] = loop.time() + 2 ** batch[0].attempts
+            return
+        await self._drop(batch)
+        self._global_bucket.reward()
+        interval = self._chat_interval * self._workers * (3 if chat_id < 0 else 1)
+        self._next_send[chat_id] = loop.time() + interval * len(batch)
+
+    async def _send(self, chat_id: int, batch: list[Notification]) -> None:
+        if len(batch) > 1:
+            with NOTIFICATION_SEND_SECONDS.time(method="send_media_group"):
+                await self._bot.send_media_group(
+                    chat_id=chat_id,
+                    media=[
+                        InputMediaPhoto(media=item.photo_url or "", caption=item.text)
+                        for item in batch
+                    ],
+                )
+        elif batch[0].photo_url:
+            with NOTIFICATION_SEND_SECONDS.time(method="send_photo"):
+                await self._bot.send_photo(
+                    chat_id=chat_id, photo=batch[0].photo_url, caption=batch[0].text
+                )
+        else:
+            with NOTIFICATION_SEND_SECONDS.time(method="send_message"):
+                await self._bot.send_message(chat_id=chat_id, text=batch[0].text)
+
+    async def _drop(self, batch: list[Notification]) -> None:
+        for item in batch:
+            self._pending.pop(item.id, None)
+        if batch:
+            await self._repo.drop_notifications([item.id for item in batch])
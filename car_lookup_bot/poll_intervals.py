@@ -0,0 +1,94 @@
+import datetime
+import math
+from collections.abc import Sequence
+
+MINUTES_IN_DAY = 24 * 60
+
+
+def estimate_arrival_rate(add_times: Sequence[datetime.datetime]) -> float | None:
+    """Guess listings per hour from add times of listings on a search page"""
+    if len(add_times) < 2:
+        return None
+    span = (max(add_times) - min(add_times)).total_seconds() / 3600
+    if span <= 0:
+        return None
+    return (len(add_times) - 1) / span
+
+
+def update_arrival_rate(
+    rate: float | None, arrivals: int, elapsed: float, window: float
+) -> float:
+    """Exponentially weighted listings per hour for irregular observations
+
+    `elapsed` is the time in seconds covered by the observation, older
+    observations fade out with time constant `window` (also in seconds).
+    """
+    observed = arrivals * 3600 / elapsed
+    if rate is None:
+        return observed
+    decay = math.exp(-elapsed / window)
+    return decay * rate + (1 - decay) * observed
+
+
+def record_release_minute(
+    minutes: Sequence[int], when: datetime.datetime, keep: int = 24
+) -> list[int]:
+    minute = when.hour * 60 + when.minute
+    res = [item for item in minutes if item != minute]
+    res.append(minute)
+    return res[-keep:]
+
+
+class PollIntervals:
+    """Picks how long to wait before the next poll of a subscription
+
+    Car searches are polled so that about `target_arrivals` new listings
+    are expected between polls. Ticket subscriptions are polled as often
+    as allowed around minutes of day when new tickets used to show up
+    and back off to `ticket_max_interval` otherwise.
+    """
+
+    def __init__(
+        self,
+        base_interval: datetime.timedelta = datetime.timedelta(seconds=30),
+        min_interval: datetime.timedelta = datetime.timedelta(seconds=15),
+        max_interval: datetime.timedelta = datetime.timedelta(minutes=10),
+        target_arrivals: float = 0.5,
+        rate_window: datetime.timedelta = datetime.timedelta(hours=6),
+        ticket_max_interval: datetime.timedelta = datetime.timedelta(minutes=2),
+        release_window: datetime.timedelta = datetime.timedelta(minutes=5),
+    ) -> None:
+        self.base_interval = base_interval.total_seconds()
+        self.min_interval = min_interval.total_seconds()
+        self.max_interval = max_interval.total_seconds()
+        self.target_arrivals = target_arrivals
+        self.rate_window = rate_window.total_seconds()
+        self.ticket_max_interval = ticket_max_interval.total_seconds()
+        self.release_window = release_window.total_seconds() / 60
+
+    def _clamp(self, interval: float, max_interval: float) -> float:
+        return min(max(interval, self.min_interval), max_interval)
+
+    def for_arrival_rate(self, rate: float | None) -> float:
+        if rate is None:
+            return self._clamp(self.base_interval, self.max_interval)
+        if rate <= 0:
+            return self.max_interval
+        return self._clamp(self.target_arrivals * 3600 / rate, self.max_interval)
+
+    def for_release_minutes(
+        self, minutes: Sequence[int], now: datetime.datetime
+    ) -> float:
+        max_interval = max(self.ticket_max_interval, self.min_interval)
+        if not minutes:
+            return self._clamp(self.base_interval, max_interval)
+        current = now.hour * 60 + now.minute + now.second / 60
+        until_window = float(MINUTES_IN_DAY)
+        for minute in minutes:
+            ahead = (minute - current) % MINUTES_IN_DAY
+            if ahead <= self.release_window or (
+                MINUTES_IN_DAY - ahead <= self.release_window
+            ):
+                return self.min_interval
+            until_window = min(until_window, ahead - self.release_window)
+        return self._clamp(until_window * 60, max_interval)
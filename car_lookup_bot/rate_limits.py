@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Token bucket rate limiter that adapts to upstream errors
+
+    The rate is halved on every penalty (and requests are paused for the
+    `Retry-After` time if it is known) and grows back by `increase` on
+    every success, up to the initial rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1.0,
+        min_rate: float = 0.1,
+        increase: float = 0.1,
+    ) -> None:
+        self.rate = rate
+        self._max_rate = rate
+        self._min_rate = min_rate
+        self._increase = increase
+        self._burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, retry_after: float | None = None) -> None:
+        self.rate = max(self._min_rate, self.rate / 2)
+        if retry_after is not None:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def set_max_rate(self, rate: float, burst: float | None = None) -> None:
+        """Change the rate the bucket grows back to"""
+        self._max_rate = rate
+        self.rate = min(self.rate, rate)
+        if burst is not None:
+            self._burst = burst
+            self._tokens = min(self._tokens, burst)
+
+    def reward(self) -> None:
+        self.rate = min(self._max_rate, self.rate + self._increase)
@@ -1,9 +1,72 @@
+import datetime
+import socket
+from typing import Literal
+
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     LOG_LEVEL: str = "info"
+    METRICS_PORT: int | None = None
+
+    TELEGRAM_TOKEN: str | None = None
+    # Base url of a local Bot API server or a stand-in for load tests
+    TELEGRAM_API_URL: str | None = None
+
+    STORAGE_BACKEND: Literal["redis", "sqlite"] = "redis"
+    SQLITE_PATH: str = "car_lookup_bot.sqlite3"
 
-    REDIS_URL: str
+    REDIS_URL: str | None = None
     REDIS_CLUSTER_MODE: bool = False
     REDIS_KEY_PREFIX: str = "louvre"
+    # Move data of old versions from unprefixed keys on start, only for
+    # the deployment that owns them
+    REDIS_MIGRATE_LEGACY: bool = False
+
+    SHARDING: bool = False
+    WORKER_ID: str = Field(default_factory=socket.gethostname)
+    SHARD_LEASE_TTL: datetime.timedelta = datetime.timedelta(seconds=15)
+
+    # Polls running at once are bounded both by POLL_WORKERS and by the sum
+    # of per-host limits, hosts that are not listed get 4
+    POLL_WORKERS: int = 16
+    POLL_HOST_LIMITS: dict[str, int] = {"auto.ria.com": 4, "eq.hsc.gov.ua": 2}
+    WARM_START_BATCH: int = 500
+    POLL_JITTER: float = 0.1
+    POLL_INTERVAL: datetime.timedelta = datetime.timedelta(seconds=30)
+    POLL_MIN_INTERVAL: datetime.timedelta = datetime.timedelta(seconds=15)
+    POLL_MAX_INTERVAL: datetime.timedelta = datetime.timedelta(minutes=10)
+    POLL_TARGET_ARRIVALS: float = 0.5
+    TICKET_POLL_MAX_INTERVAL: datetime.timedelta = datetime.timedelta(minutes=2)
+    TICKET_RELEASE_WINDOW: datetime.timedelta = datetime.timedelta(minutes=5)
+    TICKET_REQUESTS_PER_SECOND: float = 2.0
+    TICKET_OFFICE_REQUESTS_PER_SECOND: float = 5.0
+    TICKET_MAX_CONCURRENCY: int = 3
+    TICKET_MAX_RETRIES: int = 3
+    # Stand-in for the tickets site in load tests
+    TICKETS_BASE_URL: str = "https://eq.hsc.gov.ua"
+    RIA_PARSER: str = "stream"
+    RIA_MAX_PAGES: int = 5
+    SUBS_FLUSH_INTERVAL: datetime.timedelta = datetime.timedelta(seconds=5)
+    PARSE_EXECUTOR: str = "none"
+    PARSE_WORKERS: int = 2
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 10
+    HTTP2: bool = False
+    HTTP_SHARED_TTL: float = 10.0
+
+    # Limits of the whole bot, sharded workers split them between each other
+    TELEGRAM_GLOBAL_RATE: float = 25.0
+    TELEGRAM_CHAT_INTERVAL: float = 1.0
+    NOTIFICATION_SENDERS: int = 8
+
+    # "set" keeps every seen car, "watermark" the newest add time and a window
+    CAR_DEDUPE_STRATEGY: Literal["set", "watermark"] = "set"
+    CAR_WATERMARK_WINDOW: datetime.timedelta = datetime.timedelta(hours=1)
+    CAR_WATERMARK_WINDOW_SIZE: int = 100
+
+    SEEN_CARS_RETENTION: datetime.timedelta = datetime.timedelta(days=30)
+    SEEN_TICKETS_RETENTION: datetime.timedelta = datetime.timedelta(days=1)
+
+    SEEN_CACHE_SIZE: int = 200
+    SEEN_CACHE_BLOOM_CAPACITY: int = 0
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from contextlib import suppress
+from typing import Any, Literal
+
+from pydantic import BaseModel
+from redis.asyncio import Redis, RedisCluster
+
+logger = logging.getLogger(__name__)
+
+# Renew the lease only if it still belongs to us
+_RENEW_LEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class ShardEvent(BaseModel):
+    kind: Literal["added", "dropped", "rebalance"]
+    subscription_id: str | None = None
+
+
+ShardListener = Callable[[ShardEvent], Awaitable[None]]
+
+
+def rendezvous_owner(key: str, workers: Sequence[str]) -> str | None:
+    """Pick the worker with the highest hash for the key
+
+    Only keys of a leaving worker move when the set of workers changes.
+    """
+
+    def weight(worker: str) -> bytes:
+        return hashlib.blake2b(f"{worker}:{key}".encode(), digest_size=8).digest()
+
+    if not workers:
+        return None
+    return max(workers, key=weight)
+
+
+class ShardCoordinator:
+    """Splits subscriptions between bot workers through Redis
+
+    Every worker keeps a heartbeat in a sorted set scored by lease expiry
+    time and owns the keys that rendezvous hashing assigns to it among
+    live workers. Listeners get a `rebalance` event when workers join or
+    leave, and `added`/`dropped` events published by other workers.
+
+    One of the workers also holds the leader lease, it is the one that
+    should receive Telegram updates.
+
+    Cluster clients can not subscribe to channels, so `pubsub_client`
+    connected to any node of the cluster has to be passed with them.
+    """
+
+    def __init__(
+        self,
+        client: Redis | RedisCluster,
+        worker_id: str,
+        lease_ttl: datetime.timedelta = datetime.timedelta(seconds=15),
+        key_prefix: str = "louvre",
+        pubsub_client: Redis | None = None,
+    ) -> None:
+        self._client = client
+        if pubsub_client is None:
+            if not isinstance(client, Redis):
+                raise ValueError("pubsub_client is required for cluster clients")
+            pubsub_client = client
+        self._pubsub_client = pubsub_client
+        self.worker_id = worker_id
+        self._lease_ttl = lease_ttl.total_seconds()
+        self._workers_key = f"{key_prefix}:workers"
+        self._leader_key = f"{key_prefix}:workers:leader"
+        self._channel = f"{key_prefix}:workers:events"
+        self._workers: list[str] = [worker_id]
+        self._listeners: list[ShardListener] = []
+        self._leader_changed = asyncio.Event()
+        self.is_leader = False
+        # Heartbeats of the loop and of rebalance events must not both
+        # try to take the lease, the loser would think it is not the leader
+        self._leadership_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    async def __aenter__(self) -> ShardCoordinator:
+        await self._heartbeat()
+        await self.publish(ShardEvent(kind="rebalance"))
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        self._tasks.append(asyncio.create_task(self._listen()))
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        for task in self._tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks.clear()
+        await self._client.zrem(self._workers_key, self.worker_id)
+        await self._client.eval(_RELEASE_LEASE, 1, self._leader_key, self.worker_id)
+        await self.publish(ShardEvent(kind="rebalance"))
+
+    def add_listener(self, listener: ShardListener) -> None:
+        self._listeners.append(listener)
+
+    def workers(self) -> list[str]:
+        return list(self._workers)
+
+    async def refresh(self) -> None:
+        """Update live workers and leadership right away"""
+        await self._heartbeat()
+
+    def owns(self, key: str) -> bool:
+        return rendezvous_owner(key, self._workers) == self.worker_id
+
+    async def publish(self, event: ShardEvent) -> None:
+        await self._client.publish(self._channel, event.model_dump_json())
+
+    async def wait_leadership(self, is_leader: bool = True) -> None:
+        """Wait until this worker becomes (or stops being) the leader"""
+        while self.is_leader != is_leader:
+            self._leader_changed.clear()
+            await self._leader_changed.wait()
+
+    async def _heartbeat(self) -> None:
+        now = time.time()
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self._workers_key, {self.worker_id: now + self._lease_ttl})
+            pipe.zremrangebyscore(self._workers_key, "-inf", now)
+            pipe.zrange(self._workers_key, 0, -1)
+            _, _, workers = await pipe.execute()
+        workers = sorted(worker.decode() for worker in workers)
+        if workers != self._workers:
+            logger.info(f"Live workers changed to {workers}")
+            self._workers = workers
+            await self._notify(ShardEvent(kind="rebalance"))
+        await self._refresh_leadership()
+
+    async def _refresh_leadership(self) -> None:
+        async with self._leadership_lock:
+            await self._refresh_leadership_locked()
+
+    async def _refresh_leadership_locked(self) -> None:
+        ttl_ms = int(self._lease_ttl * 1000)
+        if self.is_leader:
+            is_leader = bool(
+                await self._client.eval(
+                    _RENEW_LEASE, 1, self._leader_key, self.worker_id, ttl_ms
+                )
+            )
+        else:
+            is_leader = bool(
+                await self._client.set(
+                    self._leader_key, self.worker_id, nx=True, px=ttl_ms
+                )
+            )
+        if is_leader != self.is_leader:
+            logger.info(f"Worker {self.worker_id} leadership: {is_leader}")
+            self.is_leader = is_leader
+            self._leader_changed.set()
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._lease_ttl / 3)
+            try:
+                await self._heartbeat()
+            except Exception:
+                logger.exception("Failed to send worker heartbeat")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await self._listen_once()
+            except Exception:
+                logger.exception("Failed to listen for worker events")
+                await asyncio.sleep(1)
+
+    async def _listen_once(self) -> None:
+        async with self._pubsub_client.pubsub() as pubsub:
+            await pubsub.subscribe(self._channel)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                event = ShardEvent.model_validate_json(message["data"])
+                if event.kind == "rebalance":
+                    # Pick up the new set of workers right away
+                    await self._heartbeat()
+                else:
+                    await self._notify(event)
+
+    async def _notify(self, event: ShardEvent) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(event)
+            except Exception:
+                logger.exception(f"Failed to handle shard event {event}")
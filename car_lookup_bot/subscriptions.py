@@ -3,38 +3,102 @@ from __future__ import annotations
 import abc
 import asyncio
 import datetime
+import functools
+import heapq
+import itertools
 import logging
+import random
 import secrets
 import textwrap
-from collections.abc import Iterable
+from collections.abc import Awaitable, Callable, Mapping, Sequence
 from contextlib import suppress
-from typing import Any, Union
-
-from aiogram import Bot
-from pydantic import BaseModel, Field
-
-from car_lookup_bot.car_info_readers import CarInfo, CarReader, RiaCarReader
-from car_lookup_bot.exam_tickets import TickerReaderConf, Ticket, TicketReader
+from typing import Annotated, Any, Literal, Union
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from car_lookup_bot.car_info_readers import (
+    CarIdentity,
+    CarInfo,
+    CarT,
+    RiaCarReader,
+    RiaCarRecord,
+    normalize_ria_url,
+    ria_page_fingerprint,
+)
+from car_lookup_bot.exam_tickets import (
+    OfficeBuckets,
+    TickerReaderConf,
+    Ticket,
+    TicketReader,
+    TicketReaderOptions,
+)
+from car_lookup_bot.executors import ParseExecutor
+from car_lookup_bot.http_clients import HttpClients, SingleFlight
+from car_lookup_bot.metrics import (
+    ACTIVE_SUBSCRIPTIONS,
+    CAR_POLL_FINGERPRINT_HITS,
+    POLL_LATENESS_SECONDS,
+)
+from car_lookup_bot.notifications import Notification, NotificationDispatcher
+from car_lookup_bot.poll_intervals import (
+    PollIntervals,
+    estimate_arrival_rate,
+    record_release_minute,
+    update_arrival_rate,
+)
+from car_lookup_bot.sharding import ShardCoordinator, ShardEvent
 
 logger = logging.getLogger(__name__)
 
 
 class CarSubscription(BaseModel):
+    type: Literal["car"] = "car"
     id: str = Field(default_factory=lambda: secrets.token_hex(3))
     ria_url: str
     chat_id: int
     last_update: datetime.datetime | None = None
+    results_fingerprint: str | None = None
+    # New listings per hour, learned from polls
+    arrival_rate: float | None = None
+    # Add time of the newest processed listing
+    watermark: datetime.datetime | None = None
 
 
 class TicketSubscription(BaseModel):
+    type: Literal["ticket"] = "ticket"
     id: str = Field(default_factory=lambda: secrets.token_hex(3))
     conf: TickerReaderConf
     chat_id: int
     last_update: datetime.datetime | None = None
+    # Minutes of day when new tickets showed up
+    release_minutes: list[int] = Field(default_factory=list)
 
 
 Subscription = Union[CarSubscription, TicketSubscription]
 
+_subscription_adapter: TypeAdapter[Subscription] = TypeAdapter(
+    Annotated[Subscription, Field(discriminator="type")]  # type: ignore[arg-type]
+)
+
+
+def load_subscription(raw_data: bytes | str) -> Subscription:
+    """Parse a serialized subscription of any type
+
+    Subscriptions saved before the "type" field was added are told apart
+    by their fields.
+    """
+    try:
+        return _subscription_adapter.validate_json(raw_data)
+    except ValidationError as exc:
+        errors = exc.errors()
+        if errors[0]["type"] != "union_tag_not_found":
+            raise
+        data = errors[0]["input"]
+    if "ria_url" in data:
+        return CarSubscription.model_validate(data)
+    return TicketSubscription.model_validate(data)
+
 
 class SubscriptionRepoABC(abc.ABC):
     @abc.abstractmethod
@@ -45,10 +109,22 @@ class SubscriptionRepoABC(abc.ABC):
     async def update_subscription(self, subscription: Subscription) -> None:
         pass
 
+    @abc.abstractmethod
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        pass
+
     @abc.abstractmethod
     async def list_subscriptions(self) -> list[Subscription]:
         pass
 
+    @abc.abstractmethod
+    async def list_chat_subscriptions(self, chat_id: int) -> list[Subscription]:
+        pass
+
+    @abc.abstractmethod
+    async def get_subscription(self, subs_id: str) -> Subscription | None:
+        pass
+
     @abc.abstractmethod
     async def drop_subscription(self, subscription: Subscription) -> None:
         pass
@@ -56,13 +132,35 @@ class SubscriptionRepoABC(abc.ABC):
 
 class CarRepoABC(abc.ABC):
     @abc.abstractmethod
-    async def add_car(self, car_info: CarInfo, subs_id: str) -> None:
+    async def add_car(self, car_info: CarIdentity, subs_id: str) -> None:
         pass
 
     @abc.abstractmethod
-    async def has_car(self, car_info: CarInfo, subs_id: str) -> bool:
+    async def has_car(self, car_info: CarIdentity, subs_id: str) -> bool:
         pass
 
+    @abc.abstractmethod
+    async def add_cars(self, cars: Sequence[CarIdentity], subs_id: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def filter_new_cars(self, cars: Sequence[CarT], subs_id: str) -> list[CarT]:
+        """Return cars that were not added yet, keeping their order"""
+
+    @abc.abstractmethod
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        """Return (provider_name, provider_car_id) of all cars seen by subscription"""
+
+    @abc.abstractmethod
+    async def drop_subscription(self, subs_id: str) -> None:
+        """Forget all cars seen by given subscription"""
+
+    def evict(self, subs_id: str) -> None:
+        """Free in-process state of a subscription polled by another worker now"""
+
+    async def warm(self, subs_ids: Sequence[str]) -> None:
+        """Load in-process state of subscriptions that are about to be polled"""
+
 
 class TicketRepoABC(abc.ABC):
     @abc.abstractmethod
@@ -73,136 +171,740 @@ class TicketRepoABC(abc.ABC):
     async def has_ticket(self, ticket: Ticket, subs_id: str) -> bool:
         pass
 
+    @abc.abstractmethod
+    async def add_tickets(self, tickets: Sequence[Ticket], subs_id: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def filter_new_tickets(
+        self, tickets: Sequence[Ticket], subs_id: str
+    ) -> list[Ticket]:
+        """Return tickets that were not added yet, keeping their order"""
+
+    @abc.abstractmethod
+    async def list_seen_tickets(self, subs_id: str) -> list[str]:
+        """Return ids of all tickets seen by subscription, oldest first"""
+
+    @abc.abstractmethod
+    async def drop_subscription(self, subs_id: str) -> None:
+        """Forget all tickets seen by given subscription"""
+
+    def evict(self, subs_id: str) -> None:
+        """Free in-process state of a subscription polled by another worker now"""
+
+    async def warm(self, subs_ids: Sequence[str]) -> None:
+        """Load in-process state of subscriptions that are about to be polled"""
+
+
+class PollSchedulerStats(BaseModel):
+    scheduled: int
+    queue_depth: int
+    running: int
+    last_lateness: float
+    max_lateness: float
+
+
+class _PollJob:
+    def __init__(
+        self, key: str, host: str, poll: Callable[[], Awaitable[None]]
+    ) -> None:
+        self.key = key
+        self.host = host
+        self.poll = poll
+        self.due = 0.0
+        self.interval: float | None = None
+        self.running: asyncio.Future[None] | None = None
+
+
+class PollScheduler:
+    """Runs every registered poll once per interval
+
+    The interval can be changed per poll with `set_interval`, the new value
+    is used starting from the next run.
+
+    Next due times are kept in a heap. Due polls are put to a queue per
+    upstream host, which is drained by as many workers as the host allows,
+    and all hosts together share the bounded worker pool. So at most the
+    smaller of `workers` and the sum of host limits polls run at once.
+    """
+
+    def __init__(
+        self,
+        interval: datetime.timedelta,
+        workers: int = 16,
+        jitter: float = 0.1,
+        host_limits: Mapping[str, int] | None = None,
+        default_host_limit: int = 4,
+    ) -> None:
+        self._interval = interval.total_seconds()
+        self._jitter = jitter
+        self._pool = asyncio.Semaphore(workers)
+        self._host_limits = dict(host_limits or {})
+        self._default_host_limit = default_host_limit
+        self._jobs: dict[str, _PollJob] = {}
+        self._heap: list[tuple[float, int, _PollJob]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._host_queues: dict[str, asyncio.Queue[_PollJob]] = {}
+        self._tasks: list[asyncio.Task[None]] = []
+        self._running = 0
+        self._last_lateness = 0.0
+        self._max_lateness = 0.0
+
+    async def __aenter__(self) -> PollScheduler:
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        for job in self._jobs.values():
+            if job.running is not None:
+                job.running.cancel()
+        for task in self._tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks.clear()
+
+    def schedule(
+        self,
+        key: str,
+        host: str,
+        poll: Callable[[], Awaitable[None]],
+        delay: float | None = None,
+    ) -> None:
+        if key in self._jobs:
+            return
+        job = self._jobs[key] = _PollJob(key, host, poll)
+        if delay is None:
+            delay = random.uniform(0, self._interval * self._jitter)
+        self._push(job, asyncio.get_running_loop().time() + delay)
+
+    def set_interval(self, key: str, interval: float) -> None:
+        job = self._jobs.get(key)
+        if job is not None:
+            job.interval = interval
+
+    def unschedule(self, key: str) -> None:
+        job = self._jobs.pop(key, None)
+        if job is None or job.running is None:
+            return
+        if job.running is not asyncio.current_task():
+            job.running.cancel()
+
+    def stats(self) -> PollSchedulerStats:
+        return PollSchedulerStats(
+            scheduled=len(self._jobs),
+            queue_depth=sum(queue.qsize() for queue in self._host_queues.values()),
+            running=self._running,
+            last_lateness=self._last_lateness,
+            max_lateness=self._max_lateness,
+        )
+
+    def _push(self, job: _PollJob, due: float) -> None:
+        job.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), job))
+        self._wakeup.set()
+
+    def _host_queue(self, host: str) -> asyncio.Queue[_PollJob]:
+        queue = self._host_queues.get(host)
+        if queue is None:
+            queue = self._host_queues[host] = asyncio.Queue()
+            limit = self._host_limits.get(host, self._default_host_limit)
+            for _ in range(limit):
+                self._tasks.append(asyncio.create_task(self._work(queue)))
+        return queue
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            now = loop.time()
+            while self._heap:
+                due, _, job = self._heap[0]
+                if due > now:
+                    timeout = due - now
+                    break
+                heapq.heappop(self._heap)
+                if self._jobs.get(job.key) is job:
+                    self._host_queue(job.host).put_nowait(job)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    async def _work(self, queue: asyncio.Queue[_PollJob]) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await queue.get()
+            async with self._pool:
+                if self._jobs.get(job.key) is not job:
+                    continue
+                lateness = loop.time() - job.due
+                self._last_lateness = lateness
+                self._max_lateness = max(self._max_lateness, lateness)
+                POLL_LATENESS_SECONDS.observe(max(lateness, 0.0), host=job.host)
+                if lateness > (job.interval or self._interval):
+                    logger.warning(
+                        f"Poll {job.key} started {lateness:.1f}s late, "
+                        f"{queue.qsize()} more polls are waiting"
+                    )
+                self._running += 1
+                job.running = asyncio.ensure_future(job.poll())
+                try:
+                    await asyncio.wait([job.running])
+                    if not job.running.cancelled() and job.running.exception():
+                        logger.error(
+                            f"Poll {job.key} failed", exc_info=job.running.exception()
+                        )
+                finally:
+                    job.running = None
+                    self._running -= 1
+            if self._jobs.get(job.key) is job:
+                interval = job.interval or self._interval
+                spread = interval * self._jitter
+                self._push(
+                    job, loop.time() + interval + random.uniform(-spread, spread)
+                )
+
+
+class CarSearchGroup:
+    """Car subscriptions that watch the same (normalized) AutoRia search"""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.members: dict[str, CarSubscription] = {}
+        self.fingerprint: str | None = None
+        self.processed_at = 0.0
+        self.arrival_rate: float | None = None
+        self.observed_at: float | None = None
+
+
+class CarPollStats(BaseModel):
+    fingerprint_hits: int = 0
+    fingerprint_misses: int = 0
+    not_modified: int = 0
+
 
 class SubscriptionsService:
     def __init__(
         self,
-        bot: Bot,
+        notifications: NotificationDispatcher,
         subs_repo: SubscriptionRepoABC,
         car_repo: CarRepoABC,
         ticket_repo: TicketRepoABC,
         pooling_interval: datetime.timedelta = datetime.timedelta(seconds=30),
+        poll_workers: int = 16,
+        poll_jitter: float = 0.1,
+        host_limits: Mapping[str, int] | None = None,
+        ria_parser: str = "stream",
+        parse_executor: ParseExecutor | None = None,
+        http_clients: HttpClients | None = None,
+        poll_intervals: PollIntervals | None = None,
+        shard: ShardCoordinator | None = None,
+        warm_start_batch: int = 500,
+        ria_max_pages: int = 5,
+        subs_flush_interval: datetime.timedelta = datetime.timedelta(seconds=5),
+        ticket_options: TicketReaderOptions | None = None,
     ) -> None:
-        self._tasks: dict[str, asyncio.Task[None]] = {}
-        self._bot = bot
+        self._car_groups: dict[str, CarSearchGroup] = {}
+        self._notifications = notifications
         self._subs_repo = subs_repo
         self._car_repo = car_repo
         self._ticket_repo = ticket_repo
         self._pooling_interval = pooling_interval
+        self._ria_parser = ria_parser
+        self._car_poll_stats = CarPollStats()
+        # Seen sets have to see listings from time to time even if
+        # the results did not change, so they are not trimmed
+        self._fingerprint_ttl = 3600.0
+        self._parse_executor = parse_executor or ParseExecutor()
+        self._http_clients = http_clients or HttpClients()
+        self._poll_intervals = poll_intervals or PollIntervals(pooling_interval)
+        self._shard = shard
+        self._shard_lock = asyncio.Lock()
+        self._warm_start_batch = warm_start_batch
+        self._ria_max_pages = ria_max_pages
+        self._ticket_options = ticket_options or TicketReaderOptions()
+        self._day_tickets: SingleFlight[list[Ticket]] = SingleFlight(
+            self._http_clients.shared_ttl
+        )
+        self._office_buckets = OfficeBuckets(
+            self._ticket_options.office_requests_per_second
+        )
+        self._ticket_readers: dict[str, TicketReader] = {}
+        # Readers of stopped subscriptions being closed in the background
+        self._closing_readers: set[asyncio.Task[None]] = set()
+        self._running: dict[str, Subscription] = {}
+        self._running_by_type: dict[str, int] = {}
+        # Subscription state changed by polls, written in batches
+        self._dirty_subs: dict[str, Subscription] = {}
+        # Dropped since the current flush started, must not be put back
+        self._dropped_subs: set[str] = set()
+        self._subs_flush_interval = subs_flush_interval.total_seconds()
+        self._flush_task: asyncio.Task[None] | None = None
+        if host_limits is None:
+            host_limits = {"auto.ria.com": 4, self._ticket_options.host: 2}
+        self._scheduler = PollScheduler(
+            pooling_interval,
+            workers=poll_workers,
+            jitter=poll_jitter,
+            host_limits=host_limits,
+        )
 
     async def __aenter__(self) -> SubscriptionsService:
-        old_subs = await self._subs_repo.list_subscriptions()
-        for sub in old_subs:
-            self._start_processing(sub)
+        await self._scheduler.__aenter__()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        if self._shard is not None:
+            # Events published during the warm start wait for the lock
+            self._shard.add_listener(self._on_shard_event)
+            await self._shard.refresh()
+        async with self._shard_lock:
+            old_subs = await self._subs_repo.list_subscriptions()
+            await self._warm_start([sub for sub in old_subs if self._owns(sub)])
+            # Workers could change while the subscriptions were listed
+            for sub in list(self._running.values()):
+                if not self._owns(sub):
+                    self._stop_processing(sub)
         return self
 
     async def __aexit__(self, *args: Any) -> None:
-        for task in self._tasks.values():
-            task.cancel()
+        await self._scheduler.__aexit__(*args)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
             with suppress(asyncio.CancelledError):
-                await task
+                await self._flush_task
+            self._flush_task = None
+        await self._flush_subscriptions()
+        for sub_id in list(self._ticket_readers):
+            self._close_ticket_reader(sub_id)
+        await asyncio.gather(*self._closing_readers)
+
+    def scheduler_stats(self) -> PollSchedulerStats:
+        return self._scheduler.stats()
+
+    def car_poll_stats(self) -> CarPollStats:
+        return self._car_poll_stats.model_copy()
 
     async def add_subscription(self, sub: Subscription) -> None:
         logger.info(f"Adding new subscription {sub}")
         await self._subs_repo.add_subscription(sub)
         if isinstance(sub, CarSubscription):
-            readers = [RiaCarReader(sub.ria_url)]
-            await self._car_process_once(sub, readers, limit_send_cnt=3)
-        self._start_processing(sub)
+            cars = await self._make_car_reader(sub.ria_url).read_records()
+            await self._car_process_once(sub, cars, limit_send_cnt=3)
+            sub.arrival_rate = estimate_arrival_rate([car.add_time for car in cars])
+            await self._subs_repo.update_subscription(sub)
+        if self._owns(sub):
+            self._start_processing(sub)
+        elif self._shard is not None:
+            if isinstance(sub, CarSubscription):
+                # Cached seen cars go stale if this worker polls it later
+                self._car_repo.evict(sub.id)
+            await self._shard.publish(ShardEvent(kind="added", subscription_id=sub.id))
 
     async def list_subscriptions(self, chat_id: int) -> list[Subscription]:
-        subs = await self._subs_repo.list_subscriptions()
-        return [sub for sub in subs if sub.chat_id == chat_id]
+        return await self._subs_repo.list_chat_subscriptions(chat_id)
 
     async def drop_subscription(self, subs: Subscription) -> None:
+        self._forget_dirty(subs)
         await self._subs_repo.drop_subscription(subs)
-        if task := self._tasks.pop(subs.id):
-            task.cancel()
-            with suppress(asyncio.CancelledError):
-                await task
+        self._stop_processing(subs)
+        await self._drop_seen(subs)
+        if self._shard is not None:
+            await self._shard.publish(
+                ShardEvent(kind="dropped", subscription_id=subs.id)
+            )
+
+    def _owns(self, sub: Subscription) -> bool:
+        if self._shard is None:
+            return True
+        if isinstance(sub, CarSubscription):
+            # Subscriptions for the same search are polled together
+            return self._shard.owns(normalize_ria_url(sub.ria_url))
+        return self._shard.owns(sub.id)
+
+    async def _on_shard_event(self, event: ShardEvent) -> None:
+        async with self._shard_lock:
+            if event.kind == "added" and event.subscription_id is not None:
+                sub = await self._subs_repo.get_subscription(event.subscription_id)
+                if sub is not None and self._owns(sub):
+                    self._start_processing(sub)
+            elif event.kind == "dropped" and event.subscription_id is not None:
+                running = self._running.get(event.subscription_id)
+                if running is not None:
+                    self._stop_processing(running)
+            elif event.kind == "rebalance":
+                await self._rebalance()
+
+    async def _rebalance(self) -> None:
+        subs = {sub.id: sub for sub in await self._subs_repo.list_subscriptions()}
+        for sub in list(self._running.values()):
+            if sub.id not in subs or not self._owns(sub):
+                self._stop_processing(sub)
+        await self._warm_start(
+            [
+                sub
+                for sub in subs.values()
+                if sub.id not in self._running and self._owns(sub)
+            ]
+        )
+        logger.info(f"Processing {len(self._running)} of {len(subs)} subscriptions")
+
+    async def _warm_start(self, subs: Sequence[Subscription]) -> None:
+        """Start many subscriptions with first polls spread over the interval
+
+        Otherwise after a restart every upstream gets all polls at once.
+        Subscriptions are started in batches, yielding to the loop in between.
+        Seen caches of a batch are loaded before it starts, so first polls
+        do not have to go to the storage.
+        """
+        interval = self._pooling_interval.total_seconds()
+        for start in range(0, len(subs), self._warm_start_batch):
+            batch = subs[start : start + self._warm_start_batch]
+            await self._warm_repos(batch)
+            for index, sub in enumerate(batch, start):
+                self._start_processing(sub, delay=interval * index / len(subs))
+            logger.info(f"Started {start + len(batch)} of {len(subs)} subscriptions")
+            await asyncio.sleep(0)
+
+    async def _warm_repos(self, subs: Sequence[Subscription]) -> None:
+        try:
+            await self._car_repo.warm(
+                [sub.id for sub in subs if isinstance(sub, CarSubscription)]
+            )
+            await self._ticket_repo.warm(
+                [sub.id for sub in subs if isinstance(sub, TicketSubscription)]
+            )
+        except Exception:
+            # Caches are loaded on first use then
+            logger.exception("Failed to warm seen caches")
+
+    def _start_processing(self, sub: Subscription, delay: float | None = None) -> None:
+        if sub.id in self._running:
+            return
+        self._running[sub.id] = sub
+        self._update_active_subscriptions(sub, 1)
+        if isinstance(sub, CarSubscription):
+            group_key = normalize_ria_url(sub.ria_url)
+            group = self._car_groups.get(group_key)
+            if group is None:
+                group = self._car_groups[group_key] = CarSearchGroup(group_key)
+                reader = self._make_car_reader(group.url)
+                self._scheduler.schedule(
+                    group_key,
+                    urlsplit(group_key).hostname or "",
+                    functools.partial(self._car_poll, group, reader),
+                    delay=delay,
+                )
+            group.members[sub.id] = sub
+            if sub.arrival_rate is not None and (
+                group.arrival_rate is None or sub.arrival_rate > group.arrival_rate
+            ):
+                group.arrival_rate = sub.arrival_rate
+                self._scheduler.set_interval(
+                    group_key, self._poll_intervals.for_arrival_rate(sub.arrival_rate)
+                )
+        if isinstance(sub, TicketSubscription):
+            ticket_reader = self._ticket_readers[sub.id] = TicketReader(
+                sub.conf,
+                options=self._ticket_options,
+                day_tickets=self._day_tickets,
+                office_buckets=self._office_buckets,
+            )
+            self._scheduler.schedule(
+                sub.id,
+                self._ticket_options.host,
+                functools.partial(self._ticket_poll, sub, ticket_reader),
+                delay=delay,
+            )
+            self._scheduler.set_interval(
+                sub.id,
+                self._poll_intervals.for_release_minutes(
+                    sub.release_minutes, self._get_now()
+                ),
+            )
+
+    def _stop_processing(self, sub: Subscription) -> None:
+        if self._running.pop(sub.id, None) is not None:
+            self._update_active_subscriptions(sub, -1)
+        if isinstance(sub, CarSubscription):
+            self._car_repo.evict(sub.id)
+            group_key = normalize_ria_url(sub.ria_url)
+            group = self._car_groups.get(group_key)
+            if group is None:
+                return
+            group.members.pop(sub.id, None)
+            if not group.members:
+                del self._car_groups[group_key]
+                self._scheduler.unschedule(group_key)
+        if isinstance(sub, TicketSubscription):
+            self._ticket_repo.evict(sub.id)
+            self._scheduler.unschedule(sub.id)
+            self._close_ticket_reader(sub.id)
 
-    def _start_processing(self, sub: Subscription) -> None:
-        if sub.id in self._tasks:
+    def _close_ticket_reader(self, sub_id: str) -> None:
+        reader = self._ticket_readers.pop(sub_id, None)
+        if reader is None:
             return
+        # Unscheduling only cancels the poll, it finishes after this returns
+        task = asyncio.create_task(reader.__aexit__(None, None, None))
+        self._closing_readers.add(task)
+        task.add_done_callback(self._closing_readers.discard)
+
+    def _update_active_subscriptions(self, sub: Subscription, delta: int) -> None:
+        kind = "car" if isinstance(sub, CarSubscription) else "ticket"
+        self._running_by_type[kind] = self._running_by_type.get(kind, 0) + delta
+        ACTIVE_SUBSCRIPTIONS.set(self._running_by_type[kind], type=kind)
+
+    async def _drop_seen(self, sub: Subscription) -> None:
         if isinstance(sub, CarSubscription):
-            self._tasks[sub.id] = asyncio.create_task(self._car_processor(sub))
+            await self._car_repo.drop_subscription(sub.id)
         if isinstance(sub, TicketSubscription):
-            self._tasks[sub.id] = asyncio.create_task(self._ticket_processor(sub))
+            await self._ticket_repo.drop_subscription(sub.id)
+
+    def _make_car_reader(self, url: str) -> RiaCarReader:
+        return RiaCarReader(
+            url,
+            self._http_clients.get(url),
+            parser=self._ria_parser,
+            executor=self._parse_executor,
+            responses=self._http_clients.responses,
+        )
 
-    async def _car_processor(self, sub: CarSubscription) -> None:
-        readers = [RiaCarReader(sub.ria_url)]
-        while True:
+    async def _car_poll(self, group: CarSearchGroup, reader: RiaCarReader) -> None:
+        stats = self._car_poll_stats
+        now = asyncio.get_running_loop().time()
+        full_check = now - group.processed_at > self._fingerprint_ttl
+        if full_check:
+            reader.reset_validators()
+        try:
+            raw = await reader.fetch_new_page()
+        except Exception:
+            logging.exception("Failed to poll new cars")
+            return
+        if raw is None:
+            stats.not_modified += 1
+            fingerprint = group.fingerprint
+        else:
+            fingerprint = ria_page_fingerprint(raw)
+        members = list(group.members.values())
+        pending = {
+            sub.id
+            for sub in members
+            if full_check or sub.results_fingerprint != fingerprint
+        }
+        cars: list[RiaCarRecord] = []
+        observed = True
+        # Whether every page the members need was read
+        complete = True
+        if not pending:
+            stats.fingerprint_hits += 1
+            CAR_POLL_FINGERPRINT_HITS.inc()
+        elif raw is None:
+            # Some members did not see the current page, get it next time
+            reader.reset_validators()
+            pending.clear()
+            observed = False
+        else:
+            stats.fingerprint_misses += 1
+            reached_known = functools.partial(
+                self._reached_known, [group.members[subs_id] for subs_id in pending]
+            )
+            try:
+                async for car in reader.crawl(
+                    raw, reached_known, max_pages=self._ria_max_pages
+                ):
+                    cars.append(car)
+            except Exception:
+                logging.exception("Failed to parse new cars")
+                # Validators already match the page that was not processed
+                reader.reset_validators()
+                if not cars:
+                    return
+                # Listings of the pages read so far are still sent
+                complete = False
+            if full_check and complete:
+                group.processed_at = now
+        group.fingerprint = fingerprint
+        arrivals = 0
+        processed: list[CarSubscription] = []
+        for sub in members:
+            # Members can be dropped or moved while the pages are loading
+            if sub.id not in group.members:
+                continue
             try:
-                await self._car_process_once(sub, readers)
+                if sub.id in pending:
+                    new_cars = await self._car_process_once(sub, cars)
+                    arrivals = max(arrivals, len(new_cars))
+                    if complete:
+                        sub.results_fingerprint = fingerprint
             except Exception:
-                logging.exception("Failed to poll new cars")
+                logging.exception("Failed to process new cars")
+                reader.reset_validators()
             else:
-                sub.last_update = self._get_now()
-                await self._subs_repo.update_subscription(sub)
-            await asyncio.sleep(self._pooling_interval.total_seconds())
+                if sub.id in group.members:
+                    processed.append(sub)
+                elif await self._subs_repo.get_subscription(sub.id) is None:
+                    # Dropped while processed, seen cars were written back
+                    await self._drop_seen(sub)
+        if processed and observed:
+            self._observe_arrivals(group, arrivals, now)
+        for sub in processed:
+            sub.last_update = self._get_now()
+            sub.arrival_rate = group.arrival_rate
+            self._dirty_subs[sub.id] = sub
+
+    async def _reached_known(
+        self, subs: Sequence[CarSubscription], cars: list[RiaCarRecord]
+    ) -> bool:
+        """Whether every subscription has seen some of the listings before
+
+        Listings come newest first, so once the last one on the page is
+        older than the watermark, the next pages hold nothing new either.
+        """
+        for sub in subs:
+            if sub.watermark is not None and cars[-1].add_time <= sub.watermark:
+                continue
+            new_cars = await self._car_repo.filter_new_cars(cars, sub.id)
+            if len(new_cars) == len(cars):
+                return False
+        return True
 
-    async def _ticket_processor(self, sub: TicketSubscription) -> None:
-        reader = TicketReader(sub.conf)
+    def _observe_arrivals(
+        self, group: CarSearchGroup, arrivals: int, now: float
+    ) -> None:
+        if group.observed_at is not None and now > group.observed_at:
+            group.arrival_rate = update_arrival_rate(
+                group.arrival_rate,
+                arrivals,
+                now - group.observed_at,
+                self._poll_intervals.rate_window,
+            )
+            self._scheduler.set_interval(
+                group.url, self._poll_intervals.for_arrival_rate(group.arrival_rate)
+            )
+        group.observed_at = now
+
+    async def _ticket_poll(self, sub: TicketSubscription, reader: TicketReader) -> None:
+        try:
+            new_tickets = await self._ticket_process_once(sub, reader)
+        except Exception as e:
+            now = self._get_now()
+            if sub.last_update is not None and (
+                (now - sub.last_update) > datetime.timedelta(minutes=15)
+            ):
+                await self._notifications.enqueue(
+                    [
+                        Notification(
+                            id=f"error:{sub.id}",
+                            chat_id=sub.chat_id,
+                            text=f"Ошибка при загрузке талонов уже более 15 минут: {e}",
+                        )
+                    ]
+                )
+                self._forget_dirty(sub)
+                await self._subs_repo.drop_subscription(sub)
+                self._stop_processing(sub)
+                await self._drop_seen(sub)
+                return
+            logging.exception("Failed to poll new talons")
+        else:
+            sub.last_update = self._get_now()
+            if new_tickets:
+                sub.release_minutes = record_release_minute(
+                    sub.release_minutes, sub.last_update
+                )
+        self._scheduler.set_interval(
+            sub.id,
+            self._poll_intervals.for_release_minutes(
+                sub.release_minutes, self._get_now()
+            ),
+        )
+        webchsid2 = reader.get_current_webchsid2()
+        if webchsid2 == sub.conf.webchsid2:
+            self._dirty_subs[sub.id] = sub
+            return
+        # The rotated session has to survive a crash, write it right away
+        sub.conf.webchsid2 = webchsid2
+        self._dirty_subs.pop(sub.id, None)
+        await self._subs_repo.update_subscription(sub)
+
+    async def _flush_loop(self) -> None:
         while True:
-            try:
-                await self._ticket_process_once(sub, reader)
-            except Exception as e:
-                now = self._get_now()
-                if sub.last_update is not None and (
-                    (now - sub.last_update) > datetime.timedelta(minutes=15)
-                ):
-                    await self._bot.send_message(
-                        chat_id=sub.chat_id,
-                        text=f"Ошибка при загрузке талонов уже более 15 минут: {e}",
-                    )
-                    await self._subs_repo.drop_subscription(sub)
-                    return
-                logging.exception("Failed to poll new talons")
-            else:
-                sub.last_update = self._get_now()
-            sub.conf.webchsid2 = reader.get_current_webchsid2()
-            await self._subs_repo.update_subscription(sub)
+            await asyncio.sleep(self._subs_flush_interval)
+            await self._flush_subscriptions()
 
-            await asyncio.sleep(self._pooling_interval.total_seconds())
+    async def _flush_subscriptions(self) -> None:
+        """Write subscriptions changed since the last flush in one batch"""
+        if not self._dirty_subs:
+            return
+        dirty, self._dirty_subs = self._dirty_subs, {}
+        self._dropped_subs.clear()
+        try:
+            await self._subs_repo.update_subscriptions(list(dirty.values()))
+        except Exception:
+            logger.exception("Failed to save subscriptions")
+            # Keep them for the next flush unless changed in the meantime
+            for subs_id, sub in dirty.items():
+                if subs_id not in self._dropped_subs:
+                    self._dirty_subs.setdefault(subs_id, sub)
+
+    def _forget_dirty(self, sub: Subscription) -> None:
+        self._dirty_subs.pop(sub.id, None)
+        self._dropped_subs.add(sub.id)
 
     async def _car_process_once(
         self,
         sub: CarSubscription,
-        readers: Iterable[CarReader],
+        cars: list[RiaCarRecord],
         limit_send_cnt: int | None = None,
-    ) -> None:
-        sent = 0
-        for reader in readers:
-            cars = await reader.read_cars()
-            for car in cars:
-                if await self._car_repo.has_car(car, sub.id):
-                    continue
-                if limit_send_cnt is None or sent < limit_send_cnt:
-                    await self._send_car_notification(car, sub.chat_id)
-                    logger.info(
-                        f"Sending message to {sub.chat_id} about "
-                        f"car {car.provider_car_id}"
-                    )
-                    sent += 1
-                await self._car_repo.add_car(car, sub.id)
+    ) -> list[RiaCarRecord]:
+        unique_cars: dict[str, RiaCarRecord] = {}
+        for car in cars:
+            unique_cars.setdefault(car.car_id, car)
+        new_cars = await self._car_repo.filter_new_cars(
+            list(unique_cars.values()), sub.id
+        )
+        # Only listings that are going to be sent are validated
+        to_send = [car.to_car_info() for car in new_cars[:limit_send_cnt]]
+        await self._notifications.enqueue(
+            [self._make_car_notification(car_info, sub) for car_info in to_send]
+        )
+        for car_info in to_send:
+            logger.info(
+                f"Sending message to {sub.chat_id} "
+                f"about car {car_info.provider_car_id}"
+            )
+        await self._car_repo.add_cars(new_cars, sub.id)
+        if new_cars:
+            newest = max(car.add_time for car in new_cars)
+            if sub.watermark is None or newest > sub.watermark:
+                sub.watermark = newest
+        return new_cars
 
     async def _ticket_process_once(
         self,
         sub: TicketSubscription,
         reader: TicketReader,
-    ) -> None:
-        async for ticket in reader.get_tickets():
-            if await self._ticket_repo.has_ticket(ticket, sub.id):
-                continue
-            await self._send_ticket_notification(ticket, sub.chat_id)
+    ) -> list[Ticket]:
+        tickets = {ticket.id: ticket async for ticket in reader.get_tickets()}
+        new_tickets = await self._ticket_repo.filter_new_tickets(
+            list(tickets.values()), sub.id
+        )
+        await self._notifications.enqueue(
+            [self._make_ticket_notification(ticket, sub) for ticket in new_tickets]
+        )
+        for ticket in new_tickets:
             logger.info(f"Sending message to {sub.chat_id} about ticket {ticket.id}")
-            await self._ticket_repo.add_ticket(ticket, sub.id)
-
-    async def _send_car_notification(self, car: CarInfo, chat_id: int) -> None:
-        await self._bot.send_photo(
-            chat_id=chat_id,
-            photo=car.image_url,
-            caption=textwrap.dedent(
+        await self._ticket_repo.add_tickets(new_tickets, sub.id)
+        return new_tickets
+
+    def _make_car_notification(
+        self, car: CarInfo, sub: CarSubscription
+    ) -> Notification:
+        return Notification(
+            id=f"car:{sub.id}:{car.provider_car_id}",
+            chat_id=sub.chat_id,
+            photo_url=car.image_url,
+            text=textwrap.dedent(
                 f"""\
                 <b>{car.name}: {car.year}</b>
                 Цена: {car.price_usd}$ {car.price_uah} грн
@@ -213,9 +915,12 @@ class SubscriptionsService:
             ),
         )
 
-    async def _send_ticket_notification(self, ticket: Ticket, chat_id: int) -> None:
-        await self._bot.send_message(
-            chat_id=chat_id,
+    def _make_ticket_notification(
+        self, ticket: Ticket, sub: TicketSubscription
+    ) -> Notification:
+        return Notification(
+            id=f"ticket:{sub.id}:{ticket.id}",
+            chat_id=sub.chat_id,
             text=textwrap.dedent(
                 f"""\
                 Талон появился!
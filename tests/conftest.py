@@ -1,11 +1,27 @@
 from __future__ import annotations
 
 import asyncio
-from collections.abc import Iterator
+from collections.abc import Callable, Iterator
 from typing import Any
 
 import pytest
 
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryCarRepo
+from car_lookup_bot.impls.notification_repo.in_memory_repo import (
+    InMemoryNotificationRepo,
+)
+from car_lookup_bot.impls.subs_repo.in_memory_repo import InMemoryAuctionRepo
+from car_lookup_bot.impls.ticket_repo.in_memory_repo import InMemoryTicketRepo
+from car_lookup_bot.notifications import NotificationDispatcher
+from car_lookup_bot.subscriptions import (
+    CarRepoABC,
+    SubscriptionRepoABC,
+    SubscriptionsService,
+    TicketRepoABC,
+)
+
+ServiceFactory = Callable[..., SubscriptionsService]
+
 
 @pytest.fixture(scope="session")
 def event_loop(request: Any) -> Iterator[asyncio.AbstractEventLoop]:
@@ -13,3 +29,28 @@ def event_loop(request: Any) -> Iterator[asyncio.AbstractEventLoop]:
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
     loop.close()
+
+
+@pytest.fixture
+def make_service() -> ServiceFactory:
+    """Build services over in-memory repos, missing repos are created"""
+
+    def make(
+        subs_repo: SubscriptionRepoABC | None = None,
+        car_repo: CarRepoABC | None = None,
+        ticket_repo: TicketRepoABC | None = None,
+        **kwargs: Any,
+    ) -> SubscriptionsService:
+        # Bot is never called, as the dispatcher is not started
+        notifications = NotificationDispatcher(
+            None, InMemoryNotificationRepo()  # type: ignore[arg-type]
+        )
+        return SubscriptionsService(
+            notifications,
+            subs_repo or InMemoryAuctionRepo(),
+            car_repo or InMemoryCarRepo(),
+            ticket_repo or InMemoryTicketRepo(),
+            **kwargs,
+        )
+
+    return make
@@ -0,0 +1,191 @@
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+from car_lookup_bot.car_info_readers import (
+    RiaCarReader,
+    RiaCarRecord,
+    normalize_ria_url,
+    parse_ria_page_soup,
+    parse_ria_page_stream,
+)
+from car_lookup_bot.http_clients import SingleFlight
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+
+
+async def test_normalize_ria_url_sorts_params() -> None:
+    # Arrange
+    url_a = "https://auto.ria.com/uk/search/?year[0].gte=2010&brand.id[0]=9&page=0"
+    url_b = "https://AUTO.ria.com/uk/search/?page=0&brand.id[0]=9&year[0].gte=2010"
+
+    # Act
+    res_a = normalize_ria_url(url_a)
+    res_b = normalize_ria_url(url_b)
+
+    # Assert
+    assert res_a == res_b
+
+
+async def test_normalize_ria_url_drops_tracking_params() -> None:
+    # Arrange
+    url = "https://auto.ria.com/uk/search/?utm_source=tg&brand.id[0]=9&fbclid=x#top"
+
+    # Act
+    res = normalize_ria_url(url)
+
+    # Assert
+    assert res == "https://auto.ria.com/uk/search/?brand.id%5B0%5D=9"
+
+
+async def test_normalize_ria_url_keeps_repeated_params_order() -> None:
+    # Arrange
+    url = "https://auto.ria.com/search/?b=2&a=1&b=1"
+
+    # Act
+    res = normalize_ria_url(url)
+
+    # Assert
+    assert res == "https://auto.ria.com/search/?a=1&b=2&b=1"
+
+
+@pytest.mark.parametrize(
+    "fixture", ["ria_search_page.html", "ria_search_page_large.html"]
+)
+async def test_stream_parser_matches_soup_parser(fixture: str) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / fixture).read_bytes()
+
+    # Act
+    stream_res = parse_ria_page_stream(raw, chunk_size=4096)
+    soup_res = parse_ria_page_soup(raw)
+
+    # Assert
+    assert len(soup_res) > 0
+    assert stream_res == soup_res
+
+
+async def test_stream_parser_without_results() -> None:
+    # Act
+    res = parse_ria_page_stream(b"<html><body>Nothing found</body></html>")
+
+    # Assert
+    assert res == []
+
+
+async def test_record_converts_to_car_info() -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    record = parse_ria_page_stream(raw)[0]
+
+    # Act
+    car_info = record.to_car_info()
+
+    # Assert
+    assert car_info.provider_name == record.provider_name == "ria"
+    assert car_info.provider_car_id == record.provider_car_id == "35140891"
+    assert car_info.name == "Audi A6"
+    assert car_info.year == 2013
+    assert car_info.price_usd == 18455
+    assert car_info.mileage_km == 253000
+
+
+async def test_crawl_fetches_next_pages_until_known_listing() -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    requested: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.params["page"])
+        return httpx.Response(200, content=raw)
+
+    async def reached_known(cars: list[RiaCarRecord]) -> bool:
+        return len(requested) == 2
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    reader = RiaCarReader("https://auto.ria.com/search/?page=0", client)
+
+    # Act
+    cars = [car async for car in reader.crawl(raw, reached_known, max_pages=5)]
+
+    # Assert
+    assert requested == ["1", "2"]
+    assert len(cars) == 3 * len(parse_ria_page_stream(raw))
+
+
+async def test_readers_share_first_page_requests() -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    requested: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        return httpx.Response(200, content=raw, headers={"etag": "v1"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    responses: SingleFlight[httpx.Response] = SingleFlight(ttl=10)
+    urls = [
+        "https://auto.ria.com/search/?b=2&a=1",
+        "https://auto.ria.com/search/?a=1&b=2",
+    ]
+    readers = [RiaCarReader(url, client, responses=responses) for url in urls]
+
+    # Act
+    checked = await asyncio.gather(*(reader.read_records() for reader in readers))
+    first_poll = await readers[1].fetch_new_page()
+    second_poll = await readers[1].fetch_new_page()
+
+    # Assert
+    assert len(requested) == 2
+    assert checked[0] == checked[1] == parse_ria_page_stream(raw)
+    assert first_poll == raw
+    assert second_poll == raw
+    assert responses.hits == 2
+
+
+async def test_fetch_new_page_fails_on_error_response() -> None:
+    # Arrange
+    statuses = [200, 503]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if statuses:
+            return httpx.Response(statuses.pop(0), headers={"etag": "v1"})
+        if request.headers.get("if-none-match") == "v1":
+            return httpx.Response(304)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    reader = RiaCarReader("https://auto.ria.com/search/", client)
+    await reader.fetch_new_page()
+
+    # Act
+    with pytest.raises(httpx.HTTPStatusError):
+        await reader.fetch_new_page()
+    res = await reader.fetch_new_page()
+
+    # Assert
+    assert res is None
+
+
+async def test_shared_first_page_does_not_keep_errors() -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    statuses = [429, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(statuses.pop(0), content=raw)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    responses: SingleFlight[httpx.Response] = SingleFlight(ttl=10)
+    reader = RiaCarReader("https://auto.ria.com/search/", client, responses=responses)
+
+    # Act
+    with pytest.raises(httpx.HTTPStatusError):
+        await reader.read_records()
+    res = await reader.read_records()
+
+    # Assert
+    assert res == parse_ria_page_stream(raw)
+    assert statuses == []
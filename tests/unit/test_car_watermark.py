@@ -0,0 +1,53 @@
+import datetime
+
+from car_lookup_bot.car_info_readers import RiaCarRecord
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryWatermarkCarRepo
+
+
+def make_record(car_id: str, add_date: str) -> RiaCarRecord:
+    return RiaCarRecord(
+        car_id=car_id,
+        title="Audi A6 2013",
+        price_usd="18 455",
+        price_uah="682 835",
+        race=" 253 тис. км",
+        add_date=add_date,
+        image_url="",
+        link="",
+    )
+
+
+async def test_watermark_repo_keeps_window_near_newest_car() -> None:
+    # Arrange
+    repo = InMemoryWatermarkCarRepo(window=datetime.timedelta(minutes=30))
+    old = make_record("1", "2023-10-10 08:00:00")
+    tie = make_record("2", "2023-10-10 10:00:00")
+    newest = make_record("3", "2023-10-10 10:00:00")
+    await repo.add_cars([old, newest], "sub")
+
+    # Act
+    res = await repo.filter_new_cars(
+        [make_record("4", "2023-10-10 10:00:01"), newest, tie, old], "sub"
+    )
+
+    # Assert
+    assert [car.car_id for car in res] == ["4", "2"]
+    assert await repo.list_seen_cars("sub") == [("ria", "3")]
+
+
+async def test_watermark_repo_state_is_bounded() -> None:
+    # Arrange
+    repo = InMemoryWatermarkCarRepo(window_size=10)
+    start = datetime.datetime(2023, 10, 10, 8)
+    cars = [
+        make_record(str(idx), str(start + datetime.timedelta(seconds=idx)))
+        for idx in range(100)
+    ]
+
+    # Act
+    await repo.add_cars(cars, "sub")
+    res = await repo.filter_new_cars(cars, "sub")
+
+    # Assert
+    assert len(await repo.list_seen_cars("sub")) == 10
+    assert res == []
@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+
+from car_lookup_bot.exam_tickets import (
+    OfficeBuckets,
+    TickerReaderConf,
+    Ticket,
+    TicketReader,
+    TicketReaderOptions,
+)
+from car_lookup_bot.http_clients import SingleFlight
+
+
+def make_conf(office_id: str, csrf: str = "c") -> TickerReaderConf:
+    return TickerReaderConf(
+        identity="i",
+        csrf=csrf,
+        webchsid2="w",
+        csrf_header="h",
+        office_id=office_id,
+        date_start=datetime.date(2023, 10, 10),
+        date_end=datetime.date(2023, 10, 12),
+    )
+
+
+async def test_get_tickets_retries_rate_limited_day() -> None:
+    # Arrange
+    requested: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        date = request.content.decode().split("date_of_admission=")[1][:10]
+        requested.append(date)
+        if len(requested) == 1:
+            return httpx.Response(429, headers={"retry-after": "0.1"})
+        rows = [{"id": date, "chtime": "10:00"}]
+        return httpx.Response(200, content=json.dumps({"rows": rows}).encode())
+
+    conf = make_conf("retries")
+    options = TicketReaderOptions(requests_per_second=50.0, max_concurrency=2)
+    reader = TicketReader(conf, httpx.MockTransport(handler), options=options)
+
+    # Act
+    tickets = [ticket async for ticket in reader.get_tickets()]
+
+    # Assert
+    assert sorted(ticket.id for ticket in tickets) == [
+        "2023-10-10",
+        "2023-10-11",
+        "2023-10-12",
+    ]
+    assert len(requested) == 4
+
+
+async def test_day_tickets_are_shared_only_within_session() -> None:
+    # Arrange
+    requested: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.headers["cookie"])
+        return httpx.Response(200, content=b'{"rows": []}')
+
+    day_tickets: SingleFlight[list[Ticket]] = SingleFlight(ttl=10)
+    transport = httpx.MockTransport(handler)
+    readers = [
+        TicketReader(make_conf("shared", csrf), transport, day_tickets=day_tickets)
+        for csrf in ["a", "a", "b"]
+    ]
+    date = datetime.date(2023, 10, 10)
+
+    # Act
+    await asyncio.gather(*(reader._get_tickets(date) for reader in readers))
+
+    # Assert
+    assert len(requested) == len(set(requested)) == 2
+
+
+async def test_office_rate_limit_is_shared_by_sessions() -> None:
+    # Arrange
+    statuses = [429, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(statuses.pop(0), content=b'{"rows": []}')
+
+    office_buckets = OfficeBuckets(requests_per_second=8.0)
+    transport = httpx.MockTransport(handler)
+    penalized = TicketReader(make_conf("1"), transport, office_buckets=office_buckets)
+    other = TicketReader(make_conf("1", "b"), office_buckets=office_buckets)
+    date = datetime.date(2023, 10, 10)
+
+    # Act
+    await penalized._get_tickets_limited(date)
+
+    # Assert
+    assert other._office_bucket is office_buckets.get("1")
+    assert office_buckets.get("1").rate < 8.0
+    assert OfficeBuckets(requests_per_second=8.0).get("1").rate == 8.0
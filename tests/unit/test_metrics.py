@@ -0,0 +1,32 @@
+from car_lookup_bot.metrics import Counter, Histogram, render
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    # Arrange
+    histogram = Histogram(
+        "test_latency_seconds", "Test latency", ["host"], buckets=(0.1, 1)
+    )
+
+    # Act
+    histogram.observe(0.05, host="a")
+    histogram.observe(0.5, host="a")
+    histogram.observe(5, host="a")
+    text = render()
+
+    # Assert
+    assert 'test_latency_seconds_bucket{host="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{host="a",le="1.0"} 2' in text
+    assert 'test_latency_seconds_bucket{host="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{host="a"} 3' in text
+
+
+def test_counter_escapes_label_values() -> None:
+    # Arrange
+    counter = Counter("test_failures_total", "Test failures", ["reason"])
+
+    # Act
+    counter.inc(reason='bad "request"')
+    text = render()
+
+    # Assert
+    assert 'test_failures_total{reason="bad \\"request\\""} 1' in text
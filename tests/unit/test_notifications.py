@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from car_lookup_bot.impls.notification_repo.in_memory_repo import (
+    InMemoryNotificationRepo,
+)
+from car_lookup_bot.notifications import Notification, NotificationDispatcher
+
+
+class FakeBot:
+    def __init__(self, flood_limits: int = 0) -> None:
+        self.calls: list[tuple[str, int, int]] = []
+        self.flood_limits = flood_limits
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        if self.flood_limits:
+            self.flood_limits -= 1
+            raise TelegramRetryAfter(
+                SendMessage(chat_id=chat_id, text=text), "Flood", retry_after=0
+            )
+        self.calls.append(("message", chat_id, 1))
+
+    async def send_photo(self, chat_id: int, photo: str, caption: str) -> None:
+        self.calls.append(("photo", chat_id, 1))
+
+    async def send_media_group(self, chat_id: int, media: list[Any]) -> None:
+        self.calls.append(("media_group", chat_id, len(media)))
+
+
+async def test_dispatcher_groups_photos() -> None:
+    # Arrange
+    bot = FakeBot()
+    repo = InMemoryNotificationRepo()
+    notifications = [
+        Notification(id=str(i), chat_id=1, text="car", photo_url="https://a/b.jpg")
+        for i in range(12)
+    ]
+
+    # Act
+    dispatcher = NotificationDispatcher(bot, repo, chat_interval=0)  # type: ignore
+    async with dispatcher:
+        await dispatcher.enqueue(notifications)
+        await dispatcher.enqueue(notifications[:1])
+        await asyncio.sleep(0.1)
+
+    # Assert
+    assert bot.calls == [("media_group", 1, 10), ("media_group", 1, 2)]
+    assert repo.notifications == {}
+
+
+async def test_dispatcher_retries_after_flood_limit() -> None:
+    # Arrange
+    bot = FakeBot(flood_limits=2)
+    repo = InMemoryNotificationRepo()
+    await repo.add_notifications([Notification(id="1", chat_id=-5, text="ticket")])
+
+    # Act
+    dispatcher = NotificationDispatcher(bot, repo, chat_interval=0)  # type: ignore
+    async with dispatcher:
+        await asyncio.sleep(0.1)
+        pending = dispatcher.pending_count()
+
+    # Assert
+    assert bot.calls == [("message", -5, 1)]
+    assert pending == 0
+
+
+async def test_dispatcher_splits_chat_interval_between_workers() -> None:
+    # Arrange
+    bot = FakeBot()
+    repo = InMemoryNotificationRepo()
+    notifications = [Notification(id=str(i), chat_id=1, text="car") for i in range(2)]
+
+    # Act
+    dispatcher = NotificationDispatcher(bot, repo, chat_interval=0.1)  # type: ignore
+    dispatcher.set_workers(3)
+    async with dispatcher:
+        await dispatcher.enqueue(notifications)
+        await asyncio.sleep(0.2)
+
+    # Assert
+    assert bot.calls == [("message", 1, 1)]
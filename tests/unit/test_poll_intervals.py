@@ -0,0 +1,64 @@
+import datetime
+
+from car_lookup_bot.poll_intervals import (
+    PollIntervals,
+    estimate_arrival_rate,
+    update_arrival_rate,
+)
+
+
+def test_estimate_arrival_rate_from_add_times() -> None:
+    # Arrange
+    start = datetime.datetime(2023, 9, 1, 12)
+    add_times = [start + datetime.timedelta(minutes=15 * i) for i in range(5)]
+
+    # Act
+    rate = estimate_arrival_rate(add_times)
+
+    # Assert
+    assert rate == 4.0
+
+
+def test_update_arrival_rate_decays_quiet_searches() -> None:
+    # Arrange
+    rate = 10.0
+
+    # Act
+    for _ in range(100):
+        rate = update_arrival_rate(rate, 0, 600, window=6 * 3600)
+
+    # Assert
+    assert rate < 1.0
+
+
+def test_intervals_follow_arrival_rate_within_bounds() -> None:
+    # Arrange
+    intervals = PollIntervals()
+
+    # Act
+    busy = intervals.for_arrival_rate(600.0)
+    normal = intervals.for_arrival_rate(60.0)
+    quiet = intervals.for_arrival_rate(0.1)
+
+    # Assert
+    assert (busy, normal, quiet) == (15.0, 30.0, 600.0)
+
+
+def test_ticket_intervals_tighten_near_release_minutes() -> None:
+    # Arrange
+    intervals = PollIntervals()
+    release_minutes = [9 * 60]
+
+    # Act
+    near = intervals.for_release_minutes(
+        release_minutes, datetime.datetime(2023, 9, 1, 8, 57)
+    )
+    far = intervals.for_release_minutes(
+        release_minutes, datetime.datetime(2023, 9, 1, 14, 0)
+    )
+    before = intervals.for_release_minutes(
+        release_minutes, datetime.datetime(2023, 9, 1, 8, 54)
+    )
+
+    # Assert
+    assert (near, far, before) == (15.0, 120.0, 60.0)
@@ -0,0 +1,35 @@
+import time
+
+from car_lookup_bot.rate_limits import TokenBucket
+
+
+async def test_token_bucket_penalty_halves_rate_and_pauses() -> None:
+    # Arrange
+    bucket = TokenBucket(rate=100.0, increase=30.0)
+    await bucket.acquire()
+
+    # Act
+    bucket.penalize(retry_after=0.2)
+    started = time.monotonic()
+    await bucket.acquire()
+    waited = time.monotonic() - started
+    penalized_rate = bucket.rate
+    for _ in range(3):
+        bucket.reward()
+
+    # Assert
+    assert waited >= 0.2
+    assert penalized_rate == 50.0
+    assert bucket.rate == 100.0
+
+
+async def test_token_bucket_rate_does_not_drop_below_minimum() -> None:
+    # Arrange
+    bucket = TokenBucket(rate=1.0, min_rate=0.3)
+
+    # Act
+    for _ in range(5):
+        bucket.penalize()
+
+    # Assert
+    assert bucket.rate == 0.3
@@ -0,0 +1,134 @@
+import datetime
+from pathlib import Path
+
+from fakeredis.aioredis import FakeRedis
+
+from car_lookup_bot.car_info_readers import parse_ria_page_stream
+from car_lookup_bot.exam_tickets import Ticket
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryCarRepo
+from car_lookup_bot.impls.car_repo.redis_repo import RedisCarRepo
+from car_lookup_bot.impls.redis_utils import RedisKeys
+from car_lookup_bot.impls.subs_repo.redis_repo import RedisSubscriptionRepo
+from car_lookup_bot.impls.ticket_repo.in_memory_repo import InMemoryTicketRepo
+from car_lookup_bot.impls.ticket_repo.redis_repo import RedisTicketRepo
+from car_lookup_bot.subscriptions import CarSubscription
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+
+
+def make_car_subscription(chat_id: int) -> CarSubscription:
+    return CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=chat_id)
+
+
+async def test_redis_subscription_repo_lists_chat_subscriptions() -> None:
+    # Arrange
+    repo = RedisSubscriptionRepo(FakeRedis(), RedisKeys("test"))
+    subs = [make_car_subscription(chat_id) for chat_id in (1, 1, 2)]
+    for sub in subs:
+        await repo.add_subscription(sub)
+
+    # Act
+    await repo.drop_subscription(subs[0])
+    chat_subs = await repo.list_chat_subscriptions(1)
+    all_subs = await repo.list_subscriptions()
+
+    # Assert
+    assert chat_subs == [subs[1]]
+    assert sorted(sub.id for sub in all_subs) == sorted([subs[1].id, subs[2].id])
+    assert await repo.get_subscription(subs[0].id) is None
+
+
+async def test_redis_subscription_repo_does_not_update_dropped() -> None:
+    # Arrange
+    repo = RedisSubscriptionRepo(FakeRedis(), RedisKeys("test"))
+    kept = make_car_subscription(1)
+    dropped = make_car_subscription(1)
+    for sub in (kept, dropped):
+        await repo.add_subscription(sub)
+    await repo.drop_subscription(dropped)
+    kept.results_fingerprint = dropped.results_fingerprint = "changed"
+
+    # Act
+    await repo.update_subscriptions([kept, dropped])
+    await repo.update_subscription(dropped)
+
+    # Assert
+    assert await repo.get_subscription(kept.id) == kept
+    assert await repo.get_subscription(dropped.id) is None
+
+
+async def test_redis_subscription_repo_migrates_legacy_layouts() -> None:
+    # Arrange
+    client = FakeRedis()
+    from_set = make_car_subscription(1)
+    from_hash = make_car_subscription(2)
+    await client.sadd("subscriptions", from_set.model_dump_json())
+    await client.sadd("subscriptions:chat:1", from_set.model_dump_json())
+    repo = RedisSubscriptionRepo(client, RedisKeys("test"))
+
+    # Act
+    await repo.migrate()
+    await client.hset("subscriptions", from_hash.id, from_hash.model_dump_json())
+    await repo.migrate()
+
+    # Assert
+    assert await repo.list_chat_subscriptions(1) == [from_set]
+    assert await repo.list_chat_subscriptions(2) == [from_hash]
+    assert not await client.exists("subscriptions", "subscriptions:chat:1")
+
+
+async def test_redis_car_repo_refreshes_cars_still_in_results() -> None:
+    # Arrange
+    client = FakeRedis()
+    keys = RedisKeys("test")
+    repo = RedisCarRepo(client, keys, retention=datetime.timedelta(days=1))
+    cars = parse_ria_page_stream((FIXTURES_DIR / "ria_search_page.html").read_bytes())
+    await repo.add_cars(cars[:3], "sub")
+    # Seen long ago, but still in the results
+    await client.zadd(keys.seen_cars("sub"), {"ria|" + cars[0].car_id: 0}, xx=True)
+
+    # Act
+    res = await repo.filter_new_cars(cars[::-1], "sub")
+    await repo.add_cars(cars[3:4], "sub")
+
+    # Assert
+    assert res == cars[3:][::-1]
+    assert len(await repo.list_seen_cars("sub")) == 4
+    assert await repo.has_car(cars[0], "sub")
+
+
+async def test_redis_ticket_repo_filters_in_order() -> None:
+    # Arrange
+    now = datetime.datetime.now()
+    tickets = [
+        Ticket(id=str(idx), office_id="1", time=now + datetime.timedelta(hours=idx))
+        for idx in range(4)
+    ]
+    repo = RedisTicketRepo(FakeRedis(), RedisKeys("test"))
+    await repo.add_tickets(tickets[1:3], "sub")
+
+    # Act
+    res = await repo.filter_new_tickets(tickets[::-1], "sub")
+    other = await repo.filter_new_tickets(tickets, "other")
+
+    # Assert
+    assert res == [tickets[3], tickets[0]]
+    assert other == tickets
+
+
+async def test_in_memory_repos_filter_in_order() -> None:
+    # Arrange
+    cars = parse_ria_page_stream((FIXTURES_DIR / "ria_search_page.html").read_bytes())
+    ticket = Ticket(id="1", office_id="1", time=datetime.datetime.now())
+    car_repo = InMemoryCarRepo()
+    ticket_repo = InMemoryTicketRepo()
+    await car_repo.add_cars(cars[1:3], "sub")
+    await ticket_repo.add_tickets([ticket], "sub")
+
+    # Act
+    new_cars = await car_repo.filter_new_cars(cars[::-1], "sub")
+    new_tickets = await ticket_repo.filter_new_tickets([ticket], "sub")
+
+    # Assert
+    assert new_cars == [car for car in cars[::-1] if car not in cars[1:3]]
+    assert new_tickets == []
@@ -0,0 +1,22 @@
+from redis.crc import key_slot
+
+from car_lookup_bot.impls.redis_utils import RedisKeys
+
+
+def test_subscription_keys_share_cluster_slot() -> None:
+    # Arrange
+    keys = RedisKeys("test")
+
+    # Act
+    slots = {
+        key_slot(key.encode())
+        for key in [
+            keys.subscription("abc123"),
+            keys.seen_cars("abc123"),
+            keys.seen_tickets("abc123"),
+        ]
+    }
+
+    # Assert
+    assert len(slots) == 1
+    assert keys.subscription("abc123").startswith("test:")
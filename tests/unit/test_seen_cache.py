@@ -0,0 +1,98 @@
+import datetime
+from collections.abc import Sequence
+
+from car_lookup_bot.car_info_readers import RiaCarRecord
+from car_lookup_bot.impls.car_repo.cached_repo import CachedCarRepo
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryCarRepo
+from car_lookup_bot.impls.seen_cache import BloomFilter, SeenCache
+from car_lookup_bot.impls.subs_repo.in_memory_repo import InMemoryAuctionRepo
+from car_lookup_bot.subscriptions import CarSubscription
+from tests.conftest import ServiceFactory
+
+
+class CountingCarRepo(InMemoryCarRepo):
+    def __init__(self) -> None:
+        super().__init__()
+        self.listed: list[str] = []
+
+    async def list_seen_cars(self, subs_id: str) -> list[tuple[str, str]]:
+        self.listed.append(subs_id)
+        return await super().list_seen_cars(subs_id)
+
+
+async def test_bloom_filter_has_no_false_negatives() -> None:
+    # Arrange
+    bloom = BloomFilter(capacity=1000)
+
+    # Act
+    for idx in range(1000):
+        bloom.add(str(idx))
+
+    # Assert
+    assert all(str(idx) in bloom for idx in range(1000))
+    assert sum(str(idx) in bloom for idx in range(1000, 11000)) < 300
+
+
+async def test_seen_cache_checks_only_unknown_ids() -> None:
+    # Arrange
+    cache = SeenCache(["1", "2"], max_size=10)
+    checked: list[str] = []
+
+    async def check(items: Sequence[str]) -> list[str]:
+        checked.extend(items)
+        return [item for item in items if item != "3"]
+
+    # Act
+    res = await cache.filter_new(["4", "1", "2", "3"], str, check)
+    again = await cache.filter_new(["1", "2", "3"], str, check)
+
+    # Assert
+    assert res == ["4"]
+    assert again == []
+    assert checked == ["4", "3"]
+
+
+async def test_seen_cache_trusts_bloom_filter_misses() -> None:
+    # Arrange
+    cache = SeenCache(["1", "2", "3"], max_size=1, bloom_capacity=100)
+    checked: list[str] = []
+
+    async def check(items: Sequence[str]) -> list[str]:
+        checked.extend(items)
+        return []
+
+    # Act
+    res = await cache.filter_new(["1", "2", "new"], str, check)
+
+    # Assert
+    assert res == ["new"]
+    assert checked == ["1", "2"]
+
+
+async def test_seen_caches_are_warmed_on_start(make_service: ServiceFactory) -> None:
+    # Arrange
+    subs_repo = InMemoryAuctionRepo()
+    # Nothing listens there, polls fail right away
+    subs = [
+        CarSubscription(ria_url=f"http://127.0.0.1:9/search/?q={idx}", chat_id=idx)
+        for idx in range(3)
+    ]
+    for sub in subs:
+        await subs_repo.add_subscription(sub)
+    inner = CountingCarRepo()
+    car = RiaCarRecord("1", "Audi A6 2013", "", "", "", "2023-10-10 10:00:00", "", "")
+    await inner.add_cars([car], subs[0].id)
+    car_repo = CachedCarRepo(inner)
+    service = make_service(
+        subs_repo, car_repo, pooling_interval=datetime.timedelta(hours=1)
+    )
+
+    # Act
+    async with service:
+        listed = sorted(inner.listed)
+        new_cars = await car_repo.filter_new_cars([car], subs[0].id)
+
+    # Assert
+    assert listed == sorted(sub.id for sub in subs)
+    assert new_cars == []
+    assert len(inner.listed) == 3
@@ -0,0 +1,204 @@
+import asyncio
+import datetime
+from pathlib import Path
+
+import fakeredis
+import httpx
+from fakeredis.aioredis import FakeRedis
+
+from car_lookup_bot.http_clients import HttpClients
+from car_lookup_bot.impls.car_repo.in_memory_repo import InMemoryCarRepo
+from car_lookup_bot.impls.subs_repo.in_memory_repo import InMemoryAuctionRepo
+from car_lookup_bot.sharding import (
+    ShardCoordinator,
+    ShardEvent,
+    ShardListener,
+    rendezvous_owner,
+)
+from car_lookup_bot.subscriptions import CarSubscription, Subscription
+from tests.conftest import ServiceFactory
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+HOUR = datetime.timedelta(hours=1)
+
+
+class FakeShard:
+    def __init__(self, owned: set[str]) -> None:
+        self.owned = owned
+        self.listeners: list[ShardListener] = []
+
+    def add_listener(self, listener: ShardListener) -> None:
+        self.listeners.append(listener)
+
+    async def refresh(self) -> None:
+        pass
+
+    def owns(self, key: str) -> bool:
+        return key in self.owned
+
+    async def publish(self, event: ShardEvent) -> None:
+        pass
+
+    async def notify(self, event: ShardEvent) -> None:
+        for listener in self.listeners:
+            await listener(event)
+
+
+class RecordingCarRepo(InMemoryCarRepo):
+    def __init__(self) -> None:
+        super().__init__()
+        self.evicted: list[str] = []
+
+    def evict(self, subs_id: str) -> None:
+        self.evicted.append(subs_id)
+
+
+class RebalancingSubsRepo(InMemoryAuctionRepo):
+    """Workers change while the subscriptions are being listed"""
+
+    def __init__(self, shard: FakeShard, leaving: str) -> None:
+        super().__init__()
+        self._shard = shard
+        self._leaving = leaving
+        self.rebalanced: asyncio.Task[None] | None = None
+
+    async def list_subscriptions(self) -> list[Subscription]:
+        if self.rebalanced is None:
+            self.rebalanced = asyncio.create_task(self._rebalance())
+        return await super().list_subscriptions()
+
+    async def _rebalance(self) -> None:
+        self._shard.owned.discard(self._leaving)
+        await self._shard.notify(ShardEvent(kind="rebalance"))
+
+
+def make_car_subscriptions(count: int) -> list[CarSubscription]:
+    # Nothing listens there, polls fail right away
+    return [
+        CarSubscription(ria_url=f"http://127.0.0.1:9/search/?q={idx}", chat_id=idx)
+        for idx in range(count)
+    ]
+
+
+def test_rendezvous_owner_moves_only_keys_of_leaving_worker() -> None:
+    # Arrange
+    keys = [f"sub-{i}" for i in range(200)]
+    before = {key: rendezvous_owner(key, ["a", "b", "c"]) for key in keys}
+
+    # Act
+    after = {key: rendezvous_owner(key, ["a", "b"]) for key in keys}
+
+    # Assert
+    assert set(before.values()) == {"a", "b", "c"}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert moved
+    assert all(before[key] == "c" for key in moved)
+
+
+async def test_leader_lease_is_renewed_and_released() -> None:
+    # Arrange
+    server = fakeredis.FakeServer()
+    ttl = datetime.timedelta(seconds=0.3)
+    first = ShardCoordinator(FakeRedis(server=server), "a", lease_ttl=ttl)
+    second = ShardCoordinator(FakeRedis(server=server), "b", lease_ttl=ttl)
+
+    # Act
+    await first.refresh()
+    await second.refresh()
+    leaders = [first.is_leader, second.is_leader]
+    for _ in range(3):
+        await asyncio.sleep(0.15)
+        await first.refresh()
+    await second.refresh()
+    renewed = [first.is_leader, second.is_leader]
+    await first.__aexit__(None, None, None)
+    await second.refresh()
+
+    # Assert
+    assert leaders == [True, False]
+    assert renewed == [True, False]
+    assert second.is_leader
+    assert second.workers() == ["b"]
+
+
+async def test_concurrent_heartbeats_keep_leadership() -> None:
+    # Arrange
+    client = FakeRedis()
+    coordinator = ShardCoordinator(client, "a")
+
+    # Act
+    await asyncio.gather(coordinator.refresh(), coordinator.refresh())
+
+    # Assert
+    assert coordinator.is_leader
+    assert await client.get("louvre:workers:leader") == b"a"
+
+
+async def test_rebalance_stops_subscriptions_of_other_workers(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    subs = make_car_subscriptions(2)
+    shard = FakeShard({sub.ria_url for sub in subs})
+    subs_repo = InMemoryAuctionRepo()
+    for sub in subs:
+        await subs_repo.add_subscription(sub)
+    car_repo = RecordingCarRepo()
+
+    # Act
+    async with make_service(
+        subs_repo, car_repo, shard=shard, pooling_interval=HOUR
+    ) as service:
+        scheduled_before = service.scheduler_stats().scheduled
+        shard.owned.discard(subs[1].ria_url)
+        await shard.notify(ShardEvent(kind="rebalance"))
+        scheduled_after = service.scheduler_stats().scheduled
+
+    # Assert
+    assert scheduled_before == 2
+    assert scheduled_after == 1
+    assert car_repo.evicted == [subs[1].id]
+
+
+async def test_rebalance_during_warm_start_is_not_lost(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    subs = make_car_subscriptions(2)
+    shard = FakeShard({sub.ria_url for sub in subs})
+    subs_repo = RebalancingSubsRepo(shard, leaving=subs[1].ria_url)
+    for sub in subs:
+        await subs_repo.add_subscription(sub)
+
+    # Act
+    async with make_service(
+        subs_repo, RecordingCarRepo(), shard=shard, pooling_interval=HOUR
+    ) as service:
+        assert subs_repo.rebalanced is not None
+        await subs_repo.rebalanced
+        scheduled = service.scheduler_stats().scheduled
+
+    # Assert
+    assert scheduled == 1
+
+
+async def test_subscription_added_for_other_worker_is_evicted(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=raw))
+    sub = CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=1)
+    car_repo = RecordingCarRepo()
+    service = make_service(
+        car_repo=car_repo,
+        shard=FakeShard(set()),
+        http_clients=HttpClients(transport=transport),
+    )
+
+    # Act
+    await service.add_subscription(sub)
+
+    # Assert
+    assert car_repo.evicted == [sub.id]
+    assert service.scheduler_stats().scheduled == 0
@@ -0,0 +1,107 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from car_lookup_bot.car_info_readers import parse_ria_page_stream
+from car_lookup_bot.impls.car_repo.sqlite_repo import SqliteCarRepo
+from car_lookup_bot.impls.sqlite_utils import SqliteDatabase
+from car_lookup_bot.impls.subs_repo.sqlite_repo import SqliteSubscriptionRepo
+from car_lookup_bot.subscriptions import CarSubscription
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+
+
+async def test_sqlite_subscription_repo_persists_subscriptions(tmp_path: Path) -> None:
+    # Arrange
+    path = str(tmp_path / "bot.sqlite3")
+    subs = [
+        CarSubscription(ria_url=f"https://auto.ria.com/search/?page={idx}", chat_id=1)
+        for idx in range(3)
+    ]
+
+    # Act
+    async with SqliteDatabase(path) as db:
+        repo = SqliteSubscriptionRepo(db)
+        await asyncio.gather(*(repo.add_subscription(sub) for sub in subs))
+        await repo.drop_subscription(subs[0])
+    async with SqliteDatabase(path) as db:
+        repo = SqliteSubscriptionRepo(db)
+        chat_subs = await repo.list_chat_subscriptions(1)
+        other_subs = await repo.list_chat_subscriptions(2)
+
+    # Assert
+    assert sorted(sub.id for sub in chat_subs) == sorted(sub.id for sub in subs[1:])
+    assert other_subs == []
+
+
+async def test_sqlite_car_repo_filters_seen_cars(tmp_path: Path) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    cars = parse_ria_page_stream(raw)
+
+    # Act
+    async with SqliteDatabase(str(tmp_path / "bot.sqlite3")) as db:
+        repo = SqliteCarRepo(db)
+        await repo.add_cars(cars[:5], "sub")
+        res = await repo.filter_new_cars(cars, "sub")
+        other = await repo.filter_new_cars(cars, "other")
+
+    # Assert
+    assert res == cars[5:]
+    assert other == cars
+
+
+async def test_sqlite_failed_write_does_not_affect_others(tmp_path: Path) -> None:
+    # Arrange
+    def insert(conn: sqlite3.Connection, subs_id: str) -> None:
+        conn.execute(
+            "INSERT INTO subscriptions (id, chat_id, data) VALUES (?, 1, '{}')",
+            (subs_id,),
+        )
+
+    # Act
+    async with SqliteDatabase(str(tmp_path / "bot.sqlite3")) as db:
+        res = await asyncio.gather(
+            db.write(lambda conn: insert(conn, "a")),
+            db.write(lambda conn: insert(conn, "a")),
+            db.write(lambda conn: insert(conn, "b")),
+            return_exceptions=True,
+        )
+        ids = await db.read(
+            lambda conn: conn.execute("SELECT id FROM subscriptions").fetchall()
+        )
+
+    # Assert
+    assert res[0] is None and res[2] is None
+    assert isinstance(res[1], sqlite3.IntegrityError)
+    assert sorted(ids) == [("a",), ("b",)]
+
+
+async def test_sqlite_failed_commit_fails_all_writes(tmp_path: Path) -> None:
+    # Arrange
+    schema = """
+    PRAGMA foreign_keys = ON;
+    CREATE TABLE parents (id INTEGER PRIMARY KEY);
+    CREATE TABLE children (
+        parent_id INTEGER REFERENCES parents (id) DEFERRABLE INITIALLY DEFERRED
+    );
+    """
+
+    # Act
+    async with SqliteDatabase(str(tmp_path / "bot.sqlite3")) as db:
+        await db.read(lambda conn: conn.executescript(schema))
+        failed = asyncio.gather(
+            db.write(lambda conn: conn.execute("INSERT INTO parents VALUES (1)")),
+            db.write(lambda conn: conn.execute("INSERT INTO children VALUES (2)")),
+        )
+        with pytest.raises(sqlite3.IntegrityError):
+            await failed
+        await db.write(lambda conn: conn.execute("INSERT INTO parents VALUES (3)"))
+        parents = await db.read(
+            lambda conn: conn.execute("SELECT id FROM parents").fetchall()
+        )
+
+    # Assert
+    assert parents == [(3,)]
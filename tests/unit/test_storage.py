@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import httpx
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from car_lookup_bot.bot import make_redis_storage
+from car_lookup_bot.car_info_readers import parse_ria_page_stream
+from car_lookup_bot.http_clients import HttpClients
+from car_lookup_bot.impls.car_repo.redis_repo import RedisWatermarkCarRepo
+from car_lookup_bot.impls.redis_utils import RedisKeys
+from car_lookup_bot.impls.subs_repo.redis_repo import RedisSubscriptionRepo
+from car_lookup_bot.maintenance import build_car_watermarks
+from car_lookup_bot.settings import Settings
+from car_lookup_bot.subscriptions import CarSubscription
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+
+
+async def make_legacy_data(client: FakeRedis) -> CarSubscription:
+    sub = CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=1)
+    await RedisSubscriptionRepo(client, RedisKeys("test")).add_subscription(sub)
+    await client.sadd("cars", f"ria|1|{sub.id}", "ria|2|dropped")
+    return sub
+
+
+async def test_redis_storage_moves_legacy_seen_cars_on_start() -> None:
+    # Arrange
+    client = FakeRedis()
+    sub = await make_legacy_data(client)
+
+    settings = Settings(REDIS_KEY_PREFIX="test", REDIS_MIGRATE_LEGACY=True)
+
+    # Act
+    storage = await make_redis_storage(settings, client)
+    seen = await storage.car_repo.list_seen_cars(sub.id)
+
+    # Assert
+    assert seen == [("ria", "1")]
+    assert not await client.exists("cars")
+
+
+async def test_redis_storage_requires_built_watermarks() -> None:
+    # Arrange
+    client = FakeRedis()
+    await make_legacy_data(client)
+    settings = Settings(
+        REDIS_KEY_PREFIX="test",
+        REDIS_MIGRATE_LEGACY=True,
+        CAR_DEDUPE_STRATEGY="watermark",
+    )
+
+    # Act
+    with pytest.raises(RuntimeError):
+        await make_redis_storage(settings, client)
+
+    # Assert
+    assert not await client.exists("cars")
+
+
+async def test_redis_storage_keeps_legacy_keys_of_other_deployments() -> None:
+    # Arrange
+    client = FakeRedis()
+    await make_legacy_data(client)
+
+    # Act
+    with pytest.raises(RuntimeError):
+        await make_redis_storage(Settings(REDIS_KEY_PREFIX="other"), client)
+
+    # Assert
+    assert await client.scard("cars") == 2
+
+
+async def test_car_watermarks_are_built_without_seen_listings() -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    client = FakeRedis()
+    keys = RedisKeys("test")
+    subs_repo = RedisSubscriptionRepo(client, keys)
+    changed = CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=1)
+    dead = CarSubscription(ria_url="https://auto.ria.com/gone/", chat_id=1)
+    for sub in (changed, dead):
+        await subs_repo.add_subscription(sub)
+        # Seen listing that is not on the current page
+        await client.zadd(keys.seen_cars(sub.id), {b"ria|unlisted": 1})
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/gone/":
+            return httpx.Response(404)
+        return httpx.Response(200, content=raw)
+
+    http_clients = HttpClients(transport=httpx.MockTransport(handler))
+    settings = Settings(REDIS_KEY_PREFIX="test", CAR_DEDUPE_STRATEGY="watermark")
+
+    # Act
+    failed = await build_car_watermarks(settings, client, http_clients)
+    await make_redis_storage(settings, client)
+
+    # Assert
+    watermark_repo = RedisWatermarkCarRepo(client, keys)
+    assert failed == [dead.id]
+    assert await watermark_repo.missing_watermarks([changed.id, dead.id]) == []
+    cars = parse_ria_page_stream(raw)
+    assert await watermark_repo.filter_new_cars(cars, changed.id) == []
@@ -0,0 +1,331 @@
+import asyncio
+import datetime
+from collections.abc import AsyncIterator, Sequence
+from pathlib import Path
+
+import httpx
+
+from car_lookup_bot.car_info_readers import RiaCarReader, parse_ria_page_stream
+from car_lookup_bot.exam_tickets import TickerReaderConf, Ticket
+from car_lookup_bot.impls.subs_repo.in_memory_repo import InMemoryAuctionRepo
+from car_lookup_bot.subscriptions import (
+    CarSearchGroup,
+    CarSubscription,
+    PollScheduler,
+    Subscription,
+    TicketSubscription,
+    load_subscription,
+)
+from tests.conftest import ServiceFactory
+
+FIXTURES_DIR = Path(__file__).parent.parent / "fixtures"
+FLUSH_INTERVAL = datetime.timedelta(seconds=0.05)
+
+
+class RecordingSubsRepo(InMemoryAuctionRepo):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writes: list[list[str]] = []
+
+    async def update_subscription(self, subscription: Subscription) -> None:
+        self.writes.append([subscription.id])
+        await super().update_subscription(subscription)
+
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        self.writes.append([sub.id for sub in subscriptions])
+        await super().update_subscriptions(subscriptions)
+
+
+class FlakySubsRepo(RecordingSubsRepo):
+    """The first batch write waits for `release` and fails"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.failures = 1
+
+    async def update_subscriptions(self, subscriptions: Sequence[Subscription]) -> None:
+        self.started.set()
+        await self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Storage is down")
+        await super().update_subscriptions(subscriptions)
+
+
+class FakeTicketReader:
+    def __init__(self, webchsid2: str) -> None:
+        self._webchsid2 = webchsid2
+        self._tickets: list[Ticket] = []
+
+    def get_current_webchsid2(self) -> str:
+        return self._webchsid2
+
+    async def get_tickets(self) -> AsyncIterator[Ticket]:
+        for ticket in self._tickets:
+            yield ticket
+
+
+def make_ticket_subscription(office_id: str) -> TicketSubscription:
+    day = datetime.date(2023, 10, 10)
+    return TicketSubscription(
+        conf=TickerReaderConf(
+            identity="i",
+            csrf="c",
+            webchsid2="w",
+            csrf_header="h",
+            office_id=office_id,
+            date_start=day,
+            date_end=day,
+        ),
+        chat_id=1,
+    )
+
+
+async def test_poll_scheduler_repeats_polls() -> None:
+    # Arrange
+    calls: list[str] = []
+
+    async def poll() -> None:
+        calls.append("a")
+
+    # Act
+    async with PollScheduler(datetime.timedelta(seconds=0.05)) as scheduler:
+        scheduler.schedule("a", "example.com", poll, delay=0)
+        await asyncio.sleep(0.18)
+        scheduler.unschedule("a")
+        stats = scheduler.stats()
+
+    # Assert
+    assert len(calls) >= 3
+    assert stats.scheduled == 0
+
+
+async def test_poll_scheduler_respects_host_limit() -> None:
+    # Arrange
+    active = 0
+    max_active = 0
+
+    async def poll() -> None:
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+
+    # Act
+    async with PollScheduler(
+        datetime.timedelta(seconds=10), host_limits={"example.com": 2}
+    ) as scheduler:
+        for idx in range(6):
+            scheduler.schedule(str(idx), "example.com", poll, delay=0)
+        await asyncio.sleep(0.1)
+
+    # Assert
+    assert max_active == 2
+
+
+def test_load_subscription_tagged_and_legacy() -> None:
+    # Arrange
+    car = CarSubscription(ria_url="https://auto.ria.com/search/", chat_id=1)
+    legacy = b'{"id": "abc", "chat_id": 2, "conf": {"identity": "i", "csrf": "c", '
+    legacy += b'"webchsid2": "w", "csrf_header": "h", "office_id": "1", '
+    legacy += b'"date_start": "2023-10-10", "date_end": "2023-10-11"}}'
+
+    # Act
+    loaded_car = load_subscription(car.model_dump_json())
+    loaded_legacy = load_subscription(legacy)
+
+    # Assert
+    assert loaded_car == car
+    assert isinstance(loaded_legacy, TicketSubscription)
+    assert loaded_legacy.id == "abc"
+
+
+async def test_subscription_updates_are_batched_until_session_rotates(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    repo = RecordingSubsRepo()
+    service = make_service(repo)
+    subs = [make_ticket_subscription(str(idx)) for idx in range(3)]
+
+    # Act
+    async with service:
+        for sub in subs[:2]:
+            reader = FakeTicketReader("w")
+            await service._ticket_poll(sub, reader)  # type: ignore[arg-type]
+        writes_before_exit = list(repo.writes)
+        rotated = FakeTicketReader("rotated")
+        await service._ticket_poll(subs[2], rotated)  # type: ignore[arg-type]
+        writes_after_rotation = list(repo.writes)
+
+    # Assert
+    assert writes_before_exit == []
+    assert writes_after_rotation == [[subs[2].id]]
+    assert repo.writes == [[subs[2].id], [subs[0].id, subs[1].id]]
+    assert subs[2].conf.webchsid2 == "rotated"
+
+
+async def test_failed_subscription_flush_is_retried(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    repo = FlakySubsRepo()
+    repo.release.set()
+    sub = make_ticket_subscription("1")
+    await repo.add_subscription(sub)
+
+    # Act
+    async with make_service(repo, subs_flush_interval=FLUSH_INTERVAL) as service:
+        await service._ticket_poll(sub, FakeTicketReader("w"))  # type: ignore[arg-type]
+        await asyncio.sleep(0.2)
+
+    # Assert
+    assert repo.failures == 0
+    assert repo.writes == [[sub.id]]
+
+
+async def test_subscription_dropped_during_flush_is_not_written_back(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    repo = FlakySubsRepo()
+    sub = make_ticket_subscription("1")
+    await repo.add_subscription(sub)
+
+    # Act
+    async with make_service(repo, subs_flush_interval=FLUSH_INTERVAL) as service:
+        await service._ticket_poll(sub, FakeTicketReader("w"))  # type: ignore[arg-type]
+        await asyncio.wait_for(repo.started.wait(), timeout=1)
+        await service.drop_subscription(sub)
+        repo.release.set()
+        await asyncio.sleep(0.2)
+
+    # Assert
+    assert repo.failures == 0
+    assert repo.writes == []
+    assert sub.id not in repo.subs
+
+
+async def test_ticket_readers_are_closed_when_processing_stops(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    repo = RecordingSubsRepo()
+    dropped = make_ticket_subscription("1")
+    kept = make_ticket_subscription("2")
+
+    # Act
+    async with make_service(repo, subs_flush_interval=FLUSH_INTERVAL) as service:
+        service._start_processing(dropped, delay=3600)
+        service._start_processing(kept, delay=3600)
+        dropped_reader = service._ticket_readers[dropped.id]
+        kept_reader = service._ticket_readers[kept.id]
+        await service.drop_subscription(dropped)
+        await asyncio.sleep(0)
+        dropped_closed = dropped_reader._client.is_closed
+        kept_open = not kept_reader._client.is_closed
+
+    # Assert
+    assert dropped_closed
+    assert kept_open
+    assert kept_reader._client.is_closed
+
+
+async def test_car_poll_refetches_page_after_failed_crawl(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    statuses = [500]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("page") == "1":
+            return httpx.Response(statuses.pop(0) if statuses else 200, content=raw)
+        if request.headers.get("if-none-match") == "v1":
+            return httpx.Response(304)
+        return httpx.Response(200, content=raw, headers={"etag": "v1"})
+
+    url = "https://auto.ria.com/search/"
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    reader = RiaCarReader(url, client)
+    sub = CarSubscription(ria_url=url, chat_id=1)
+    group = CarSearchGroup(url)
+    group.members[sub.id] = sub
+    group.processed_at = asyncio.get_running_loop().time()
+    service = make_service()
+
+    # Act
+    await service._car_poll(group, reader)
+    await service._car_poll(group, reader)
+    hits_after_retry = service.car_poll_stats().fingerprint_hits
+    await service._car_poll(group, reader)
+
+    # Assert
+    cars = parse_ria_page_stream(raw)
+    assert hits_after_retry == 0
+    assert await service._car_repo.filter_new_cars(cars, sub.id) == []
+    # Unchanged page of a processed subscription is short-circuited
+    assert service.car_poll_stats().fingerprint_hits == 1
+
+
+async def test_car_poll_sends_pages_read_before_crawl_failure(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("page") == "1":
+            return httpx.Response(500)
+        return httpx.Response(200, content=raw)
+
+    url = "https://auto.ria.com/search/"
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    sub = CarSubscription(ria_url=url, chat_id=1)
+    group = CarSearchGroup(url)
+    group.members[sub.id] = sub
+    service = make_service()
+
+    # Act
+    await service._car_poll(group, RiaCarReader(url, client))
+
+    # Assert
+    cars = parse_ria_page_stream(raw)
+    assert await service._car_repo.filter_new_cars(cars, sub.id) == []
+    # Not marked as processed, so the page is crawled again
+    assert sub.results_fingerprint is None
+
+
+async def test_car_poll_skips_members_dropped_during_poll(
+    make_service: ServiceFactory,
+) -> None:
+    # Arrange
+    raw = (FIXTURES_DIR / "ria_search_page.html").read_bytes()
+    url = "https://auto.ria.com/search/"
+    repo = InMemoryAuctionRepo()
+    service = make_service(repo)
+    kept = CarSubscription(ria_url=url, chat_id=1)
+    dropped = CarSubscription(ria_url=url, chat_id=2)
+    for sub in (kept, dropped):
+        await repo.add_subscription(sub)
+        service._start_processing(sub)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("page") == "1":
+            await service.drop_subscription(dropped)
+        return httpx.Response(200, content=raw)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    group = service._car_groups[url]
+
+    # Act
+    await service._car_poll(group, RiaCarReader(url, client))
+
+    # Assert
+    cars = parse_ria_page_stream(raw)
+    assert await service._car_repo.filter_new_cars(cars, kept.id) == []
+    assert await service._car_repo.filter_new_cars(cars, dropped.id) == cars
+    assert service._notifications.pending_count() == len(cars)